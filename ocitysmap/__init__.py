@@ -102,7 +102,7 @@ from .indexlib.commons import IndexDoesNotFitError, IndexEmptyError
 from .layoutlib.abstract_renderer import Renderer
 from .layoutlib import renderers
 from .layoutlib import commons
-from .stylelib import Stylesheet
+from .stylelib import Stylesheet, icon_cache
 
 LOG = logging.getLogger('ocitysmap')
 
@@ -133,6 +133,7 @@ class RenderingConfiguration:
         self.ins_pgs_bef_idx = 0 # skip x pages before index (to manually insert pages afterwards)
         self.multipg_def_scale = Renderer.DEFAULT_MULTIPAGE_SCALE # multipage: default scale
         self.multipg_frst_map_page = -1 # set page number x as first map page
+        self.multipg_processes = 1 # multipage: processes drawing the page maps
 
         self.paper_width_mm  = None
         self.paper_height_mm = None
@@ -145,11 +146,18 @@ class RenderingConfiguration:
         # Setup by OCitySMap::render() from language field:
         self.i18n            = None # i18n object
 
+        # Setup by OCitySMap::render(): function opening a new database
+        # connection, for the data fetched on other threads
+        self.db_connect      = None
+
         # Extra upload files
         self.poi_file        = None
         self.gpx_file        = None
         self.umap_file       = None
 
+        # Leave out the POI markers mostly hiding the ones already drawn
+        self.poi_marker_culling = False
+
         # custom QRcode text
         self.qrcode_text     = None
 
@@ -163,6 +171,8 @@ class OCitySMap:
 
     DEFAULT_RENDERING_PNG_DPI = 300
 
+    OUTPUT_FORMATS = ('png', 'svg', 'svgz', 'pdf', 'ps', 'ps.gz')
+
     STYLESHEET_REGISTRY = []
 
     OVERLAY_REGISTRY = []
@@ -212,6 +222,31 @@ class OCitySMap:
         self.OVERLAY_REGISTRY = Stylesheet.create_all_from_config(self._parser, "overlays")
         LOG.debug('Found %d Mapnik overlay styles.' % len(self.OVERLAY_REGISTRY))
 
+        # Cache of the icons of the uMap overlays
+        try:
+            icon_cache_dir = self._parser.get('rendering', 'umap_icon_cache')
+        except (configparser.NoSectionError, configparser.NoOptionError):
+            icon_cache_dir = icon_cache.DEFAULT_DIRECTORY
+        try:
+            icon_cache_size = self._parser.getint('rendering', 'umap_icon_cache_size_mb') * 1024 * 1024
+        except (configparser.NoSectionError, configparser.NoOptionError, ValueError):
+            icon_cache_size = icon_cache.DEFAULT_MAX_BYTES
+        icon_cache.configure(icon_cache_dir, icon_cache_size)
+
+        # Processes drawing the map pages of the multi-page renderer
+        try:
+            self._multipage_processes = \
+                max(1, self._parser.getint('rendering', 'multipage_processes'))
+        except (configparser.NoSectionError, configparser.NoOptionError, ValueError):
+            self._multipage_processes = 1
+
+        # Culling of the overlapping POI markers
+        try:
+            self._poi_marker_culling = \
+                self._parser.getboolean('rendering', 'poi_marker_culling')
+        except (configparser.NoSectionError, configparser.NoOptionError, ValueError):
+            self._poi_marker_culling = False
+
         if self._parser.has_section('paper_sizes'):
             self.PAPER_SIZES = []
             for key in self._parser['paper_sizes']:
@@ -240,9 +275,12 @@ class OCitySMap:
 
     @property
     def _db(self, name='default'):
-        if name in self.__dbs:
-            return self.__dbs[name]
+        if name not in self.__dbs:
+            self.__dbs[name] = self._connect(name)
+        return self.__dbs[name]
 
+    def _connect(self, name='default'):
+        """Open a new connection to the database of the given name."""
         # Database connection
         if name == 'default':
             datasource = dict(self._parser.items('datasource'))
@@ -275,8 +313,6 @@ class OCitySMap:
         except (configparser.NoOptionError, ValueError):
             timeout = OCitySMap.DEFAULT_REQUEST_TIMEOUT_MIN
         self._set_request_timeout(db, timeout)
-
-        self.__dbs[name] = db
         return db
 
     def _verify_db(self, db):
@@ -486,6 +522,9 @@ SELECT ST_AsText(ST_LongestLine(
         output_formats = map(lambda x: x.lower(), output_formats)
         config.i18n = i18n.install_translation(config.language,
                                                self._locale_path)
+        config.db_connect = self._connect
+        config.multipg_processes = self._multipage_processes
+        config.poi_marker_culling = self._poi_marker_culling
 
         LOG.info('Rendering with renderer %s in language: %s (rtl: %s).' %
                  (renderer_name, config.i18n.language_code(),
@@ -562,13 +601,16 @@ SELECT ST_AsText(ST_LongestLine(
             # Prepare the generic renderer
             renderer_cls = renderers.get_renderer_class_by_name(renderer_name)
 
-            # Perform the actual rendering to the Cairo devices
+            # Perform the actual rendering to the Cairo devices. Single
+            # page renderings are only drawn once per resolution, and
+            # replayed onto the output surfaces of the other formats.
+            recordings = {}
             for output_format in output_formats:
                 output_filename = '%s.%s' % (file_prefix, output_format)
                 try:
                     self._render_one(config, tmpdir, renderer_cls,
-                                     output_format, output_filename, osm_date,
-                                     file_prefix)
+                                     output_format, output_filename,
+                                     osm_date, file_prefix, recordings)
                 except IndexDoesNotFitError:
                     LOG.exception("The actual font metrics probably don't "
                                   "match those pre-computed by the renderer's"
@@ -578,33 +620,99 @@ SELECT ST_AsText(ST_LongestLine(
         finally:
             self._cleanup_tempdir(tmpdir)
 
+    def _get_output_dpi(self, config, output_format):
+        """Return the resolution to render the given output format at."""
+        dpi = layoutlib.commons.PT_PER_INCH
+        if output_format != 'png':
+            return dpi
+
+        try:
+            dpi = int(self._parser.get('rendering', 'png_dpi'))
+        except configparser.NoOptionError:
+            dpi = OCitySMap.DEFAULT_RENDERING_PNG_DPI
+
+        w_px = int(layoutlib.commons.convert_mm_to_dots(config.paper_width_mm, dpi))
+        h_px = int(layoutlib.commons.convert_mm_to_dots(config.paper_height_mm, dpi))
+
+        if w_px > 25000 or h_px > 25000:
+            LOG.warning("%d DPI to high for this paper size, using 72dpi instead" % dpi)
+            dpi = layoutlib.commons.PT_PER_INCH
+
+        return dpi
+
     def _render_one(self, config, tmpdir, renderer_cls,
-                    output_format, output_filename, osm_date, file_prefix):
+                    output_format, output_filename, osm_date, file_prefix,
+                    recordings):
+        """Render the job to the given output format.
+
+        Renderings that fit on a single page are drawn only once per
+        resolution into a cairo.RecordingSurface, kept in recordings, and
+        replayed onto the output surface. The font metrics used to lay out
+        the page are then the same for all the output formats, raster ones
+        included. Each output format gets its own renderer, which draws at
+        most once.
+
+        Args:
+            recordings (dict): resolution -> RecordingSurface of the
+                renderings recorded so far.
+        """
 
         LOG.debug('Rendering to %s format...' % output_format.upper())
 
-        dpi = layoutlib.commons.PT_PER_INCH
+        if output_format == 'csv':
+            # We don't render maps into CSV.
+            return
+        if output_format not in self.OUTPUT_FORMATS:
+            raise ValueError( \
+                'Unsupported output format: %s!' % output_format.upper())
 
+        dpi = self._get_output_dpi(config, output_format)
         config.output_format = output_format
 
         renderer = renderer_cls(self._db, config, tmpdir, dpi, file_prefix)
 
-        if output_format == 'png':
+        if not renderer.renders_single_page(output_format):
+            surface = self._create_surface(renderer, config, output_format,
+                                           output_filename, dpi)
             try:
-                dpi = int(self._parser.get('rendering', 'png_dpi'))
-            except configparser.NoOptionError:
-                dpi = OCitySMap.DEFAULT_RENDERING_PNG_DPI
-
-            w_px = int(layoutlib.commons.convert_mm_to_dots(config.paper_width_mm, dpi))
-            h_px = int(layoutlib.commons.convert_mm_to_dots(config.paper_height_mm, dpi))
+                renderer.render(surface, dpi, osm_date)
+            finally:
+                renderer.close()
+            self._finish_surface(surface, output_format, output_filename)
+            return
 
-            if w_px > 25000 or h_px > 25000:
-                LOG.warning("%d DPI to high for this paper size, using 72dpi instead" % dpi)
-                dpi = layoutlib.commons.PT_PER_INCH
+        w_dots = layoutlib.commons.convert_pt_to_dots(renderer.paper_width_pt, dpi)
+        h_dots = layoutlib.commons.convert_pt_to_dots(renderer.paper_height_pt, dpi)
+        recording = recordings.get(dpi)
+        if recording is None:
+            LOG.debug("Recording the rendering at %ddpi..." % dpi)
+            recording = cairo.RecordingSurface(cairo.CONTENT_COLOR_ALPHA,
+                                               cairo.Rectangle(0, 0, w_dots, h_dots))
+            try:
+                renderer.render(recording, dpi, osm_date)
+            finally:
+                renderer.close()
+            recordings[dpi] = recording
 
-            # as the dpi value may have changed we need to re-create the renderer
-            renderer = renderer_cls(self._db, config, tmpdir, dpi, file_prefix)
-                
+        if output_format == 'png':
+            LOG.debug("Rendering PNG into %dpx x %dpx area at %ddpi ..."
+                      % (w_dots, h_dots, dpi))
+            surface = cairo.ImageSurface(cairo.FORMAT_ARGB32,
+                                         int(w_dots), int(h_dots))
+        else:
+            surface = self._create_surface(renderer, config, output_format,
+                                           output_filename, dpi)
+
+        ctx = cairo.Context(surface)
+        ctx.set_source_surface(recording, 0, 0)
+        ctx.paint()
+        del ctx
+        self._finish_surface(surface, output_format, output_filename)
+
+    def _create_surface(self, renderer, config, output_format,
+                        output_filename, dpi):
+        """Create the Cairo surface for the given output format."""
+        if output_format == 'png':
             # As strange as it may seem, we HAVE to use a vector
             # device here and not a raster device such as
             # ImageSurface. Because, for some reason, with
@@ -648,15 +756,9 @@ SELECT ST_AsText(ST_LongestLine(
         elif output_format == 'ps.gz':
             surface = cairo.PSSurface(gzip.GzipFile(output_filename, 'wb'),
                                       renderer.paper_width_pt, renderer.paper_height_pt)
-        elif output_format == 'csv':
-            # We don't render maps into CSV.
-            return
-        else:
-            raise ValueError( \
-                'Unsupported output format: %s!' % output_format.upper())
-
-        renderer.render(surface, dpi, osm_date)
+        return surface
 
+    def _finish_surface(self, surface, output_format, output_filename):
         LOG.debug('Writing %s...' % output_filename)
 
         if output_format == 'png':
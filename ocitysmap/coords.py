@@ -24,6 +24,7 @@
 
 import math
 
+import numpy
 import shapely.wkt
 
 import xml.sax
@@ -40,6 +41,41 @@ _MAPNIK_PROJECTION = "+proj=merc +a=6378137 +b=6378137 +lat_ts=0.0 " \
 
 EARTH_RADIUS = 6370986 # meters
 
+# Sphere radius of the _MAPNIK_PROJECTION Web Mercator projection
+MERCATOR_RADIUS = 6378137.0 # meters
+
+def mercator_forward(lons, lats):
+    """Project WGS84 longitudes and latitudes to _MAPNIK_PROJECTION
+    meters. Works on scalars as well as on whole sequences/arrays of
+    coordinates, and returns the (x, y) arrays."""
+    lons = numpy.radians(numpy.asarray(lons, dtype=float))
+    lats = numpy.radians(numpy.asarray(lats, dtype=float))
+    return (MERCATOR_RADIUS * lons,
+            MERCATOR_RADIUS * numpy.log(numpy.tan(math.pi/4 + lats/2)))
+
+def mercator_inverse(xs, ys):
+    """Inverse of mercator_forward(): returns the (longitudes, latitudes)
+    of the given _MAPNIK_PROJECTION coordinates."""
+    xs = numpy.asarray(xs, dtype=float)
+    ys = numpy.asarray(ys, dtype=float)
+    return (numpy.degrees(xs / MERCATOR_RADIUS),
+            numpy.degrees(2 * numpy.arctan(numpy.exp(ys / MERCATOR_RADIUS))
+                          - math.pi/2))
+
+def project_envelope(bbox):
+    """Project the given BoundingBox into a _MAPNIK_PROJECTION
+    mapnik.Box2d envelope."""
+    xs, ys = mercator_forward([bbox.get_left(), bbox.get_right()],
+                              [bbox.get_bottom(), bbox.get_top()])
+    return mapnik.Box2d(xs[0], ys[0], xs[1], ys[1])
+
+def inverse_envelope(envelope):
+    """Inverse the given _MAPNIK_PROJECTION envelope back to a 4326
+    BoundingBox."""
+    lons, lats = mercator_inverse([envelope.minx, envelope.maxx],
+                                  [envelope.miny, envelope.maxy])
+    return BoundingBox(lats[0], lons[0], lats[1], lons[1])
+
 # XML tag handler for parsing GPX files
 class GpxElementHandler(xml.sax.ContentHandler):
   min_lat = 90
@@ -127,7 +163,9 @@ class BoundingBox:
 
     @staticmethod
     def parse_gpx(gpx_file):
-        """ Returs a BoundingBox object extraced from GPX file contents"""
+        """ Returs a BoundingBox object extraced from GPX file contents,
+        to choose the map area before rendering. The GPX overlay finds the
+        bounding box of its file itself (see GpxStylesheet.bbox)."""
         # create GPX XML parser
         parser = xml.sax.make_parser()
         handler = GpxElementHandler()
@@ -158,6 +196,11 @@ class BoundingBox:
     def get_top_left(self):
         return (self._lat1, self._long1)
 
+    def contains(self, lat, long_):
+        """Returns True if the given lat/long point lies inside the bbox."""
+        return (self._lat2 <= lat <= self._lat1
+                and self._long1 <= long_ <= self._long2)
+
     def get_bottom_right(self):
         return (self._lat2, self._long2)
 
@@ -249,13 +292,9 @@ class BoundingBox:
         return (int(math.ceil(pix_y)), int(math.ceil(pix_x)))
 
     def to_mercator(self):
-        envelope = mapnik.Box2d(self.get_top_left()[1],
-                                self.get_top_left()[0],
-                                self.get_bottom_right()[1],
-                                self.get_bottom_right()[0])
-        _proj = mapnik.Projection(_MAPNIK_PROJECTION)
-        bottom_left = _proj.forward(mapnik.Coord(envelope.minx, envelope.miny))
-        top_right = _proj.forward(mapnik.Coord(envelope.maxx, envelope.maxy))
+        envelope = project_envelope(self)
+        bottom_left = mapnik.Coord(envelope.minx, envelope.miny)
+        top_right = mapnik.Coord(envelope.maxx, envelope.maxy)
         top_left = mapnik.Coord(bottom_left.x, top_right.y)
         bottom_right = mapnik.Coord(top_right.x, bottom_left.y)
         return (bottom_right, bottom_left, top_left, top_right)
@@ -23,13 +23,51 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import re
+import collections.abc
 import gettext
+import functools
+import importlib
+
+def _memoize(method):
+    """Cache the results of a single argument method on the i18n object.
+    The language object lives as long as the rendering job, so does the
+    cache."""
+    cache_name = '_memo_' + method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, s):
+        cache = self.__dict__.setdefault(cache_name, {})
+        try:
+            return cache[s]
+        except KeyError:
+            result = cache[s] = method(self, s)
+            return result
+    return wrapper
+
+def _unaccent_table(replacements):
+    """Build a str.translate() table from a {characters: replacement}
+    dict. Both cases of each character are mapped, like the
+    case-insensitive regexps used before."""
+    table = {}
+    for chars, replacement in replacements.items():
+        for c in chars:
+            for variant in (c, c.lower(), c.upper()):
+                if len(variant) == 1:
+                    table[ord(variant)] = replacement
+    return table
+
+# gettext catalogs already loaded by this process, by (language, path)
+_translations = {}
 
 def _install_language(language, locale_path):
-    t = gettext.translation(domain='ocitysmap',
-                            localedir=locale_path,
-                            languages=[language],
-                            fallback=True)
+    key = (language, locale_path)
+    t = _translations.get(key)
+    if t is None:
+        t = gettext.translation(domain='ocitysmap',
+                                localedir=locale_path,
+                                languages=[language],
+                                fallback=True)
+        _translations[key] = t
     t.install()
 
 class i18n:
@@ -47,7 +85,14 @@ class i18n:
     def isrtl(self):
         return False
 
+    # str.translate() table used to fold accented letters for the index,
+    # only non-ASCII letters are expected in it
+    UNACCENT_TABLE = {}
+
+    @_memoize
     def upper_unaccent_string(self, s):
+        if self.UNACCENT_TABLE and not s.isascii():
+            s = s.translate(self.UNACCENT_TABLE)
         return s.upper()
 
     def number_category_name(self):
@@ -99,112 +144,146 @@ class i18n_generic(i18n):
     def first_letter_equal(self, a, b):
         return a == b
 
-from .ar    import i18n_ar_generic
-from .al    import i18n_al_generic
-from .ast   import i18n_ast_generic
-from .be    import i18n_be_generic
-from .ca    import i18n_ca_generic
-from .de    import i18n_de_generic
-from .es    import i18n_es_generic
-from .fa    import i18n_fa_generic
-from .fr    import i18n_fr_generic
-from .hr    import i18n_hr_HR
-from .it    import i18n_it_generic
-from .nl    import i18n_nl_generic
-from .pl    import i18n_pl_generic
-from .pt_br import i18n_pt_br_generic
-from .ro    import i18n_ro_generic
-from .ru    import i18n_ru_generic
-from .tr    import i18n_tr_generic
+# Language classes are only imported when first needed, see
+# get_language_class()
+_LANGUAGE_MODULES = {
+    'i18n_ar_generic': 'ar',
+    'i18n_al_generic': 'al',
+    'i18n_ast_generic': 'ast',
+    'i18n_be_generic': 'be',
+    'i18n_ca_generic': 'ca',
+    'i18n_de_generic': 'de',
+    'i18n_es_generic': 'es',
+    'i18n_fa_generic': 'fa',
+    'i18n_fr_generic': 'fr',
+    'i18n_hr_HR': 'hr',
+    'i18n_it_generic': 'it',
+    'i18n_nl_generic': 'nl',
+    'i18n_pl_generic': 'pl',
+    'i18n_pt_br_generic': 'pt_br',
+    'i18n_ro_generic': 'ro',
+    'i18n_ru_generic': 'ru',
+    'i18n_tr_generic': 'tr',
+}
+
+# Name of the language class of each locale, see language_class_map
+_LANGUAGE_CLASS_NAMES = {
+    'fr_BE.UTF-8': 'i18n_fr_generic',
+    'fr_FR.UTF-8': 'i18n_fr_generic',
+    'fr_CA.UTF-8': 'i18n_fr_generic',
+    'fr_CH.UTF-8': 'i18n_fr_generic',
+    'fr_LU.UTF-8': 'i18n_fr_generic',
+    'en_AG': 'i18n_generic',
+    'en_AU.UTF-8': 'i18n_generic',
+    'en_BW.UTF-8': 'i18n_generic',
+    'en_CA.UTF-8': 'i18n_generic',
+    'en_DK.UTF-8': 'i18n_generic',
+    'en_GB.UTF-8': 'i18n_generic',
+    'en_HK.UTF-8': 'i18n_generic',
+    'en_IE.UTF-8': 'i18n_generic',
+    'en_IN': 'i18n_generic',
+    'en_NG': 'i18n_generic',
+    'en_NZ.UTF-8': 'i18n_generic',
+    'en_PH.UTF-8': 'i18n_generic',
+    'en_SG.UTF-8': 'i18n_generic',
+    'en_US.UTF-8': 'i18n_generic',
+    'en_ZA.UTF-8': 'i18n_generic',
+    'en_ZW.UTF-8': 'i18n_generic',
+    'nl_BE.UTF-8': 'i18n_nl_generic',
+    'nl_NL.UTF-8': 'i18n_nl_generic',
+    'it_IT.UTF-8': 'i18n_it_generic',
+    'it_CH.UTF-8': 'i18n_it_generic',
+    'de_AT.UTF-8': 'i18n_de_generic',
+    'de_BE.UTF-8': 'i18n_de_generic',
+    'de_DE.UTF-8': 'i18n_de_generic',
+    'de_LU.UTF-8': 'i18n_de_generic',
+    'de_CH.UTF-8': 'i18n_de_generic',
+    'es_ES.UTF-8': 'i18n_es_generic',
+    'es_AR.UTF-8': 'i18n_es_generic',
+    'es_BO.UTF-8': 'i18n_es_generic',
+    'es_CL.UTF-8': 'i18n_es_generic',
+    'es_CR.UTF-8': 'i18n_es_generic',
+    'es_DO.UTF-8': 'i18n_es_generic',
+    'es_EC.UTF-8': 'i18n_es_generic',
+    'es_SV.UTF-8': 'i18n_es_generic',
+    'es_GT.UTF-8': 'i18n_es_generic',
+    'es_HN.UTF-8': 'i18n_es_generic',
+    'es_MX.UTF-8': 'i18n_es_generic',
+    'es_NI.UTF-8': 'i18n_es_generic',
+    'es_PA.UTF-8': 'i18n_es_generic',
+    'es_PY.UTF-8': 'i18n_es_generic',
+    'es_PE.UTF-8': 'i18n_es_generic',
+    'es_PR.UTF-8': 'i18n_es_generic',
+    'es_US.UTF-8': 'i18n_es_generic',
+    'es_UY.UTF-8': 'i18n_es_generic',
+    'es_VE.UTF-8': 'i18n_es_generic',
+    'ca_ES.UTF-8': 'i18n_ca_generic',
+    'ca_AD.UTF-8': 'i18n_ca_generic',
+    'ca_FR.UTF-8': 'i18n_ca_generic',
+    'pt_BR.UTF-8': 'i18n_pt_br_generic',
+    'da_DK.UTF-8': 'i18n_generic',
+    'ar_AE.UTF-8': 'i18n_ar_generic',
+    'ar_BH.UTF-8': 'i18n_ar_generic',
+    'ar_DZ.UTF-8': 'i18n_ar_generic',
+    'ar_EG.UTF-8': 'i18n_ar_generic',
+    'ar_IN': 'i18n_ar_generic',
+    'ar_IQ.UTF-8': 'i18n_ar_generic',
+    'ar_JO.UTF-8': 'i18n_ar_generic',
+    'ar_KW.UTF-8': 'i18n_ar_generic',
+    'ar_LB.UTF-8': 'i18n_ar_generic',
+    'ar_LY.UTF-8': 'i18n_ar_generic',
+    'ar_MA.UTF-8': 'i18n_ar_generic',
+    'ar_OM.UTF-8': 'i18n_ar_generic',
+    'ar_QA.UTF-8': 'i18n_ar_generic',
+    'ar_SA.UTF-8': 'i18n_ar_generic',
+    'ar_SD.UTF-8': 'i18n_ar_generic',
+    'ar_SY.UTF-8': 'i18n_ar_generic',
+    'ar_TN.UTF-8': 'i18n_ar_generic',
+    'ar_YE.UTF-8': 'i18n_ar_generic',
+    'hr_HR.UTF-8': 'i18n_hr_HR',
+    'ro_RO.UTF-8': 'i18n_ro_generic',
+    'ru_RU.UTF-8': 'i18n_ru_generic',
+    'pl_PL.UTF-8': 'i18n_pl_generic',
+    'nb_NO.UTF-8': 'i18n_generic',
+    'nn_NO.UTF-8': 'i18n_generic',
+    'tr_TR.UTF-8': 'i18n_tr_generic',
+    'ast_ES.UTF-8': 'i18n_ast_generic',
+    'sk_SK.UTF-8': 'i18n_generic',
+    'be_BY.UTF-8': 'i18n_be_generic',
+    'fa_IR.UTF-8': 'i18n_fa_generic',
+    'sq_AL.UTF-8': 'i18n_al_generic',
+}
+
+class _LanguageClassMap(collections.abc.MutableMapping):
+    """Locale name -> language class, importing the module of a class when
+    it is first looked up."""
+
+    def __init__(self, class_names):
+        # locale name -> class, or class name until looked up
+        self._classes = dict(class_names)
+
+    def __getitem__(self, locale_name):
+        language_class = self._classes[locale_name]
+        if isinstance(language_class, str):
+            language_class = get_language_class(language_class)
+            self._classes[locale_name] = language_class
+        return language_class
+
+    def __setitem__(self, locale_name, language_class):
+        self._classes[locale_name] = language_class
+
+    def __delitem__(self, locale_name):
+        del self._classes[locale_name]
+
+    def __iter__(self):
+        return iter(self._classes)
+
+    def __len__(self):
+        return len(self._classes)
 
 # When not listed in the following map, default language class will be
 # i18n_generic
-language_class_map = {
-    'fr_BE.UTF-8': i18n_fr_generic,
-    'fr_FR.UTF-8': i18n_fr_generic,
-    'fr_CA.UTF-8': i18n_fr_generic,
-    'fr_CH.UTF-8': i18n_fr_generic,
-    'fr_LU.UTF-8': i18n_fr_generic,
-    'en_AG': i18n_generic,
-    'en_AU.UTF-8': i18n_generic,
-    'en_BW.UTF-8': i18n_generic,
-    'en_CA.UTF-8': i18n_generic,
-    'en_DK.UTF-8': i18n_generic,
-    'en_GB.UTF-8': i18n_generic,
-    'en_HK.UTF-8': i18n_generic,
-    'en_IE.UTF-8': i18n_generic,
-    'en_IN': i18n_generic,
-    'en_NG': i18n_generic,
-    'en_NZ.UTF-8': i18n_generic,
-    'en_PH.UTF-8': i18n_generic,
-    'en_SG.UTF-8': i18n_generic,
-    'en_US.UTF-8': i18n_generic,
-    'en_ZA.UTF-8': i18n_generic,
-    'en_ZW.UTF-8': i18n_generic,
-    'nl_BE.UTF-8': i18n_nl_generic,
-    'nl_NL.UTF-8': i18n_nl_generic,
-    'it_IT.UTF-8': i18n_it_generic,
-    'it_CH.UTF-8': i18n_it_generic,
-    'de_AT.UTF-8': i18n_de_generic,
-    'de_BE.UTF-8': i18n_de_generic,
-    'de_DE.UTF-8': i18n_de_generic,
-    'de_LU.UTF-8': i18n_de_generic,
-    'de_CH.UTF-8': i18n_de_generic,
-    'es_ES.UTF-8': i18n_es_generic,
-    'es_AR.UTF-8': i18n_es_generic,
-    'es_BO.UTF-8': i18n_es_generic,
-    'es_CL.UTF-8': i18n_es_generic,
-    'es_CR.UTF-8': i18n_es_generic,
-    'es_DO.UTF-8': i18n_es_generic,
-    'es_EC.UTF-8': i18n_es_generic,
-    'es_SV.UTF-8': i18n_es_generic,
-    'es_GT.UTF-8': i18n_es_generic,
-    'es_HN.UTF-8': i18n_es_generic,
-    'es_MX.UTF-8': i18n_es_generic,
-    'es_NI.UTF-8': i18n_es_generic,
-    'es_PA.UTF-8': i18n_es_generic,
-    'es_PY.UTF-8': i18n_es_generic,
-    'es_PE.UTF-8': i18n_es_generic,
-    'es_PR.UTF-8': i18n_es_generic,
-    'es_US.UTF-8': i18n_es_generic,
-    'es_UY.UTF-8': i18n_es_generic,
-    'es_VE.UTF-8': i18n_es_generic,
-    'ca_ES.UTF-8': i18n_ca_generic,
-    'ca_AD.UTF-8': i18n_ca_generic,
-    'ca_FR.UTF-8': i18n_ca_generic,
-    'pt_BR.UTF-8': i18n_pt_br_generic,
-    'da_DK.UTF-8': i18n_generic,
-    'ar_AE.UTF-8': i18n_ar_generic,
-    'ar_BH.UTF-8': i18n_ar_generic,
-    'ar_DZ.UTF-8': i18n_ar_generic,
-    'ar_EG.UTF-8': i18n_ar_generic,
-    'ar_IN': i18n_ar_generic,
-    'ar_IQ.UTF-8': i18n_ar_generic,
-    'ar_JO.UTF-8': i18n_ar_generic,
-    'ar_KW.UTF-8': i18n_ar_generic,
-    'ar_LB.UTF-8': i18n_ar_generic,
-    'ar_LY.UTF-8': i18n_ar_generic,
-    'ar_MA.UTF-8': i18n_ar_generic,
-    'ar_OM.UTF-8': i18n_ar_generic,
-    'ar_QA.UTF-8': i18n_ar_generic,
-    'ar_SA.UTF-8': i18n_ar_generic,
-    'ar_SD.UTF-8': i18n_ar_generic,
-    'ar_SY.UTF-8': i18n_ar_generic,
-    'ar_TN.UTF-8': i18n_ar_generic,
-    'ar_YE.UTF-8': i18n_ar_generic,
-    'hr_HR.UTF-8': i18n_hr_HR,
-    'ro_RO.UTF-8': i18n_ro_generic,
-    'ru_RU.UTF-8': i18n_ru_generic,
-    'pl_PL.UTF-8': i18n_pl_generic,
-    'nb_NO.UTF-8': i18n_generic,
-    'nn_NO.UTF-8': i18n_generic,
-    'tr_TR.UTF-8': i18n_tr_generic,
-    'ast_ES.UTF-8': i18n_ast_generic,
-    'sk_SK.UTF-8': i18n_generic,
-    'be_BY.UTF-8': i18n_be_generic,
-    'fa_IR.UTF-8': i18n_fa_generic,
-    'sq_AL.UTF-8': i18n_al_generic,
-}
+language_class_map = _LanguageClassMap(_LANGUAGE_CLASS_NAMES)
 
 def install_translation(locale_name, locale_path):
     """Return a new i18n class instance, depending on the specified
@@ -213,3 +292,26 @@ def install_translation(locale_name, locale_path):
     class is i18n_generic"""
     language_class = language_class_map.get(locale_name, i18n_generic)
     return language_class(locale_name, locale_path)
+
+def get_language_class(name):
+    """Return the i18n class of the given name, importing its module on
+    first use."""
+    try:
+        return globals()[name]
+    except KeyError:
+        pass
+    try:
+        module_name = _LANGUAGE_MODULES[name]
+    except KeyError:
+        raise ValueError("Unknown i18n class '%s'" % name)
+    module = importlib.import_module('.' + module_name, __name__)
+    language_class = getattr(module, name)
+    globals()[name] = language_class
+    return language_class
+
+def __getattr__(name):
+    # keep i18n.i18n_fr_generic & co working as module attributes
+    if name in _LANGUAGE_MODULES:
+        return get_language_class(name)
+    raise AttributeError("module '%s' has no attribute '%s'"
+                         % (__name__, name))
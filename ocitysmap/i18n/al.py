@@ -1,6 +1,6 @@
 import re, gettext
 import logging
-from . import i18n, _install_language
+from . import i18n, _install_language, _memoize
 
 LOG = logging.getLogger('ocitysmap')
 
@@ -26,6 +26,7 @@ class i18n_al_generic(i18n):
     def language_code(self):
         return self.language
 
+    @_memoize
     def user_readable_street(self, name):
         #
         # Make sure name actually contains something,
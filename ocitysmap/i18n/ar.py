@@ -1,5 +1,5 @@
 import re, gettext
-from . import i18n, _install_language
+from . import i18n, _install_language, _memoize, _unaccent_table
 
 class i18n_ar_generic(i18n):
     APPELLATIONS = [ u"شارع", u"طريق", u"زقاق", u"نهج", u"جادة",
@@ -18,19 +18,16 @@ class i18n_ar_generic(i18n):
                                                                  | re.UNICODE)
 
     # for IndexPageGenerator.upper_unaccent_string
-    A_ACCENT = re.compile(r"[اإآ]", re.IGNORECASE | re.UNICODE)
+    UNACCENT_TABLE = _unaccent_table({"اإآ": "أ"})
 
     def __init__(self, language, locale_path):
         self.language = str(language)
         _install_language(language, locale_path)
 
-    def upper_unaccent_string(self, s):
-        s = self.A_ACCENT.sub("أ", s)
-        return s.upper()
-
     def language_code(self):
         return self.language
 
+    @_memoize
     def user_readable_street(self, name):
         name = name.strip()
         name = self.SPACE_REDUCE.sub(" ", name)
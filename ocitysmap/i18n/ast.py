@@ -1,5 +1,5 @@
 import re, gettext
-from . import i18n, _install_language
+from . import i18n, _install_language, _memoize, _unaccent_table
 
 class i18n_ast_generic(i18n):
 
@@ -71,33 +71,25 @@ class i18n_ast_generic(i18n):
                                                                  | re.UNICODE)
 
     # for IndexPageGenerator.upper_unaccent_string
-    E_ACCENT = re.compile(r"[éèêëẽ]", re.IGNORECASE | re.UNICODE)
-    I_ACCENT = re.compile(r"[íìîïĩ]", re.IGNORECASE | re.UNICODE)
-    A_ACCENT = re.compile(r"[áàâäã]", re.IGNORECASE | re.UNICODE)
-    O_ACCENT = re.compile(r"[óòôöõ]", re.IGNORECASE | re.UNICODE)
-    U_ACCENT = re.compile(r"[úùûüũ]", re.IGNORECASE | re.UNICODE)
-    N_ACCENT = re.compile(r"[ñ]", re.IGNORECASE | re.UNICODE)
-    H_ACCENT = re.compile(r"[ḥ]", re.IGNORECASE | re.UNICODE)
-    L_ACCENT = re.compile(r"[ḷ]", re.IGNORECASE | re.UNICODE)
+    UNACCENT_TABLE = _unaccent_table({
+        "éèêëẽ": "e",
+        "íìîïĩ": "i",
+        "áàâäã": "a",
+        "óòôöõ": "o",
+        "úùûüũ": "u",
+        "ñ": "n",
+        "ḥ": "h",
+        "ḷ": "l",
+    })
 
     def __init__(self, language, locale_path):
         self.language = str(language)
         _install_language(language, locale_path)
 
-    def upper_unaccent_string(self, s):
-        s = self.E_ACCENT.sub("e", s)
-        s = self.I_ACCENT.sub("i", s)
-        s = self.A_ACCENT.sub("a", s)
-        s = self.O_ACCENT.sub("o", s)
-        s = self.U_ACCENT.sub("u", s)
-        s = self.N_ACCENT.sub("n", s)
-        s = self.H_ACCENT.sub("h", s)
-        s = self.L_ACCENT.sub("l", s)
-        return s.upper()
-
     def language_code(self):
         return self.language
 
+    @_memoize
     def user_readable_street(self, name):
         name = name.strip()
         name = self.SPACE_REDUCE.sub(" ", name)
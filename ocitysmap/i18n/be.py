@@ -1,5 +1,5 @@
 import re, gettext
-from . import i18n, _install_language
+from . import i18n, _install_language, _memoize
 
 class i18n_be_generic(i18n):
     # Based on code for Russian language:
@@ -66,6 +66,7 @@ class i18n_be_generic(i18n):
                     if s is not None)
                 ))
 
+    @_memoize
     def user_readable_street(self, name):
         name = name.strip()
         name = self.SPACE_REDUCE.sub(" ", name)
@@ -1,5 +1,5 @@
 import re, gettext
-from . import i18n, _install_language
+from . import i18n, _install_language, _memoize, _unaccent_table
 
 class i18n_fa_generic(i18n):
     APPELLATIONS = [ "خ", "خ.", "جاده", "راه", "مسیر", "بلوار", 
@@ -33,31 +33,25 @@ class i18n_fa_generic(i18n):
                                                                  | re.UNICODE)
 
     # for IndexPageGenerator.upper_unaccent_string
-    A_ACCENT = re.compile(r"[اأإ]", re.IGNORECASE | re.UNICODE)
-    
-    ### following line contains diacritics (The usage of these chars is when we want distinguish between similar words that have the same letters with different pronunciation). Their usage is rare.
-    ### There is also character kashida (ـ). this is not a diacritic, but a character that stretch some letters. (This is also rare)
-    O_ACCENT = re.compile(r"[ًٌٍَُِْـ]", re.IGNORECASE | re.UNICODE)
-    T_ACCENT = re.compile(r"[تة]", re.IGNORECASE | re.UNICODE)
-    Y_ACCENT = re.compile(r"[ئءیىي]", re.IGNORECASE | re.UNICODE)
-    V_ACCENT = re.compile(r"[وؤ]", re.IGNORECASE | re.UNICODE)
+    UNACCENT_TABLE = _unaccent_table({
+        "اأإ": "ا",
+        ### following line contains diacritics (The usage of these chars is when we want distinguish between similar words that have the same letters with different pronunciation). Their usage is rare.
+        ### There is also character kashida (ـ). this is not a diacritic, but a character that stretch some letters. (This is also rare)
+        ### to ignoring diacritics and kashida (ـ) I put an empty string.
+        "ًٌٍَُِْـ": "",
+        "تة": "ت",
+        "ئءیىي": "ی",
+        "وؤ": "و",
+    })
 
     def __init__(self, language, locale_path):
         self.language = str(language)
         _install_language(language, locale_path)
 
-    def upper_unaccent_string(self, s):
-        s = self.A_ACCENT.sub("ا", s)
-        ### to ignoring diacritics and kashida (ـ) I put an empty string.
-        s = self.O_ACCENT.sub("", s)
-        s = self.T_ACCENT.sub("ت", s)
-        s = self.Y_ACCENT.sub("ی", s)
-        s = self.V_ACCENT.sub("و", s)
-        return s.upper()
-
     def language_code(self):
         return self.language
 
+    @_memoize
     def user_readable_street(self, name):
         name = name.strip()
         name = self.SPACE_REDUCE.sub(" ", name)
@@ -1,22 +1,21 @@
 import re, gettext
-from . import i18n, _install_language
+from . import i18n, _install_language, _memoize, _unaccent_table
 
 class i18n_hr_HR(i18n):
-    # for upper_unaccent_string
-    C_ACCENT = re.compile(r"[ćč]", re.IGNORECASE | re.UNICODE)
-    D_ACCENT = re.compile(r"đ|dž", re.IGNORECASE | re.UNICODE)
-    N_ACCENT = re.compile(r"nj", re.IGNORECASE | re.UNICODE)
-    L_ACCENT = re.compile(r"lj", re.IGNORECASE | re.UNICODE)
-    S_ACCENT = re.compile(r"š", re.IGNORECASE | re.UNICODE)
-    Z_ACCENT = re.compile(r"ž", re.IGNORECASE | re.UNICODE)
+    # for upper_unaccent_string, digraphs are folded to their first letter
+    DIGRAPHS = re.compile(r"dž|nj|lj", re.IGNORECASE | re.UNICODE)
+    UNACCENT_TABLE = _unaccent_table({
+        "ćč": "c",
+        "đ": "d",
+        "š": "s",
+        "ž": "z",
+    })
 
+    @_memoize
     def upper_unaccent_string(self, s):
-        s = self.C_ACCENT.sub("c", s)
-        s = self.D_ACCENT.sub("d", s)
-        s = self.N_ACCENT.sub("n", s)
-        s = self.L_ACCENT.sub("l", s)
-        s = self.S_ACCENT.sub("s", s)
-        s = self.Z_ACCENT.sub("z", s)
+        s = self.DIGRAPHS.sub(lambda m: m.group(0)[0], s)
+        if not s.isascii():
+            s = s.translate(self.UNACCENT_TABLE)
         return s.upper()
 
     def __init__(self, language, locale_path):
@@ -1,5 +1,5 @@
 import re, gettext
-from . import i18n, _install_language
+from . import i18n, _install_language, _memoize
 
 class i18n_ro_generic(i18n):
     APPELLATIONS = ['Aleea', 'Bulevardul', 'Calea', 'Piata', 'Strada']
@@ -19,6 +19,7 @@ class i18n_ro_generic(i18n):
     def language_code(self):
         return self.language
 
+    @_memoize
     def user_readable_street(self, name):
         name = name.strip()
         name = self.SPACE_REDUCE.sub(" ", name)
@@ -1,5 +1,5 @@
 import re, gettext
-from . import i18n, _install_language
+from . import i18n, _install_language, _memoize
 
 class i18n_ru_generic(i18n):
     # Based on list from Streetmangler:
@@ -85,6 +85,7 @@ class i18n_ru_generic(i18n):
                     if s is not None)
                 ))
 
+    @_memoize
     def user_readable_street(self, name):
         name = name.strip()
         name = self.SPACE_REDUCE.sub(" ", name)
@@ -1,5 +1,5 @@
 import re, gettext
-from . import i18n, _install_language
+from . import i18n, _install_language, _memoize
 
 class i18n_tr_generic(i18n):
     APPELLATIONS = [ u"Sokak", u"Sokağı" ]
@@ -20,6 +20,7 @@ class i18n_tr_generic(i18n):
     def language_code(self):
         return self.language
 
+    @_memoize
     def user_readable_street(self, name):
         #
         # Make sure name actually contains something,
@@ -0,0 +1,101 @@
+# -*- coding: utf-8; mode: Python -*-
+
+# ocitysmap, city map and street index generator from OpenStreetMap data
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Microbenchmark of the index label normalization of every i18n language
+class: the former chain of case insensitive regexps against the
+str.translate() tables, and the cold against the memoized calls.
+
+Run from this directory, like i18n_test.py:
+
+    python3 i18n_benchmark.py [number of labels]
+"""
+
+import re
+import sys
+import timeit
+
+import i18n
+
+SAMPLE_NAMES = [
+    "Rue de l'Église", "Avenue Émile Zola", "Calle de la Peña",
+    "Plaça de Catalunya", "Straße der Einheit", "Via Niccolò Tommaseo",
+    "Ulica Đure Đakovića", "Njegoševa ulica", "Ljubljanska cesta",
+    "Rua São João", "Carrer d'Aragó", "Åkerövägen", "улица Ленина",
+    "Зеленая улица", "شارع الإمام", "خیابان آزادی", "Fenêtre Œuvre",
+]
+
+def _legacy_upper_unaccent(obj):
+    """Rebuild the former one-regexp-per-letter implementation from the
+    translate table of the language object."""
+    by_replacement = {}
+    for code, replacement in obj.UNACCENT_TABLE.items():
+        by_replacement.setdefault(replacement, []).append(chr(code))
+    regexps = [(re.compile("[%s]" % re.escape("".join(chars)),
+                           re.IGNORECASE | re.UNICODE), replacement)
+               for replacement, chars in by_replacement.items()]
+    digraphs = getattr(obj, 'DIGRAPHS', None)
+
+    def upper_unaccent_string(s):
+        if digraphs is not None:
+            s = digraphs.sub(lambda m: m.group(0)[0], s)
+        for regexp, replacement in regexps:
+            s = regexp.sub(replacement, s)
+        return s.upper()
+    return upper_unaccent_string
+
+def _labels(count):
+    """Labels as seen by the indexer: a few thousand distinct names, each
+    of them showing up several times."""
+    return ["%s %d" % (SAMPLE_NAMES[i % len(SAMPLE_NAMES)], i % 2000)
+            for i in range(count)]
+
+def _time(function, labels):
+    return min(timeit.repeat(lambda: [function(l) for l in labels],
+                             number=1, repeat=3))
+
+def main(count):
+    labels = _labels(count)
+    print("%d labels\n" % count)
+    print("%-22s %10s %10s %10s %10s %10s" % ("class", "regexp",
+                                            "translate", "memoized",
+                                            "street", "memoized"))
+
+    classes = sorted(set(i18n.language_class_map.values()),
+                     key=lambda c: c.__name__)
+    for cls in classes:
+        obj = cls('C', '')
+        legacy = _legacy_upper_unaccent(obj)
+        method = type(obj).upper_unaccent_string
+        method = getattr(method, '__wrapped__', method)
+        translate = lambda s: method(obj, s)
+        for label in labels[:len(SAMPLE_NAMES)]:
+            assert legacy(label) == translate(label), (cls.__name__, label)
+
+        street = type(obj).user_readable_street
+        street = getattr(street, '__wrapped__', street)
+
+        print("%-22s %9.1fms %9.1fms %9.1fms %9.1fms %9.1fms" % (
+            cls.__name__,
+            1000 * _time(legacy, labels),
+            1000 * _time(translate, labels),
+            1000 * _time(cls('C', '').upper_unaccent_string, labels),
+            1000 * _time(lambda s: street(obj, s), labels),
+            1000 * _time(cls('C', '').user_readable_street, labels)))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
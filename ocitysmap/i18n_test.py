@@ -1,6 +1,6 @@
 # -*- coding: utf-8; mode: Python -*-
 import unittest
-import i18n
+from ocitysmap import i18n
 
 class i18n_ru_generic_test(unittest.TestCase):
     def setUp(self):
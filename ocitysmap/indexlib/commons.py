@@ -25,7 +25,8 @@
 import os
 import gi
 gi.require_version('Pango', '1.0')
-from gi.repository import GObject, Pango
+gi.require_version('PangoCairo', '1.0')
+from gi.repository import GObject, Pango, PangoCairo
 import sys
 
 import logging
@@ -36,6 +37,47 @@ import draw_utils
 
 from colour import Color
 
+class TextMeasurements:
+    """
+    Cache of the sizes of the texts laid out by the index renderers. One
+    instance is shared by all the index renderers of a rendering job, so
+    that each label is shaped by Pango only once for a given font,
+    resolution and wrapping width.
+    """
+
+    def __init__(self):
+        self._sizes = {}
+
+    def get_size(self, layout, text):
+        """Return the size of the given text in the given layout.
+
+        Args:
+            layout (pango.Layout): the Pango layout, configured with the
+                font and width to measure the text with.
+            text (str): the text to measure.
+
+        Returns a tuple (width, height), in Cairo units. Note that the
+        text of the layout is left unchanged when the size was cached.
+        """
+        key = (layout.get_font_description().to_string(),
+               PangoCairo.context_get_resolution(layout.get_context()),
+               layout.get_width(), text)
+        try:
+            return self._sizes[key]
+        except KeyError:
+            layout.set_text(text, -1)
+            width, height = layout.get_size()
+            size = (float(width) / Pango.SCALE, float(height) / Pango.SCALE)
+            self._sizes[key] = size
+            return size
+
+def _text_size(layout, text, measurements=None):
+    if measurements is not None:
+        return measurements.get_size(layout, text)
+    layout.set_text(text, -1)
+    width, height = layout.get_size()
+    return float(width) / Pango.SCALE, float(height) / Pango.SCALE
+
 class IndexEmptyError(Exception):
     """This exception is raised when no data is to be rendered in the index."""
     pass
@@ -84,9 +126,8 @@ class StreetIndexCategory(IndexCategory):
     def __init__(self, name, items=None, is_street=True):
         IndexCategory.__init__(self, name, items, is_street)
 
-    def label_drawing_height(self, layout):
-        layout.set_text(self.name, -1)
-        return float(layout.get_size()[1]) / Pango.SCALE
+    def label_drawing_height(self, layout, measurements=None):
+        return _text_size(layout, self.name, measurements)[1]
 
     def draw(self, rtl, ctx, pc, layout, fascent, fheight,
              baseline_x, baseline_y):
@@ -232,17 +273,14 @@ class StreetIndexItem(IndexItem):
     humanized squares description.
     """
 
-    def label_drawing_width(self, layout):
-        layout.set_text(self.label, -1)
-        return float(layout.get_size()[0]) / Pango.SCALE
+    def label_drawing_width(self, layout, measurements=None):
+        return _text_size(layout, self.label, measurements)[0]
 
-    def label_drawing_height(self, layout):
-        layout.set_text(self.label, -1)
-        return float(layout.get_size()[1]) / Pango.SCALE
+    def label_drawing_height(self, layout, measurements=None):
+        return _text_size(layout, self.label, measurements)[1]
 
-    def location_drawing_width(self, layout):
-        layout.set_text(self.location_str, -1)
-        return float(layout.get_size()[0]) / Pango.SCALE
+    def location_drawing_width(self, layout, measurements=None):
+        return _text_size(layout, self.location_str, measurements)[0]
 
     def draw(self, rtl, ctx, pc, column_layout, fascent, fheight,
              baseline_x, baseline_y,
@@ -316,7 +354,7 @@ class PoiIndexItem(IndexItem):
     # icon = None
 
     def __init__(self, label, coords, icon=None):
-        IndexItem.__init__(self, label, coords, None)
+        IndexItem.__init__(self, label, None, coords, None)
         self.icon = icon
 
 
@@ -82,12 +82,135 @@ def resolveIcon(icon):
     return resultIcon
 
 
+class _JsonStreamReader:
+    """
+    Minimal incremental JSON reader. It walks the structure of a JSON
+    document chunk by chunk so that large arrays can be consumed one
+    element at a time instead of materializing the whole document.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    _WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+    # characters a number can go on with
+    _NUMBER_CHARS = '0123456789.eE+-'
+
+    def __init__(self, f):
+        self._f = f
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self):
+        """Drop the consumed part of the buffer and append the next chunk.
+        Returns False once the end of the file has been reached."""
+        if self._eof:
+            return False
+        chunk = self._f.read(self.CHUNK_SIZE)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        """Return the next non-blank character without consuming it, or ''
+        at the end of the file."""
+        while True:
+            self._pos = self._WHITESPACE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, char):
+        found = self._peek()
+        if found != char:
+            raise ValueError("expected '%s' but found '%s'" % (char, found))
+        self._pos += 1
+
+    def read_value(self):
+        """Decode and return the complete JSON value at the current
+        position."""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except ValueError:
+                if self._fill():
+                    continue
+                raise
+            # a number may go on in the next chunk, possibly after its
+            # decimal point or exponent mark, which were left out of it
+            if (isinstance(value, (int, float))
+                    and not isinstance(value, bool)
+                    and (end == len(self._buf)
+                         or self._buf[end] in self._NUMBER_CHARS)
+                    and self._fill()):
+                continue
+            self._pos = end
+            return value
+
+    def iter_object(self):
+        """Iterate over the keys of the object at the current position. The
+        caller has to consume the value of each key before the next one."""
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self.read_value()
+            if not isinstance(key, str):
+                raise ValueError("invalid object key %r" % (key,))
+            self._expect(':')
+            yield key
+            separator = self._peek()
+            self._pos += 1
+            if separator == '}':
+                return
+            if separator != ',':
+                raise ValueError("expected ',' or '}' but found '%s'"
+                                 % separator)
+
+    def iter_array(self):
+        """Iterate over the elements of the array at the current position.
+        The caller has to consume each element before the next one."""
+        self._expect('[')
+        if self._peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield
+            separator = self._peek()
+            self._pos += 1
+            if separator == ']':
+                return
+            if separator != ',':
+                raise ValueError("expected ',' or ']' but found '%s'"
+                                 % separator)
+
+
 class PoiIndex:
 
-    def __init__(self, filename):
-        f = codecs.open(filename, "r", "utf-8-sig")
-        self._read_json(f)
-        f.close()
+    def __init__(self, filename, bounding_box=None):
+        """
+        Load the POI index from the given JSON file.
+
+        The file is read incrementally: nodes lying outside of the
+        bounding box are dropped as soon as they are parsed, so memory
+        usage only depends on the number of POIs actually kept.
+
+        Args:
+           filename (str): path to the POI JSON file
+           bounding_box (coords.BoundingBox): optional area of interest,
+              nodes outside of it are not indexed
+        """
+        self._bbox = bounding_box
+        with codecs.open(filename, "r", "utf-8-sig") as f:
+            self._read_json(f)
 
     @property
     def categories(self):
@@ -103,31 +226,78 @@ class PoiIndex:
 
     def _read_json(self, f):
         self._categories = []
+        self._center_lat = False
+        self._center_lon = False
+        self._rejected_outside = 0
+        self._rejected_malformed = 0
 
+        reader = _JsonStreamReader(f)
+        header = {}
         try:
-            j = json.load(f)
+            for key in reader.iter_object():
+                if key == 'nodes':
+                    for _ in reader.iter_array():
+                        self._read_category(reader)
+                else:
+                    header[key] = reader.read_value()
         except ValueError as e:
             LOG.warning('invalid json in POI file: %s' % e)
+            self._categories = []
             return False
 
-        title = j['title']        
-        self._center_lat = float(j['center_lat'])
-        self._center_lon = float(j['center_lon'])
+        self._center_lat = float(header['center_lat'])
+        self._center_lon = float(header['center_lon'])
+
+        if self._rejected_malformed:
+            LOG.warning('%d malformed node(s) skipped in POI file'
+                        % self._rejected_malformed)
+        if self._rejected_outside:
+            LOG.info('%d POI(s) outside of the bounding box ignored'
+                     % self._rejected_outside)
+        return True
+
+    def _read_category(self, reader):
+        """Read one category object, keeping only the usable nodes."""
+        attrs = {}
+        items = []
+        had_nodes = False
+        for key in reader.iter_object():
+            if key != 'nodes':
+                attrs[key] = reader.read_value()
+                continue
+            for _ in reader.iter_array():
+                had_nodes = True
+                item = self._make_item(reader.read_value())
+                if item is not None:
+                    items.append(item)
+
+        # don't list categories whose POIs are all off the map
+        if had_nodes and not items:
+            return
 
-        for cat in j['nodes']:
-            c = commons.PoiIndexCategory(cat['text'], color=cat['color'], icon=cat['icon'])
-            for node in cat['nodes']:
-                try:
-                    c.items.append(
-                        commons.PoiIndexItem(node['text'],
-                                             ocitysmap.coords.Point(float(node['lat']),
-                                                                    float(node['lon'])),
-                                             icon = node['icon']))
-                except:
-                    pass
-
-            self._categories.append(c)
-        return True        
+        c = commons.PoiIndexCategory(attrs['text'], items,
+                                     color=attrs['color'],
+                                     icon=attrs['icon'])
+        self._categories.append(c)
+
+    def _make_item(self, node):
+        """Return the PoiIndexItem for the given decoded node, or None if
+        the node is malformed or out of the bounding box."""
+        try:
+            lat = float(node['lat'])
+            lon = float(node['lon'])
+            text = node['text']
+            icon = node['icon']
+        except (KeyError, TypeError, ValueError):
+            self._rejected_malformed += 1
+            return None
+
+        if self._bbox is not None and not self._bbox.contains(lat, lon):
+            self._rejected_outside += 1
+            return None
+
+        return commons.PoiIndexItem(text, ocitysmap.coords.Point(lat, lon),
+                                    icon = icon)
 
     def write_to_csv(self, title, output_filename):
         return
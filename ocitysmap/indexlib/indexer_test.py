@@ -0,0 +1,65 @@
+# -*- coding: utf-8; mode: Python -*-
+import unittest
+from ocitysmap.indexlib import indexer
+
+POI_FILE = '''{
+  "title": "Sample",
+  "center_lat": 48.8123,
+  "center_lon": -2.3e-1,
+  "nodes": [
+    {"text": "Food", "color": "#ff0000", "icon": "cutlery",
+     "nodes": [
+       {"lat": 48.8125, "lon": 2.35, "text": "Caf\\u00e9", "icon": "coffee"},
+       {"lat": 4.88E1, "lon": -2, "text": "Bakery", "icon": "bread"}
+     ]},
+    {"text": "Empty", "color": "blue", "icon": "circle", "nodes": []},
+    {"text": "Shops", "color": "#00ff00", "icon": "shop", "visible": true,
+     "nodes": [
+       {"lat": 48.81, "lon": 12.5e-1, "text": "Books", "icon": null}
+     ]}
+  ]
+}'''
+
+EXPECTED = [
+    ('Food', [('Café', 48.8125, 2.35), ('Bakery', 48.8, -2.0)]),
+    ('Empty', []),
+    ('Shops', [('Books', 48.81, 1.25)]),
+]
+
+class _SplitFile:
+    """A file returning its text in two reads, split at a position."""
+
+    def __init__(self, text, split):
+        self._parts = [text[:split], text[split:]]
+
+    def read(self, size=-1):
+        return self._parts.pop(0) if self._parts else ''
+
+class indexer_test(unittest.TestCase):
+    def _read(self, split):
+        index = indexer.PoiIndex.__new__(indexer.PoiIndex)
+        index._bbox = None
+        self.assertTrue(index._read_json(_SplitFile(POI_FILE, split)),
+                        'split at %d' % split)
+        return index
+
+    def test_every_chunk_boundary(self):
+        for split in range(1, len(POI_FILE)):
+            index = self._read(split)
+            self.assertEqual(index.lat, 48.8123, 'split at %d' % split)
+            self.assertEqual(index.lon, -0.23, 'split at %d' % split)
+            found = [(category.name,
+                      [(item.label,) + item.endpoint1.get_latlong()
+                       for item in category.items])
+                     for category in index.categories]
+            self.assertEqual(found, EXPECTED, 'split at %d' % split)
+
+    def test_numbers(self):
+        for text in ['48.123', '-0.5e+3', '12E-2', '7', '0.25']:
+            for split in range(1, len(text)):
+                reader = indexer._JsonStreamReader(_SplitFile(text + ' ', split))
+                self.assertEqual(reader.read_value(), float(text),
+                                 '%s split at %d' % (text, split))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -26,6 +26,7 @@ gi.require_version('PangoCairo', '1.0')
 from gi.repository import Rsvg, Pango, PangoCairo
 
 import draw_utils
+from . import commons
 import ocitysmap.layoutlib.commons as UTILS
 from ocitysmap.layoutlib.abstract_renderer import Renderer
 
@@ -45,8 +46,9 @@ class MultiPageStreetIndexRenderer:
     # ctx: Cairo context
     # surface: Cairo surface
     def __init__(self, i18n, ctx, surface, index_categories, rendering_area, margins, print_bleed_pt,
-                 page_offset):
+                 page_offset, text_measurements=None):
         self._i18n            = i18n
+        self._measurements    = text_measurements or commons.TextMeasurements()
         self.ctx              = ctx
         self.surface          = surface
         self.index_categories = index_categories
@@ -291,18 +293,18 @@ class MultiPageStreetIndexRenderer:
             #LOG.debug("number of entries in first category: %d" % len(self.index_categories[city][0].items))
             sum_height = 0
             for category in self.index_categories[city]:
-                sum_height += category.label_drawing_height(header_layout)
+                sum_height += category.label_drawing_height(header_layout, self._measurements)
                 #LOG.debug("adding height %f for category %s" % (category.label_drawing_height(header_layout), category.name))
                 for street in category.items:
                     #LOG.debug("label_drawing_height of %s: %f" % (street.label, street.label_drawing_height(label_layout)))
-                    sum_height += street.label_drawing_height(label_layout)
+                    sum_height += street.label_drawing_height(label_layout, self._measurements)
 
-                    w = street.label_drawing_width(label_layout)
+                    w = street.label_drawing_width(label_layout, self._measurements)
                     if w > max_label_drawing_width:
                         max_label_drawing_width = w
                         #LOG.debug("new max_label_drawing_width: %f (%s)" % (max_label_drawing_width, street.label))
 
-                    w = street.location_drawing_width(label_layout)
+                    w = street.location_drawing_width(label_layout, self._measurements)
                     if w > max_location_drawing_width:
                         max_location_drawing_width = w
                         #LOG.debug("new max_location_drawing_width: %f (%s)" % (max_location_drawing_width, street.location_str))
@@ -416,7 +418,7 @@ class MultiPageStreetIndexRenderer:
                             self.ctx.stroke()
                             self.ctx.restore()
 
-                category_height = category.label_drawing_height(header_layout)
+                category_height = category.label_drawing_height(header_layout, self._measurements)
                 #LOG.debug("category %s, height draw %d | %d | %d | %d" % (category.name, category_height, header_fascent, UTILS.convert_pt_to_dots(header_fascent, dpi), header_fheight))
                 category.draw(self._i18n.isrtl(), self.ctx, pc, header_layout,
                             UTILS.convert_pt_to_dots(header_fascent, dpi),
@@ -428,7 +430,7 @@ class MultiPageStreetIndexRenderer:
                 offset_y += category_height
 
                 for street in category.items:
-                    label_height = street.label_drawing_height(label_layout)
+                    label_height = street.label_drawing_height(label_layout, self._measurements)
                     if ( offset_y + label_height + margin/2. > (max_drawing_height + margin_top_page) ):
                         offset_y       = margin_top_page
                         offset_x      += delta_x
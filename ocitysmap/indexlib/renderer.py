@@ -25,17 +25,16 @@
 import os
 import cairo
 import gi
-gi.require_version('Rsvg', '2.0')
 gi.require_version('Pango', '1.0')
 gi.require_version('PangoCairo', '1.0')
-from gi.repository import Rsvg, Pango, PangoCairo
+from gi.repository import Pango, PangoCairo
 import logging
 import math
 import re
-from functools import reduce
 
 from . import commons
 import ocitysmap.layoutlib.commons as UTILS
+from ocitysmap.layoutlib import svg_assets
 
 from colour import Color
 
@@ -140,16 +139,16 @@ class PoiIndexRenderer:
                 os.path.dirname(__file__), '..', '..', 'templates', 'poi_markers', 'Font-Awesome-SVG-PNG', 'white', 'svg', logo + '.svg'))
 
             if os.path.isfile(logo_path):
-                rsvg = Rsvg.Handle()
-                svg = rsvg.new_from_file(logo_path)
+                svg = svg_assets.get_asset(logo_path)
+                _, svg_width, svg_height = svg
 
-                scale = dpi * 0.6 / svg.props.height;
-                x += svg.props.width * scale + 10*f
+                scale = dpi * 0.6 / svg_height;
+                x += svg_width * scale + 10*f
 
                 ctx.save()
                 ctx.translate(5*f, 5*f)
                 ctx.scale(scale, scale)
-                svg.render_cairo(ctx)
+                svg_assets.paint_asset(ctx, svg)
                 ctx.restore()
             else:
                 LOG.warning("icon not found %s" % logo_path)
@@ -174,26 +173,19 @@ class PoiIndexRenderer:
         marker_path = os.path.abspath(os.path.join(
             os.path.dirname(__file__), '..', '..', 'images', 'marker.svg'))
 
-        fp = open(marker_path,'r')
-        data = fp.read()
-        fp.close()
-
         if color[0] != '#':
             c = Color(color);
             color = c.hex_l
 
-        data = data.replace('#000000', color)
-
-        rsvg = Rsvg.Handle()
-        svg = rsvg.new_from_data(data.encode())
+        svg = svg_assets.get_asset(marker_path, color)
 
-        scale = 50.0 * f/ svg.props.height;
+        scale = 50.0 * f/ svg[2];
         x += 35*f
 
         ctx.save()
 
         ctx.scale(scale, scale)
-        svg.render_cairo(ctx)
+        svg_assets.paint_asset(ctx, svg)
 
         ctx.restore()
 
@@ -213,18 +205,18 @@ class PoiIndexRenderer:
                 os.path.dirname(__file__), '..', '..', 'templates', 'poi_markers', 'Font-Awesome-SVG-PNG', 'black', 'svg', logo + '.svg'))
 
             if os.path.isfile(logo_path):
-                rsvg = Rsvg.Handle()
-                svg = rsvg.new_from_file(logo_path)
+                svg = svg_assets.get_asset(logo_path)
+                _, svg_width, svg_height = svg
 
-                scale = min(dpi * 0.6 / svg.props.height, dpi * 0.6 / svg.props.width);
+                scale = min(dpi * 0.6 / svg_height, dpi * 0.6 / svg_width);
 
                 ctx.save()
                 ctx.translate(x + 5, 5*f)
                 ctx.scale(scale, scale)
-                svg.render_cairo(ctx)
+                svg_assets.paint_asset(ctx, svg)
                 ctx.restore()
                 
-                x += svg.props.width * scale + 10*f
+                x += svg_width * scale + 10*f
             else:
                 LOG.warning("icon not found %s" % logo_path)
 
@@ -304,10 +296,12 @@ class StreetIndexRenderer:
                          StreetIndexRenderingStyle('DejaVu Sans Condensed Bold 2',
                                                    'DejaVu 2'),
                          StreetIndexRenderingStyle('DejaVu Sans Condensed Bold 1',
-                                                   'DejaVu 1'), ] ):
+                                                   'DejaVu 1'), ],
+                 text_measurements=None):
         self._i18n             = i18n
         self._index_categories = index_categories
         self._rendering_styles = street_index_rendering_styles
+        self._measurements     = text_measurements or commons.TextMeasurements()
 
     def precompute_occupation_area(self, surface, x, y, w, h,
                                    freedom_direction, alignment):
@@ -349,29 +343,56 @@ class StreetIndexRenderer:
         ctx = cairo.Context(surface)
         pc  = PangoCairo.create_context(ctx)
 
-        # Iterate over the rendering_styles until we find a suitable layout
-        rendering_style = None
-        for rs in self._rendering_styles:
-            LOG.debug("Trying index fit using %s..." % rs)
-            try:
-                n_cols, min_dimension \
-                    = self._compute_columns_split(ctx, pc, rs, w, h,
-                                                  freedom_direction)
-
-                # Great: index did fit OK !
-                rendering_style = rs
-                break
-
-            except commons.IndexDoesNotFitError:
-                # Index did not fit => try smaller...
-                LOG.debug("Index %s too large: should try a smaller one."
-                        % rs)
-                continue
+        # Find the largest rendering style the index fits with. Fitting is
+        # monotonic in the font size, so bisect the rendering styles
+        # (sorted from the largest to the smallest), with text widths
+        # measured at the first probed style and scaled to the others.
+        styles = self._rendering_styles
+        reference = None
+        lo, hi = 0, len(styles)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if reference is None:
+                reference = (styles[mid],
+                             self._measure_text_widths(ctx, pc, styles[mid]))
+            LOG.debug("Estimating index fit using %s..." % styles[mid])
+            if self._try_columns_split(ctx, pc, styles[mid], w, h,
+                                       freedom_direction,
+                                       self._scale_text_widths(reference,
+                                                               styles[mid])):
+                hi = mid
+            else:
+                lo = mid + 1
+
+        # Check the chosen style exactly. Move to the larger ones while they
+        # fit, in case the estimation was too pessimistic, or fall back to
+        # the smaller ones, in case it was too optimistic.
+        lo = min(lo, len(styles) - 1)
+        LOG.debug("Trying index fit using %s..." % styles[lo])
+        fit = self._try_columns_split(ctx, pc, styles[lo], w, h,
+                                      freedom_direction)
+        if fit:
+            while lo > 0:
+                LOG.debug("Trying index fit using %s..." % styles[lo - 1])
+                larger_fit = self._try_columns_split(ctx, pc, styles[lo - 1],
+                                                     w, h, freedom_direction)
+                if not larger_fit:
+                    break
+                lo -= 1
+                fit = larger_fit
+        while not fit and lo + 1 < len(styles):
+            lo += 1
+            LOG.debug("Trying index fit using %s..." % styles[lo])
+            fit = self._try_columns_split(ctx, pc, styles[lo], w, h,
+                                          freedom_direction)
 
         # Index really did not fit with any of the rendering styles ?
-        if not rendering_style:
+        if not fit:
             raise commons.IndexDoesNotFitError("Index does not fit in area")
 
+        rendering_style = styles[lo]
+        n_cols, min_dimension = fit
+
         # Realign at bottom/top left/right
         if freedom_direction == 'height':
             index_width  = w
@@ -532,16 +553,17 @@ class StreetIndexRenderer:
 
 
     def _compute_lines_occupation(self, ctx, pc, font_desc, n_em_padding,
-                                  text_lines):
+                                  text_width, n_lines):
         """Compute the visual dimension parameters of the initial long column
-        for the given text lines with the given font.
+        for text lines with the given font.
 
         Args:
             pc (pangocairo.CairoContext): the PangoCairo context.
             font_desc (pango.FontDescription): Pango font description,
                 representing the used font at a given size.
             n_em_padding (int): number of extra em space to account for.
-            text_lines (list): the list of text labels.
+            text_width (float): width of the longest text line.
+            n_lines (int): number of text lines.
 
         Returns a dictionnary with the following key,value pairs:
             column_width: the computed column width (pixel size of the longest
@@ -555,21 +577,63 @@ class StreetIndexRenderer:
                                                                      font_desc)
         #print "PREPARE", layout, fascent, fheight, em
 
-        width = max(map(lambda x: self._label_width(layout, x), text_lines))
         # Save some extra space horizontally
-        width += n_em_padding * em
+        width = text_width + n_em_padding * em
 
-        height = fheight * len(text_lines)
+        height = fheight * n_lines
 
         return {'column_width': width, 'column_height': height,
                 'fascent': fascent, 'fheight': fheight, 'em': em}
 
 
     def _label_width(self, layout, label):
-        layout.set_text(label, -1)
-        return float(layout.get_size()[0]) / Pango.SCALE
+        return self._measurements.get_size(layout, label)[0]
+
+    def _count_text_lines(self):
+        """Returns a tuple (number of labels, number of headers)."""
+        return (sum(len(category.items) for category in self._index_categories),
+                len(self._index_categories))
+
+    def _measure_text_widths(self, ctx, pc, rendering_style):
+        """Returns a tuple (width of the longest label, width of the longest
+        header) for the given font sizes, measured in a single pass over
+        the index."""
+        label_layout = self._create_layout_with_font(ctx, pc,
+            Pango.FontDescription(rendering_style.label_font_spec))[0]
+        header_layout = self._create_layout_with_font(ctx, pc,
+            Pango.FontDescription(rendering_style.header_font_spec))[0]
+
+        label_width = header_width = 0.0
+        for category in self._index_categories:
+            header_width = max(header_width,
+                               self._label_width(header_layout, category.name))
+            for item in category.items:
+                label_width = max(label_width,
+                                  self._label_width(label_layout, item.label))
+        return label_width, header_width
 
-    def _compute_column_occupation(self, ctx, pc, rendering_style):
+    def _scale_text_widths(self, reference, rendering_style):
+        """Estimate the text widths for the given font sizes from the ones
+        measured at another size.
+
+        Args:
+            reference (tuple): the rendering style the widths were
+                measured with, and the result of _measure_text_widths().
+            rendering_style (StreetIndexRenderingStyle): the rendering style
+                to estimate the widths for.
+        """
+        reference_style, (label_width, header_width) = reference
+        def ratio(spec, reference_spec):
+            return (float(Pango.FontDescription(spec).get_size())
+                    / Pango.FontDescription(reference_spec).get_size())
+
+        return (label_width * ratio(rendering_style.label_font_spec,
+                                    reference_style.label_font_spec),
+                header_width * ratio(rendering_style.header_font_spec,
+                                     reference_style.header_font_spec))
+
+    def _compute_column_occupation(self, ctx, pc, rendering_style,
+                                   text_widths=None):
         """Returns the size of the tall column with all headers, labels and
         squares for the given font sizes.
 
@@ -577,6 +641,8 @@ class StreetIndexRenderer:
             pc (pangocairo.CairoContext): the PangoCairo context.
             rendering_style (StreetIndexRenderingStyle): how to render the
                 headers and labels.
+            text_widths (tuple): widths of the longest label and header, as
+                returned by _measure_text_widths(). Measured when None.
 
         Return a tuple (width of tall column, height of tall column,
                         vertical margin to reserve after each small column).
@@ -585,14 +651,18 @@ class StreetIndexRenderer:
         header_fd = Pango.FontDescription(rendering_style.header_font_spec)
         label_fd  = Pango.FontDescription(rendering_style.label_font_spec)
 
+        if text_widths is None:
+            text_widths = self._measure_text_widths(ctx, pc, rendering_style)
+        label_width, header_width = text_widths
+        n_labels, n_headers = self._count_text_lines()
+
         # Account for maximum square width (at worst " " + "Z99-Z99")
         label_block = self._compute_lines_occupation(ctx, pc, label_fd, 1+7,
-                reduce(lambda x,y: x+y.get_all_item_labels(),
-                       self._index_categories, []))
+                label_width, n_labels)
 
         # Reserve a small margin around the category headers
         headers_block = self._compute_lines_occupation(ctx, pc, header_fd, 2,
-                [x.name for x in self._index_categories])
+                header_width, n_headers)
 
         column_width = max(label_block['column_width'],
                            headers_block['column_width'])
@@ -607,9 +677,24 @@ class StreetIndexRenderer:
         return column_width, column_height, vertical_extra
 
 
+    def _try_columns_split(self, ctx, pc, rendering_style,
+                           zone_width_dots, zone_height_dots,
+                           freedom_direction, text_widths=None):
+        """Same as _compute_columns_split(), but returns None when the index
+        does not fit."""
+        try:
+            return self._compute_columns_split(ctx, pc, rendering_style,
+                                               zone_width_dots,
+                                               zone_height_dots,
+                                               freedom_direction, text_widths)
+        except commons.IndexDoesNotFitError:
+            LOG.debug("Index %s too large: should try a smaller one."
+                      % rendering_style)
+            return None
+
     def _compute_columns_split(self, ctx, pc, rendering_style,
                                zone_width_dots, zone_height_dots,
-                               freedom_direction):
+                               freedom_direction, text_widths=None):
         """Computes the columns split for this index. From the one tall column
         width and height it finds the number of columns fitting on the zone
         dedicated to the index on the Cairo surface.
@@ -629,13 +714,16 @@ class StreetIndexRenderer:
                 rendering this index, can be 'width' or 'height'. If the
                 streets don't fill the zone dedicated to the index, we need to
                 try with a zone smaller in the freedom_direction.
+            text_widths (tuple): widths of the longest label and header, see
+                _compute_column_occupation().
 
         Returns a tuple (number of columns that will be in the index,
                          the new value for the flexible dimension).
         """
 
         tall_width, tall_height, vertical_extra = \
-                self._compute_column_occupation(ctx, pc, rendering_style)
+                self._compute_column_occupation(ctx, pc, rendering_style,
+                                                text_widths)
 
         if zone_width_dots < tall_width:
             raise commons.IndexDoesNotFitError
@@ -24,29 +24,25 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import cairo
-import gi
-gi.require_version('Rsvg', '2.0')
-gi.require_version('Pango', '1.0')
-gi.require_version('PangoCairo', '1.0')
-from gi.repository import Rsvg, Pango, PangoCairo
+import concurrent.futures
 import logging
 import mapnik
 assert mapnik.mapnik_version() >= 300000, \
     "Mapnik module version %s is too old, see ocitysmap's INSTALL " \
     "for more details." % mapnik.mapnik_version_string()
 import math
+import numpy
 import os
 import re
 import shapely.wkt
 import sys
-from colour import Color
 
-from . import commons
+from . import commons, markers, plugins, svg_assets
 from ocitysmap.maplib.map_canvas import MapCanvas
 from ocitysmap.maplib.grid import Grid
+from ocitysmap.indexlib.commons import TextMeasurements
 from ocitysmap import draw_utils, maplib
 
-from pluginbase import PluginBase
 
 LOG = logging.getLogger('ocitysmap')
 
@@ -110,9 +106,15 @@ class Renderer:
         self._title_margin_pt = 0
         self.dpi = dpi
 
-        plugin_path = os.path.abspath(os.path.join(os.path.dirname(__file__), './render_plugins'))
-        self.plugin_base = PluginBase(package='ocitysmap.layout_plugins')
-        self.plugin_source = self.plugin_base.make_plugin_source(searchpath=[plugin_path])
+        # Text sizes shared by all the index renderers of this job
+        self.text_measurements = TextMeasurements()
+
+        # (bounding box, map coords, dpi, transform) of the last projection
+        self._projection_cache = None
+
+        # plugin name -> future of the result of its prefetch() function
+        self._prefetches = {}
+        self._prefetch_executor = None
 
 
     @staticmethod
@@ -128,23 +130,22 @@ class Renderer:
         Return a tuple (cairo group object for the SVG, SVG width in
                         cairo units).
         """
-        handle = Rsvg.Handle()
         try:
-            svg = handle.new_from_file(path)
+            svg = svg_assets.get_asset(path)
         except Exception:
             LOG.warning("Cannot read SVG from '%s'." % path)
             return None, None
 
-        scale_factor = height / svg.props.height
+        _, svg_width, svg_height = svg
 
         ctx.push_group()
         ctx.save()
         ctx.move_to(0, 0)
-        factor = height / svg.props.height
+        factor = height / svg_height
         ctx.scale(factor, factor)
-        svg.render_cairo(ctx)
+        svg_assets.paint_asset(ctx, svg)
         ctx.restore()
-        return ctx.pop_group(), svg.props.width * factor
+        return ctx.pop_group(), svg_width * factor
 
 
     @staticmethod
@@ -296,9 +297,7 @@ class Renderer:
 
             # Prepare the shade SHP
             shade_shape = maplib.shapes.PolyShapeFile(
-                canvas.get_actual_bounding_box(),
-                os.path.join(self.tmpdir, 'shade.shp'),
-                'shade')
+                canvas.get_actual_bounding_box(), None, 'shade')
             shade_shape.add_shade_from_wkt(shade_wkt)
 
             # Add the shade SHP to the map
@@ -322,8 +321,7 @@ class Renderer:
         return Grid(canvas.get_actual_bounding_box(), canvas.get_actual_scale(), self.rc.i18n.isrtl())
 
     def _apply_grid(self, map_grid, canvas):
-        grid_shape = map_grid.generate_shape_file(
-            os.path.join(self.tmpdir, 'grid.shp'))
+        grid_shape = map_grid.generate_shape_file()
 
         # Add the grid SHP to the map
         canvas.add_shape_file(grid_shape,
@@ -332,7 +330,78 @@ class Renderer:
                               self.rc.stylesheet.grid_line_width)
 
     def get_plugin(self, plugin_name):
-        return self.plugin_source.load_plugin(plugin_name)
+        """Load an effect plugin.
+
+        A plugin module provides a render(renderer, ctx) function, called
+        to draw it on the map, and optionally a prefetch(renderer, db)
+        function. The latter is started on a worker thread as soon as the
+        plugin is loaded, to fetch the data of the plugin for the whole
+        job while the maps are being prepared; render() gets its result
+        through get_prefetched(). It is given its own database connection,
+        opened by rc.db_connect, the one of the renderer being used by the
+        rendering thread meanwhile.
+
+        Args:
+           plugin_name (str): name of the plugin, in render_plugins.
+
+        Returns the plugin module, or None when this renderer lacks what
+        the plugin needs (see the plugins module).
+        """
+        registry = plugins.get_registry()
+        plugin = registry.get_plugin(plugin_name)
+
+        capabilities = registry.get_capabilities(plugin_name)
+        if plugins.NEEDS_DB in capabilities and self.db is None:
+            LOG.warning('Skipping plugin %s, no database.' % plugin_name)
+            return None
+        if (plugins.NEEDS_STREET_INDEX in capabilities
+                and getattr(self, 'street_index', None) is None):
+            LOG.info('Skipping plugin %s, no street index.' % plugin_name)
+            return None
+
+        if (hasattr(plugin, 'prefetch') and plugin_name not in self._prefetches
+                and getattr(self.rc, 'db_connect', None) is not None):
+            if self._prefetch_executor is None:
+                self._prefetch_executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix='ocitysmap-prefetch')
+            LOG.debug('Prefetching the data of plugin %s.' % plugin_name)
+            self._prefetches[plugin_name] = \
+                self._prefetch_executor.submit(self._prefetch, plugin)
+
+        return plugin
+
+    def _prefetch(self, plugin):
+        # run on the prefetch thread, with a database connection of its own
+        db = self.rc.db_connect()
+        try:
+            return plugin.prefetch(self, db)
+        finally:
+            db.close()
+
+    def get_prefetched(self, plugin_name):
+        """Return what the prefetch() function of a plugin returned, waiting
+        for it when needed.
+
+        Args:
+           plugin_name (str): name of the plugin, as given to get_plugin().
+
+        Returns None when the plugin was not prefetched, the renderer then
+        having no rc.db_connect. Raise the exception raised by prefetch(),
+        if any.
+        """
+        future = self._prefetches.get(plugin_name)
+        if future is None:
+            return None
+        return future.result()
+
+    def close(self):
+        """Stop the prefetches still running, once the renderer is done."""
+        if self._prefetch_executor is None:
+            return
+        for future in self._prefetches.values():
+            future.cancel()
+        self._prefetch_executor.shutdown(wait=True)
+        self._prefetch_executor = None
 
     # The next two methods are to be overloaded by the actual renderer.
     def render(self, cairo_surface, dpi):
@@ -349,8 +418,18 @@ class Renderer:
     def get_compatible_output_formats():
         return [ "png", "svgz", "pdf", "csv" ]
 
-    def _has_multipage_format(self):
-        if self.rc.output_format == 'pdf':
+    def renders_single_page(self, output_format):
+        """Whether the rendering to the given output format fits on a single
+        page. OCitySMap then draws it only once into a recording surface,
+        and replays it onto the surfaces of all the output formats.
+
+        Args:
+            output_format (str): the output format to render to.
+        """
+        return False
+
+    def _has_multipage_format(self, output_format=None):
+        if (output_format or self.rc.output_format) == 'pdf':
             return True
         return False
 
@@ -372,69 +451,65 @@ class Renderer:
 
     # convert geo into pixel coordinates for direct rendering of geo features
     # mostly needed by rendering overlay plugins
-    def _latlon2xy(self, lat, lon, dpi = None):
-        if dpi is None:
-            dpi = self.dpi
+    def _projection(self, dpi):
+        """Return the affine transform from geographic coordinates to the
+        device coordinates of the current map canvas.
 
-        bbox = self._map_canvas.get_actual_bounding_box()
-
-        vert_angle_span  = abs(bbox.get_top_left()[1] - bbox.get_bottom_right()[1])
-        horiz_angle_span = abs(bbox.get_top_left()[0] - bbox.get_bottom_right()[0])
+        Args:
+           dpi (number): resolution of the device.
 
-        y = bbox.get_top_left()[0] - lat
-        y*= (dpi/72.0) * self._map_coords[3] / horiz_angle_span
-        y+= (dpi/72.0) * self._map_coords[1]
+        Returns a tuple (ax, bx, ay, by), where x = ax * lon + bx and
+        y = ay * lat + by. It is computed once per map canvas, map area
+        and resolution.
+        """
+        bbox = self._map_canvas.get_actual_bounding_box()
+        map_coords = tuple(self._map_coords)
 
-        x = lon - bbox.get_top_left()[1]
-        x*= (dpi/72.0) * self._map_coords[2] / vert_angle_span
-        x+= (dpi/72.0) * self._map_coords[0]
+        cached = self._projection_cache
+        if (cached is not None and cached[0] is bbox
+                and cached[1] == map_coords and cached[2] == dpi):
+            return cached[3]
 
-        return x,y
+        top, left = bbox.get_top_left()
+        bottom, right = bbox.get_bottom_right()
+        dots_per_pt = dpi / 72.0
 
-    def _marker(self, color, txt, lat, lon, ctx, dpi):
+        ax = dots_per_pt * map_coords[2] / abs(left - right)
+        ay = - dots_per_pt * map_coords[3] / abs(top - bottom)
+        transform = (ax, dots_per_pt * map_coords[0] - ax * left,
+                     ay, dots_per_pt * map_coords[1] - ay * top)
 
-        marker_path = os.path.abspath(os.path.join(
-            os.path.dirname(__file__), '..', '..', 'images', 'marker.svg'))
+        self._projection_cache = (bbox, map_coords, dpi, transform)
+        return transform
 
-        fp = open(marker_path,'r')
-        data = fp.read()
-        fp.close()
+    def project_points(self, lats, lons, dpi = None):
+        """Convert geographic coordinates to device coordinates on the
+        current map canvas.
 
-        if color[0] != '#':
-            c = Color(color)
-            color = c.hex_l
+        Args:
+           lats (sequence): latitudes of the points.
+           lons (sequence): longitudes of the points, same length as lats.
+           dpi (number): resolution of the device, self.dpi by default.
 
-        data = data.replace('#000000', color)
+        Returns a tuple (numpy array of the x, numpy array of the y).
+        """
+        ax, bx, ay, by = self._projection(self.dpi if dpi is None else dpi)
+        xs = numpy.asarray(lons, dtype=float) * ax + bx
+        ys = numpy.asarray(lats, dtype=float) * ay + by
+        return xs, ys
 
-        rsvg = Rsvg.Handle()
-        svg = rsvg.new_from_data(data.encode())
+    def _latlon2xy(self, lat, lon, dpi = None):
+        ax, bx, ay, by = self._projection(self.dpi if dpi is None else dpi)
+        return lon * ax + bx, lat * ay + by
 
+    def _marker(self, color, txt, lat, lon, ctx, dpi):
         x,y = self._latlon2xy(lat, lon, dpi)
+        self._marker_at(color, txt, x, y, ctx, dpi)
 
-        scale = (50.0  / svg.props.height) * (dpi / 72.0)
-
-        x-= svg.props.width  * scale/2
-        y-= svg.props.height * scale
-
-        ctx.save()
-        ctx.translate(x, y)
-
-        ctx.scale(scale, scale)
-        svg.render_cairo(ctx)
-
-        pc = PangoCairo.create_context(ctx)
-        layout = PangoCairo.create_layout(ctx)
-        fd = Pango.FontDescription('Droid Sans')
-        fd.set_size(Pango.SCALE)
-        layout.set_font_description(fd)
-        layout.set_text(txt, -1)
-        draw_utils.adjust_font_size(layout, fd, svg.props.width/3, svg.props.width/3)
-        ink, logical = layout.get_extents()
-        ctx.translate(svg.props.width/2 - logical.width / svg.props.height, svg.props.height/5)
-        PangoCairo.update_layout(ctx, layout)
-        PangoCairo.show_layout(ctx, layout)
-
-        ctx.restore()
+    def _marker_at(self, color, txt, x, y, ctx, dpi):
+        """Draw a marker pointing to the (x, y) device coordinates, as
+        returned by project_points()."""
+        markers.MarkerLayer(ctx, dpi).draw(color, txt, x, y)
 
 
 
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+# ocitysmap, city map and street index generator from OpenStreetMap data
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Numbered map markers (POIs, OSM notes).
+
+The marker of each color is drawn once per resolution into a sprite,
+painted for every marker. A MarkerLayer draws the number labels of its
+markers with a single Pango layout, and can be asked to leave out the
+markers that would mostly hide the ones already drawn.
+"""
+
+import cairo
+import gi
+gi.require_version('Pango', '1.0')
+gi.require_version('PangoCairo', '1.0')
+from gi.repository import Pango, PangoCairo
+import logging
+import math
+import os
+from colour import Color
+
+from . import svg_assets
+from ocitysmap import draw_utils
+
+LOG = logging.getLogger('ocitysmap')
+
+MARKER_PATH = os.path.abspath(os.path.join(
+    os.path.dirname(__file__), '..', '..', 'images', 'marker.svg'))
+
+# height of the markers on the map
+MARKER_HEIGHT_PT = 50.0
+
+# (color, dpi) -> Sprite
+_sprites = {}
+_SPRITES_CACHE_SIZE = 64
+
+class Sprite:
+    """The marker of a color at a resolution, pointing to (0, 0)."""
+
+    def __init__(self, color, dpi):
+        """
+        Args:
+           color (str): color name or '#rrggbb' value of the marker.
+           dpi (number): resolution of the device.
+        """
+        if color[0] != '#':
+            color = Color(color).hex_l
+
+        svg = svg_assets.get_asset(MARKER_PATH, color)
+        _, self.svg_width, self.svg_height = svg
+        self.svg_scale = (MARKER_HEIGHT_PT / self.svg_height) * (dpi / 72.0)
+        self.width = self.svg_width * self.svg_scale
+        self.height = self.svg_height * self.svg_scale
+
+        self.surface = cairo.RecordingSurface(
+            cairo.CONTENT_COLOR_ALPHA,
+            cairo.Rectangle(0, 0, self.width, self.height))
+        ctx = cairo.Context(self.surface)
+        ctx.scale(self.svg_scale, self.svg_scale)
+        svg_assets.paint_asset(ctx, svg)
+
+    @staticmethod
+    def get(color, dpi):
+        """Return the sprite of a color at a resolution, drawn once."""
+        key = (color, dpi)
+        sprite = _sprites.get(key)
+        if sprite is None:
+            if len(_sprites) >= _SPRITES_CACHE_SIZE:
+                del _sprites[next(iter(_sprites))]
+            sprite = _sprites[key] = Sprite(color, dpi)
+        return sprite
+
+class MarkerLayer:
+    """Numbered markers drawn on a cairo context."""
+
+    # part of a marker that may be hidden by the markers drawn before it
+    MAX_HIDDEN_RATIO = 0.3
+
+    def __init__(self, ctx, dpi, cull_overlaps=False):
+        """
+        Args:
+           ctx (cairo.Context): the context to draw on.
+           dpi (number): resolution of the device.
+           cull_overlaps (bool): leave out the markers that would hide
+               each other.
+        """
+        self._ctx = ctx
+        self._dpi = dpi
+        self._cull_overlaps = cull_overlaps
+
+        self._layout = PangoCairo.create_layout(ctx)
+        self._font_desc = Pango.FontDescription('Droid Sans')
+        # label length -> font size fitting in the markers
+        self._font_sizes = {}
+
+        # (column, row) -> boxes of the markers drawn in that grid cell,
+        # the cells being as large as the markers
+        self._grid = {}
+        self._cell_size = None
+
+        self.drawn = 0
+        self.culled = 0
+
+    def _set_label(self, sprite, text):
+        # digits have the same width in most fonts, the labels of the same
+        # length share their font size
+        size = self._font_sizes.get(len(text))
+        if size is None:
+            self._font_desc.set_size(Pango.SCALE)
+            self._layout.set_font_description(self._font_desc)
+            self._layout.set_text('0' * len(text), -1)
+            draw_utils.adjust_font_size(self._layout, self._font_desc,
+                                        sprite.svg_width/3, sprite.svg_width/3)
+            size = self._font_sizes[len(text)] = self._font_desc.get_size()
+        else:
+            self._font_desc.set_size(size)
+            self._layout.set_font_description(self._font_desc)
+        self._layout.set_text(text, -1)
+
+    def _hides(self, box):
+        # whether the box would hide too much of, or be too hidden by,
+        # the markers drawn so far; record it otherwise
+        x, y, w, h = box
+        cw, ch = self._cell_size
+        cells = [(c, r)
+                 for c in range(int(math.floor(x / cw)),
+                                int(math.floor((x + w) / cw)) + 1)
+                 for r in range(int(math.floor(y / ch)),
+                                int(math.floor((y + h) / ch)) + 1)]
+
+        max_overlap = self.MAX_HIDDEN_RATIO * w * h
+        for cell in cells:
+            for (bx, by, bw, bh) in self._grid.get(cell, ()):
+                overlap_w = min(x + w, bx + bw) - max(x, bx)
+                overlap_h = min(y + h, by + bh) - max(y, by)
+                if (overlap_w > 0 and overlap_h > 0
+                        and overlap_w * overlap_h > max_overlap):
+                    return True
+
+        for cell in cells:
+            self._grid.setdefault(cell, []).append(box)
+        return False
+
+    def draw(self, color, text, x, y):
+        """Draw a marker pointing to a position.
+
+        Args:
+           color (str): color name or '#rrggbb' value of the marker.
+           text (str): label of the marker, usually its number.
+           x, y (numbers): device coordinates the marker points to.
+
+        Returns False when the marker was left out, because of the ones
+        already drawn.
+        """
+        sprite = Sprite.get(color, self._dpi)
+        x -= sprite.width / 2
+        y -= sprite.height
+
+        if self._cull_overlaps:
+            if self._cell_size is None:
+                self._cell_size = (sprite.width, sprite.height)
+            if self._hides((x, y, sprite.width, sprite.height)):
+                self.culled += 1
+                return False
+
+        ctx = self._ctx
+        ctx.save()
+        ctx.translate(x, y)
+        ctx.set_source_surface(sprite.surface, 0, 0)
+        ctx.rectangle(0, 0, sprite.width, sprite.height)
+        ctx.fill()
+
+        ctx.scale(sprite.svg_scale, sprite.svg_scale)
+        self._set_label(sprite, text)
+        ink, logical = self._layout.get_extents()
+        ctx.translate(sprite.svg_width/2 - logical.width / sprite.svg_height,
+                      sprite.svg_height/5)
+        PangoCairo.update_layout(ctx, self._layout)
+        PangoCairo.show_layout(ctx, self._layout)
+        ctx.restore()
+
+        self.drawn += 1
+        return True
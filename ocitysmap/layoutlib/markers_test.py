@@ -0,0 +1,63 @@
+# -*- coding: utf-8; mode: Python -*-
+import cairo
+import unittest
+from ocitysmap.layoutlib import markers
+
+class markers_test(unittest.TestCase):
+    def setUp(self):
+        markers._sprites.clear()
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, 1000, 1000)
+        self.ctx = cairo.Context(surface)
+
+    def test_sprite_cache(self):
+        sprite = markers.Sprite.get('red', 72)
+        self.assertIs(markers.Sprite.get('red', 72), sprite)
+        self.assertAlmostEqual(sprite.height, markers.MARKER_HEIGHT_PT)
+
+        high = markers.Sprite.get('red', 144)
+        self.assertIsNot(high, sprite)
+        self.assertAlmostEqual(high.height, 2 * sprite.height)
+
+        # the oldest sprite is dropped once the cache is full
+        for n in range(markers._SPRITES_CACHE_SIZE - 1):
+            markers.Sprite.get('#%06x' % n, 72)
+        self.assertNotIn(('red', 72), markers._sprites)
+        self.assertIn(('red', 144), markers._sprites)
+        self.assertEqual(len(markers._sprites), markers._SPRITES_CACHE_SIZE)
+
+    def test_hides(self):
+        layer = markers.MarkerLayer(self.ctx, 72, True)
+        layer._cell_size = (10, 20)
+
+        self.assertFalse(layer._hides((0, 0, 10, 20)))
+        # less than MAX_HIDDEN_RATIO of the marker covered
+        self.assertFalse(layer._hides((8, 0, 10, 20)))
+        # mostly covering the first one
+        self.assertTrue(layer._hides((1, 1, 10, 20)))
+        # overlapping a marker of the next grid cells
+        self.assertTrue(layer._hides((12, 2, 10, 20)))
+        self.assertFalse(layer._hides((100, 100, 10, 20)))
+
+        # only the markers not hidden are recorded
+        self.assertEqual(set(box for boxes in layer._grid.values()
+                             for box in boxes),
+                         set([(0, 0, 10, 20), (8, 0, 10, 20),
+                              (100, 100, 10, 20)]))
+
+    def test_draw(self):
+        positions = [(100, 100), (102, 101), (500, 500)]
+
+        layer = markers.MarkerLayer(self.ctx, 72, True)
+        drawn = [layer.draw('blue', str(n), x, y)
+                 for n, (x, y) in enumerate(positions, 1)]
+        self.assertEqual(drawn, [True, False, True])
+        self.assertEqual((layer.drawn, layer.culled), (2, 1))
+
+        layer = markers.MarkerLayer(self.ctx, 72)
+        for n, (x, y) in enumerate(positions, 1):
+            self.assertTrue(layer.draw('blue', str(n), x, y))
+        self.assertEqual((layer.drawn, layer.culled), (3, 0))
+        self.assertEqual(layer._grid, {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -21,7 +21,7 @@
 
 import cairo
 import datetime
-from itertools import groupby
+import heapq
 import locale
 import logging
 import mapnik
@@ -29,17 +29,29 @@ assert mapnik.mapnik_version() >= 300000, \
     "Mapnik module version %s is too old, see ocitysmap's INSTALL " \
     "for more details." % mapnik.mapnik_version_string()
 import math
+import multiprocessing
 import os
 import gi
-gi.require_version('Rsvg', '2.0')
 gi.require_version('Pango', '1.0')
 gi.require_version('PangoCairo', '1.0')
-from gi.repository import Rsvg, Pango, PangoCairo
+from gi.repository import Pango, PangoCairo
+try:
+    gi.require_version('Poppler', '0.18')
+    from gi.repository import Poppler
+except (ValueError, ImportError):
+    # only needed to draw the page maps in worker processes
+    Poppler = None
+import numpy
+import shapely.geometry
+import shapely.prepared
 import shapely.wkt
+from shapely.geometry.base import BaseGeometry
 from shapely.ops import cascaded_union
+from shapely.strtree import STRtree
 import sys
+import types
 from string import Template
-from functools import cmp_to_key
+from natsort import natsort_keygen, ns
 from copy import copy
 
 import ocitysmap
@@ -50,13 +62,76 @@ from ocitysmap.indexlib.commons import StreetIndexCategory
 from ocitysmap.indexlib.indexer import StreetIndex
 from ocitysmap.indexlib.multi_page_renderer import MultiPageStreetIndexRenderer
 from ocitysmap import draw_utils, maplib
-from ocitysmap.maplib.map_canvas import MapCanvas
+from ocitysmap.maplib.map_canvas import MapCanvas, SharedDatasources, \
+    predict_actual_scale
 from ocitysmap.maplib.grid import Grid
 from ocitysmap.maplib.overview_grid import OverviewGrid
 from ocitysmap.stylelib import GpxStylesheet, UmapStylesheet
 
 LOG = logging.getLogger('ocitysmap')
 
+# The renderer drawing the page maps in a worker process, see
+# _init_page_map_worker()
+_page_map_renderer = None
+
+def _init_page_map_worker(state):
+    """Set up a worker process of the parallel page rendering, from the
+    attributes of the renderer returned by
+    MultiPageRenderer._page_map_state().
+
+    The workers are started by a fork server, which does not inherit the
+    database connections or threads of the rendering process: mapnik
+    opens its own connections to draw the maps, and the datasources of
+    the map overlays are opened once per worker."""
+    global _page_map_renderer
+    renderer = MultiPageRenderer.__new__(MultiPageRenderer)
+    renderer.__dict__.update(state)
+    renderer._overlay_datasources = dict(
+        (overlay.path, SharedDatasources(overlay.path))
+        for overlay in renderer._page_overlays)
+    _page_map_renderer = renderer
+
+def _render_page_map_to_pdf(map_number):
+    """Worker process side of the parallel page rendering: draw the map
+    and map overlays of the given page into a one page PDF file of the
+    renderer temporary directory, and return its path."""
+    renderer = _page_map_renderer
+    canvas, overlay_canvases = renderer._prepare_page_canvases(map_number)
+    rendered_map = canvas.get_rendered_map()
+
+    path = os.path.join(renderer.tmpdir, 'page_map%d.pdf' % map_number)
+    surface = cairo.PDFSurface(path, rendered_map.width, rendered_map.height)
+    renderer._render_page_map(cairo.Context(surface), canvas, overlay_canvases)
+    surface.finish()
+    return path
+
+def _bbox_polygon(bbox):
+    """Return the shapely polygon of the given coords.BoundingBox."""
+    return shapely.geometry.box(bbox.get_left(), bbox.get_bottom(),
+                                bbox.get_right(), bbox.get_top())
+
+def _indexes_intersecting(geometries, area):
+    """Return the indexes of the geometries intersecting the given area.
+    Only the geometries whose bounding box overlaps the area, as found by
+    a STRtree, are tested against the prepared area."""
+    candidates = STRtree(geometries).query(area)
+    if len(candidates) and isinstance(candidates[0], BaseGeometry):
+        # shapely < 2 returns the geometries rather than their indexes
+        position = dict((id(g), n) for n, g in enumerate(geometries))
+        candidates = [position[id(g)] for g in candidates]
+
+    prepared_area = shapely.prepared.prep(area)
+    return [int(n) for n in candidates
+            if prepared_area.intersects(geometries[n])]
+
+def _paint_pdf_file(ctx, path):
+    """Replay the PDF file produced by _render_page_map_to_pdf on ctx.
+    Poppler draws its text as glyphs and its paths as vectors, so the
+    page map is the same as if it had been drawn on ctx directly."""
+    document = Poppler.Document.new_from_file('file://' + path, None)
+    document.get_page(0).render_for_printing(ctx)
+    os.remove(path)
+
 class MultiPageRenderer(Renderer):
     """
     This Renderer creates a multi-pages map, with all the classic overlayed
@@ -132,8 +207,7 @@ class MultiPageRenderer(Renderer):
         print(self.rc.bounding_box.as_javascript("original", "#00ff00"))
 
         # Convert the original Bounding box into Mercator meters
-        self._proj = mapnik.Projection(coords._MAPNIK_PROJECTION)
-        orig_envelope = self._project_envelope(self.rc.bounding_box)
+        orig_envelope = coords.project_envelope(self.rc.bounding_box)
 
         while True:
             # Extend the bounding box to take into account the lost outer
@@ -214,7 +288,7 @@ class MultiPageRenderer(Renderer):
 
         envelope = mapnik.Box2d(off_x, off_y, off_x + width, off_y + height)
 
-        self._geo_bbox = self._inverse_envelope(envelope)
+        self._geo_bbox = coords.inverse_envelope(envelope)
 
         # Debug: show transformed bounding box as JS code
         print(self._geo_bbox.as_javascript("extended", "#0f0f0f"))
@@ -234,33 +308,60 @@ class MultiPageRenderer(Renderer):
         # geographical area that will be rendered on each sheet of
         # paper.
         area_polygon = shapely.wkt.loads(self.rc.polygon_wkt)
+
+        # The horizontal position of a page depends on the parity of its
+        # number, so lay out the candidate pages of both parities, in
+        # Mercator meters then in lat/lon for all of them at once
+        cols = numpy.arange(self.nb_pages_width)
+        rows = numpy.arange(self.nb_pages_height)
+        cur_x, inner_x = {}, {}
+        for odd in (False, True):
+            cur_x[odd] = off_x + \
+                cols * (usable_area_merc_m_width - 2*print_bleed_merc_m - grayed_margin_inside_merc_m - grayed_margin_outside_merc_m) \
+                - print_bleed_merc_m - grayed_margin_inside_merc_m - grayed_margin_outside_merc_m \
+                + (grayed_margin_outside_merc_m if odd else grayed_margin_inside_merc_m)
+            inner_x[odd] = (cur_x[odd] + print_bleed_merc_m + (grayed_margin_inside_merc_m if odd else grayed_margin_outside_merc_m),
+                            cur_x[odd] + usable_area_merc_m_width - print_bleed_merc_m - (grayed_margin_outside_merc_m if odd else grayed_margin_inside_merc_m))
+        cur_y = off_y + \
+            rows * (usable_area_merc_m_height - 2*print_bleed_merc_m - 2*grayed_margin_top_bottom_merc_m) \
+            - print_bleed_merc_m - grayed_margin_top_bottom_merc_m
+        inner_y = (cur_y + print_bleed_merc_m + grayed_margin_top_bottom_merc_m,
+                   cur_y + usable_area_merc_m_height - print_bleed_merc_m - grayed_margin_top_bottom_merc_m)
+
+        lons, inner_lons = {}, {}
+        for odd in (False, True):
+            lons[odd] = (coords.mercator_inverse(cur_x[odd], 0)[0],
+                         coords.mercator_inverse(cur_x[odd] + usable_area_merc_m_width, 0)[0])
+            inner_lons[odd] = (coords.mercator_inverse(inner_x[odd][0], 0)[0],
+                               coords.mercator_inverse(inner_x[odd][1], 0)[0])
+        lats = (coords.mercator_inverse(0, cur_y)[1],
+                coords.mercator_inverse(0, cur_y + usable_area_merc_m_height)[1])
+        inner_lats = (coords.mercator_inverse(0, inner_y[0])[1],
+                      coords.mercator_inverse(0, inner_y[1])[1])
+
+        candidates = [(odd, i, j) for odd in (False, True)
+                      for i in range(self.nb_pages_width)
+                      for j in range(self.nb_pages_height)]
+        candidate_rects = [shapely.geometry.box(inner_lons[odd][0][i], inner_lats[0][j],
+                                                inner_lons[odd][1][i], inner_lats[1][j])
+                           for odd, i, j in candidates]
+        touching = set(candidates[n] for n in
+                       _indexes_intersecting(candidate_rects, area_polygon))
+
         bboxes = []
         self.page_disposition, map_number = {}, 0
         for j in reversed(range(0, self.nb_pages_height)):
             row = self.nb_pages_height - j - 1
             self.page_disposition[row] = []
             for i in range(0, self.nb_pages_width):
-                cur_x = off_x + \
-                    i * (usable_area_merc_m_width - 2*print_bleed_merc_m - grayed_margin_inside_merc_m - grayed_margin_outside_merc_m) \
-                    - print_bleed_merc_m - grayed_margin_inside_merc_m - grayed_margin_outside_merc_m \
-                    + (grayed_margin_outside_merc_m if (map_number + self._first_map_page_number) % 2 else grayed_margin_inside_merc_m)
-                cur_y = off_y + \
-                    j * (usable_area_merc_m_height - 2*print_bleed_merc_m - 2*grayed_margin_top_bottom_merc_m) \
-                    - print_bleed_merc_m - grayed_margin_top_bottom_merc_m
-                #print("page", (self._first_map_page_number + map_number), row, "col", i, "row", j, "{:10.4f}".format(cur_x), "{:10.4f}".format(cur_x - off_x), "{:10.4f}".format(cur_y), "{:10.4f}".format(cur_y - off_y))
-                envelope = mapnik.Box2d(cur_x, cur_y,
-                                        cur_x+usable_area_merc_m_width,
-                                        cur_y+usable_area_merc_m_height)
-
-                envelope_inner = mapnik.Box2d(cur_x + print_bleed_merc_m + (grayed_margin_inside_merc_m if (self._first_map_page_number + map_number) % 2 else grayed_margin_outside_merc_m),
-                                              cur_y + print_bleed_merc_m + grayed_margin_top_bottom_merc_m,
-                                              cur_x + usable_area_merc_m_width - print_bleed_merc_m - (grayed_margin_outside_merc_m if (map_number + self._first_map_page_number) % 2 else grayed_margin_inside_merc_m),
-                                              cur_y + usable_area_merc_m_height - print_bleed_merc_m - grayed_margin_top_bottom_merc_m)
-                inner_bb = self._inverse_envelope(envelope_inner)
-                if not area_polygon.disjoint(shapely.wkt.loads(inner_bb.as_wkt())):
+                odd = bool((map_number + self._first_map_page_number) % 2)
+                if (odd, i, j) in touching:
                     self.page_disposition[row].append(map_number)
                     map_number += 1
-                    bboxes.append((self._inverse_envelope(envelope), inner_bb))
+                    bboxes.append((coords.BoundingBox(lats[0][j], lons[odd][0][i],
+                                                      lats[1][j], lons[odd][1][i]),
+                                   coords.BoundingBox(inner_lats[0][j], inner_lons[odd][0][i],
+                                                      inner_lats[1][j], inner_lons[odd][1][i])))
                 else:
                     self.page_disposition[row].append(None)
 
@@ -268,8 +369,6 @@ class MultiPageRenderer(Renderer):
         #for i, (bb, bb_inner) in enumerate(bboxes):
         #   print(bb_inner.as_javascript(name="p%d" % i))
 
-        self.pages = []
-
         overview_topleft = self._geo_bbox.get_top_left()
         overview_bottomright = self._geo_bbox.get_bottom_right()
         overview_lat_abs = math.fabs(overview_topleft[0]-overview_bottomright[0])
@@ -285,8 +384,7 @@ class MultiPageRenderer(Renderer):
         self.overview_grid = OverviewGrid(overview_bb,
                      [bb_inner for bb, bb_inner in bboxes], self.rc.i18n.isrtl())
 
-        grid_shape = self.overview_grid.generate_shape_file(
-                    os.path.join(self.tmpdir, 'grid_overview.shp'))
+        grid_shape = self.overview_grid.generate_shape_file()
 
         # Create a canvas for the overview page
         self.overview_canvas = MapCanvas(self.rc.stylesheet,
@@ -297,14 +395,13 @@ class MultiPageRenderer(Renderer):
         # Create the gray shape around the overview map
         exterior = shapely.wkt.loads(self.overview_canvas.get_actual_bounding_box()\
                                                                 .as_wkt())
-        interior = shapely.wkt.loads(self.rc.polygon_wkt)
+        interior = area_polygon
         #DEBUG: print whole city als wkt-string
         #print("WktString('%s', 'whole-shape')" % interior)
 
         shade_wkt = exterior.difference(interior).wkt
-        shade = maplib.shapes.PolyShapeFile(self.rc.bounding_box,
-                os.path.join(self.tmpdir, 'shape_overview.shp'),
-                             'shade-overview')
+        shade = maplib.shapes.PolyShapeFile(self.rc.bounding_box, None,
+                                            'shade-overview')
         shade.add_shade_from_wkt(shade_wkt)
 
         if self.rc.osmids != None:
@@ -317,28 +414,41 @@ class MultiPageRenderer(Renderer):
 
         self._overlays = copy(self.rc.overlays)
         
-        # generate style file for GPX file
+        # generate style file for GPX file, its tracks simplified to the
+        # scale of the pages
         if self.rc.gpx_file:
-            self._overlays.append(GpxStylesheet(self.rc.gpx_file, self.tmpdir))
+            self._overlays.append(GpxStylesheet(self.rc.gpx_file, self.tmpdir,
+                                                commons.convert_pt_to_mm(1) * scale_denom / 1000))
 
         # denormalize UMAP json to geojson, then create style for it
         if self.rc.umap_file:
             self._overlays.append(UmapStylesheet(self.rc.umap_file, self.tmpdir))
 
+        # The datasources of the map overlays are opened once, and shared
+        # by the overview, front page and page maps
+        self._overlay_datasources = {}
+        for overlay in self._overlays:
+            if not overlay.path.strip().startswith('internal:'):
+                self._overlay_datasources[overlay.path] = \
+                    SharedDatasources(overlay.path)
+
         self.overview_overlay_canvases = []
         self.overview_overlay_effects = []
         
         for overlay in self._overlays:
             path = overlay.path.strip()
             if path.startswith('internal:'):
-                self.overview_overlay_effects.append(self.get_plugin(path.lstrip('internal:')))
+                plugin = self.get_plugin(path.lstrip('internal:'))
+                if plugin is not None:
+                    self.overview_overlay_effects.append(plugin)
             else:
                 ov_canvas = MapCanvas(overlay,
                                       overview_bb,
                                       self._usable_map_area_width_pt,
                                       self._usable_map_area_height_pt,
                                       dpi,
-                                      extend_bbox_to_ratio=True)
+                                      extend_bbox_to_ratio=True,
+                                      datasources=self._overlay_datasources[overlay.path])
                 ov_canvas.render()
                 self.overview_overlay_canvases.append(ov_canvas)
 
@@ -365,77 +475,45 @@ class MultiPageRenderer(Renderer):
                         #index.apply_grid(map_grid)
                         indexes[name].append(index)
 
+        # Effect plugins and map overlays are the same for all the pages
+        self._page_overlay_effects = []
+        self._page_overlays = []
+        for overlay in self._overlays:
+            path = overlay.path.strip()
+            if path.startswith('internal:'):
+                plugin = self.get_plugin(path.lstrip('internal:'))
+                if plugin is not None:
+                    self._page_overlay_effects.append(plugin)
+            else:
+                self._page_overlays.append(overlay)
+
+        # Only the grids and indexes of the pages are computed here, their
+        # map canvases are created one page at a time while rendering, see
+        # _prepare_page_canvases()
+        self._area_polygon = area_polygon
+        self._pages_bboxes = bboxes
+        self._page_grids = []
+        # part of the area shown on each page
+        self._page_area_pieces = []
+        named_areas = [(name, polygon, shapely.prepared.prep(polygon))
+                       for name, polygon
+                       in (self.rc.name_to_polygon or {}).items()]
         for i, (bb, bb_inner) in enumerate(bboxes):
             # print(bb.as_javascript(name="p%d - bb" % i))
             # print(bb_inner.as_javascript(name="p%d - bb_inner" % i))
 
-            # Create the gray shape around the map
-            exterior = shapely.wkt.loads(bb.as_wkt())
-            interior = shapely.wkt.loads(bb_inner.as_wkt())
-            shade_wkt = exterior.difference(interior).wkt
-            shade = maplib.shapes.PolyShapeFile(
-                bb, os.path.join(self.tmpdir, 'shade%d.shp' % i),
-                'shade%d' % i)
-            shade.add_shade_from_wkt(shade_wkt)
-
-            # Create the contour shade
-
-            # Area to keep visible
-            interior_contour = shapely.wkt.loads(self.rc.polygon_wkt)
-            # Determine the shade WKT
-            shade_contour_wkt = interior.difference(interior_contour).wkt
-            # Prepare the shade SHP
-            shade_contour = maplib.shapes.PolyShapeFile(bb,
-                os.path.join(self.tmpdir, 'shade_contour%d.shp' % i),
-                'shade_contour%d' % i)
-            shade_contour.add_shade_from_wkt(shade_contour_wkt)
-
-
-            # Create one canvas for the current page
-            map_canvas = MapCanvas(self.rc.stylesheet,
-                                   bb, self._usable_map_area_width_pt,
-                                   self._usable_map_area_height_pt, dpi,
-                                   extend_bbox_to_ratio=False)
-
-            # Create canvas for overlay on current page
-            overlay_canvases = []
-            overlay_effects  = []
-            for overlay in self._overlays:
-                path = overlay.path.strip()
-                if path.startswith('internal:'):
-                    overlay_effects.append(self.get_plugin(path.lstrip('internal:')))
-                else:
-                    overlay_canvases.append(MapCanvas(overlay,
-                                               bb, self._usable_map_area_width_pt,
-                                               self._usable_map_area_height_pt, dpi,
-                                               extend_bbox_to_ratio=False))
-
             # Create the grid
-            map_grid = Grid(bb_inner, map_canvas.get_actual_scale(), self.rc.i18n.isrtl())
-            grid_shape = map_grid.generate_shape_file(
-                os.path.join(self.tmpdir, 'grid%d.shp' % i))
-
-            map_canvas.add_shape_file(shade)
-            if self.rc.osmids != None:
-                map_canvas.add_shape_file(shade_contour,
-                                          self.rc.stylesheet.shade_color_2,
-                                          self.rc.stylesheet.shade_alpha_2)
-            map_canvas.add_shape_file(grid_shape,
-                                      self.rc.stylesheet.grid_line_color,
-                                      self.rc.stylesheet.grid_line_alpha,
-                                      self.rc.stylesheet.grid_line_width)
-
-            map_canvas.render()
+            scale = predict_actual_scale(bb, self._usable_map_area_width_pt,
+                                         self._usable_map_area_height_pt, dpi)
+            map_grid = Grid(bb_inner, scale, self.rc.i18n.isrtl())
+            self._page_grids.append(map_grid)
 
-            for overlay_canvas in overlay_canvases:
-                overlay_canvas.render()
+            area_piece = area_polygon.intersection(_bbox_polygon(bb_inner))
+            self._page_area_pieces.append(area_piece)
 
-            self.pages.append((map_canvas, map_grid, overlay_canvases, overlay_effects))
-
-            if self.rc.name_to_polygon:
-                interior_intersected = interior_contour.intersection(interior)
-                for name in self.rc.name_to_polygon:
-                    inside_contour_wkt = interior_intersected.intersection(self.rc.name_to_polygon[name])
+            for name, polygon, prepared_polygon in named_areas:
+                if prepared_polygon.intersects(area_piece):
+                    inside_contour_wkt = area_piece.intersection(polygon)
                     if not inside_contour_wkt.is_empty:
                         # Create the index for the current page
                         # inside_contour_wkt = interior_contour.intersection(interior).wkt
@@ -459,104 +537,82 @@ class MultiPageRenderer(Renderer):
 
     def _merge_page_indexes(self, indexes):
         # First, we split street categories and "other" categories,
-        # because we sort them and we don't want to have the "other"
-        # categories intermixed with the street categories. This
-        # sorting is required for the groupby Python operator to work
-        # properly.
-        all_categories_streets = []
-        all_categories_others  = []
-        for page_number, idx in enumerate(indexes):
+        # because we don't want to have the "other" categories
+        # intermixed with the street categories. Within each of them,
+        # the items of the categories having the same name (i.e category
+        # for letter 'A' from page 1, category for letter 'A' from page
+        # 3) are kept as one run per page.
+        street_runs = {}
+        other_runs  = {}
+        for idx in indexes:
             for cat in idx.categories:
-                # Split in two lists depending on the category type
-                # (street or other)
-                if cat.is_street:
-                    all_categories_streets.append(cat)
-                else:
-                    all_categories_others.append(cat)
-
-        all_categories_streets_merged = \
-            self._merge_index_same_categories(all_categories_streets, is_street=True)
-        all_categories_others_merged = \
-            self._merge_index_same_categories(all_categories_others, is_street=False)
+                runs = street_runs if cat.is_street else other_runs
+                runs.setdefault(cat.name, []).append(cat.items)
 
-        all_categories_merged = \
-            all_categories_streets_merged + all_categories_others_merged
-
-        return all_categories_merged
+        prev_locale = locale.getlocale(locale.LC_COLLATE)
+        try:
+            locale.setlocale(locale.LC_COLLATE, self.rc.i18n.language_code())
+        except Exception:
+            LOG.warning('error while setting LC_COLLATE to "%s"'
+                        % self.rc.i18n.language_code())
 
-    def _my_cmp(self, x, y):
-        return locale.strcoll(x.label, y.label)
+        try:
+            # The keys the page indexes are sorted with, see
+            # StreetIndex._convert_street_index() and
+            # StreetIndex._group_identical_grid_locations()
+            street_key = natsort_keygen(alg=ns.LOCALE|ns.IGNORECASE,
+                                        key=lambda item: item.label)
+            other_key = natsort_keygen(
+                key=lambda item: (item.label, item.location_str))
+
+            return (self._merge_index_same_categories(street_runs, street_key,
+                                                      is_street=True)
+                    + self._merge_index_same_categories(other_runs, other_key,
+                                                        is_street=False))
+        finally:
+            locale.setlocale(locale.LC_COLLATE, prev_locale)
 
-    def _merge_index_same_categories(self, categories, is_street=True):
-        # Sort by categories. Now we may have several consecutive
-        # categories with the same name (i.e category for letter 'A'
-        # from page 1, category for letter 'A' from page 3).
-        categories.sort(key=lambda s:s.name)
+    def _merge_index_same_categories(self, categories, sort_key,
+                                     is_street=True):
+        """Merge the per-page runs of IndexItem of each category.
 
+        Args:
+            categories (dict): category name -> list of the IndexItem
+                lists of this category, one per page.
+            sort_key (function): key the runs of IndexItem are sorted
+                with.
+            is_street (bool): whether the categories are street ones.
+
+        Returns the list of the merged StreetIndexCategory, sorted by
+        name.
+        """
         categories_merged = []
-        for category_name,grouped_categories in groupby(categories,
-                                                        key=lambda s:s.name):
-
-            # Group the different IndexItem from categories having the
-            # same name. The groupby() function guarantees us that
-            # categories with the same name are grouped together in
-            # grouped_categories[].
-
-            grouped_items = []
-            for cat in grouped_categories:
-                grouped_items.extend(cat.items)
-
-            # Re-sort alphabetically all the IndexItem according to
-            # the street name.
-
-            prev_locale = locale.getlocale(locale.LC_COLLATE)
-            try:
-                locale.setlocale(locale.LC_COLLATE, self.rc.i18n.language_code())
-            except Exception:
-                l.warning('error while setting LC_COLLATE to "%s"' % self._i18n.language_code())
-
-            try:
-                grouped_items_sorted = \
-                    sorted(grouped_items, key = cmp_to_key(self._my_cmp))        
-            finally:
-                locale.setlocale(locale.LC_COLLATE, prev_locale)
-
-            self._blank_duplicated_names(grouped_items_sorted)
+        for category_name in sorted(categories):
+            merged_items = list(heapq.merge(*categories[category_name],
+                                            key=sort_key))
+            # the merge keeps the order of each run, so this only holds
+            # when every run is sorted
+            assert all(sort_key(a) <= sort_key(b) for a, b
+                       in zip(merged_items, merged_items[1:])), \
+                'unsorted index run in category %s' % category_name
+
+            # We set the label to empty string in case of duplicated
+            # item. In multi-page renderer we won't draw the dots in that
+            # case
+            prev_label = ''
+            for item in merged_items:
+                if prev_label == item.label:
+                    item.label = ''
+                else:
+                    prev_label = item.label
 
             # Rebuild a IndexCategory object with the list of merged
             # and sorted IndexItem
             categories_merged.append(
-                StreetIndexCategory(category_name, grouped_items_sorted, is_street))
+                StreetIndexCategory(category_name, merged_items, is_street))
 
         return categories_merged
 
-    # We set the label to empty string in case of duplicated item. In
-    # multi-page renderer we won't draw the dots in that case
-    def _blank_duplicated_names(self, grouped_items_sorted):
-        prev_label = ''
-        for item in grouped_items_sorted:
-            if prev_label == item.label:
-                item.label = ''
-            else:
-                prev_label = item.label
-
-    def _project_envelope(self, bbox):
-        """Project the given bounding box into the rendering projection."""
-        envelope = mapnik.Box2d(bbox.get_top_left()[1],
-                                bbox.get_top_left()[0],
-                                bbox.get_bottom_right()[1],
-                                bbox.get_bottom_right()[0])
-        c0 = self._proj.forward(mapnik.Coord(envelope.minx, envelope.miny))
-        c1 = self._proj.forward(mapnik.Coord(envelope.maxx, envelope.maxy))
-        return mapnik.Box2d(c0.x, c0.y, c1.x, c1.y)
-
-    def _inverse_envelope(self, envelope):
-        """Inverse the given cartesian envelope (in 3587) back to a 4326
-        bounding box."""
-        c0 = self._proj.inverse(mapnik.Coord(envelope.minx, envelope.miny))
-        c1 = self._proj.inverse(mapnik.Coord(envelope.maxx, envelope.maxy))
-        return coords.BoundingBox(c0.y, c0.x, c1.y, c1.x)
-
     def _prepare_front_page_map(self, dpi):
         front_page_map_w = \
             self._usable_map_area_width_pt #- 2 * Renderer.PRINT_BLEED_PT
@@ -575,11 +631,9 @@ class MultiPageRenderer(Renderer):
         # Add the shape that greys out everything that is outside of
         # the administrative boundary.
         exterior = shapely.wkt.loads(front_page_map.get_actual_bounding_box().create_expanded2(0.2,0.2,0.2,0.2).as_wkt())
-        interior = shapely.wkt.loads(self.rc.polygon_wkt)
-        shade_wkt = exterior.difference(interior).wkt
-        shade = maplib.shapes.PolyShapeFile(self.rc.bounding_box,
-                os.path.join(self.tmpdir, 'shape_overview_cover.shp'),
-                             'shade-overview-cover')
+        shade_wkt = exterior.difference(self._area_polygon).wkt
+        shade = maplib.shapes.PolyShapeFile(self.rc.bounding_box, None,
+                                            'shade-overview-cover')
         shade.add_shade_from_wkt(shade_wkt)
         front_page_map.add_shape_file(shade)
         front_page_map.render()
@@ -590,14 +644,17 @@ class MultiPageRenderer(Renderer):
         for overlay in self._overlays:
             path = overlay.path.strip()
             if path.startswith('internal:'):
-                self._frontpage_overlay_effects.append(self.get_plugin(path.lstrip('internal:')))
+                plugin = self.get_plugin(path.lstrip('internal:'))
+                if plugin is not None:
+                    self._frontpage_overlay_effects.append(plugin)
             else:
                 ov_canvas = MapCanvas(overlay,
                                       self.rc.bounding_box,
                                       front_page_map_w,
                                       front_page_map_h,
                                       dpi,
-                                      extend_bbox_to_ratio=True)
+                                      extend_bbox_to_ratio=True,
+                                      datasources=self._overlay_datasources[overlay.path])
                 ov_canvas.render()
                 self._frontpage_overlay_canvases.append(ov_canvas)
 
@@ -1045,23 +1102,143 @@ class MultiPageRenderer(Renderer):
 
         ctx.restore()
 
-    def render(self, cairo_surface, dpi, osm_date):
-        ctx = cairo.Context(cairo_surface)
+    def _create_page_map_canvas(self, map_number, stylesheet=None):
+        bb, bb_inner = self._pages_bboxes[map_number]
+        if stylesheet is None:
+            stylesheet, datasources = self.rc.stylesheet, None
+        else:
+            datasources = self._overlay_datasources[stylesheet.path]
+        return MapCanvas(stylesheet,
+                         bb, self._usable_map_area_width_pt,
+                         self._usable_map_area_height_pt, self.dpi,
+                         extend_bbox_to_ratio=False,
+                         datasources=datasources)
+
+    def _prepare_page_canvases(self, map_number):
+        """Create and render the map canvas of the given page, with its
+        shades and grid, and the canvases of its map overlays.
+
+        Returns a (map_canvas, overlay_canvases) tuple."""
+        bb, bb_inner = self._pages_bboxes[map_number]
+
+        # Create the gray shape around the map
+        exterior = _bbox_polygon(bb)
+        interior = _bbox_polygon(bb_inner)
+        shade_wkt = exterior.difference(interior).wkt
+        shade = maplib.shapes.PolyShapeFile(bb, None, 'shade%d' % map_number)
+        shade.add_shade_from_wkt(shade_wkt)
 
-        # translate all pages by PRINT_SAFE_MARGIN_PT
-        ctx.save()        
-        ctx.translate(
-            commons.convert_pt_to_dots(Renderer.PRINT_SAFE_MARGIN_PT),
-            commons.convert_pt_to_dots(Renderer.PRINT_SAFE_MARGIN_PT))
-        
-        self._render_front_page(ctx, cairo_surface, dpi, osm_date)
-        #self._render_blank_page(ctx, cairo_surface, dpi, 2)
+        # Create the contour shade
+        shade_contour_wkt = \
+            interior.difference(self._page_area_pieces[map_number]).wkt
+        shade_contour = maplib.shapes.PolyShapeFile(bb, None,
+            'shade_contour%d' % map_number)
+        shade_contour.add_shade_from_wkt(shade_contour_wkt)
 
-        ctx.save()
+        # Create one canvas for the current page
+        map_canvas = self._create_page_map_canvas(map_number)
+
+        # Create canvas for overlay on current page
+        overlay_canvases = [self._create_page_map_canvas(map_number, overlay)
+                            for overlay in self._page_overlays]
 
-        self._render_overview_page(ctx, cairo_surface, dpi, 1)
+        grid_shape = self._page_grids[map_number].generate_shape_file()
 
-        for map_number, (canvas, grid, overlay_canvases, overlay_effects) in enumerate(self.pages):
+        map_canvas.add_shape_file(shade)
+        if self.rc.osmids != None:
+            map_canvas.add_shape_file(shade_contour,
+                                      self.rc.stylesheet.shade_color_2,
+                                      self.rc.stylesheet.shade_alpha_2)
+        map_canvas.add_shape_file(grid_shape,
+                                  self.rc.stylesheet.grid_line_color,
+                                  self.rc.stylesheet.grid_line_alpha,
+                                  self.rc.stylesheet.grid_line_width)
+
+        map_canvas.render()
+
+        for overlay_canvas in overlay_canvases:
+            overlay_canvas.render()
+
+        return map_canvas, overlay_canvases
+
+    def _render_page_map(self, ctx, canvas, overlay_canvases):
+        """Draw the map of a page and its map overlays on ctx."""
+        mapnik.render(canvas.get_rendered_map(), ctx)
+
+        for overlay_canvas in overlay_canvases:
+            mapnik.render(overlay_canvas.get_rendered_map(), ctx)
+
+    def _draw_page_map(self, ctx, map_number):
+        """Prepare the given page and draw its map on ctx. Returns the page
+        map canvas."""
+        canvas, overlay_canvases = self._prepare_page_canvases(map_number)
+        self._render_page_map(ctx, canvas, overlay_canvases)
+        return canvas
+
+    def _page_map_state(self):
+        """Return the attributes of the renderer needed to draw the page
+        maps, sent to the worker processes drawing them."""
+        return {
+            'rc': types.SimpleNamespace(stylesheet=self.rc.stylesheet,
+                                        osmids=self.rc.osmids),
+            'tmpdir': self.tmpdir,
+            'dpi': self.dpi,
+            '_usable_map_area_width_pt': self._usable_map_area_width_pt,
+            '_usable_map_area_height_pt': self._usable_map_area_height_pt,
+            '_pages_bboxes': self._pages_bboxes,
+            '_page_area_pieces': self._page_area_pieces,
+            '_page_grids': self._page_grids,
+            '_page_overlays': self._page_overlays,
+        }
+
+    def _start_page_maps_rendering(self):
+        """Start drawing the map of every page.
+
+        With more than one process, the page maps are drawn concurrently
+        by worker processes into PDF files, which are replayed on the
+        final surface in page order. Everything else on the map pages,
+        including the links and page labels, is still drawn by the main
+        process.
+
+        Returns a (pool, painters) tuple: the worker pool, to terminate
+        once the pages are rendered, or None when drawing in the main
+        process, and an iterator giving, in page order, a function drawing
+        the page map on a cairo context. The function returns the page
+        MapCanvas when it was created by the main process, None otherwise.
+
+        Pages are prepared lazily, one at a time, and nothing keeps them
+        once drawn.
+        """
+        page_count = len(self._pages_bboxes)
+        processes = min(self.rc.multipg_processes or 1, page_count)
+        if processes > 1 and Poppler is None:
+            LOG.warning('Poppler introspection data not found, drawing the '
+                        'map pages in the rendering process')
+            processes = 1
+
+        if processes < 2:
+            painters = (lambda ctx, map_number=map_number:
+                            self._draw_page_map(ctx, map_number)
+                        for map_number in range(page_count))
+            return None, painters
+
+        LOG.info('Drawing %d map pages with %d processes'
+                 % (page_count, processes))
+        # Forking this process would share its database connections, and
+        # the locks of its threads, with the workers
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload([__name__])
+        pool = context.Pool(processes, _init_page_map_worker,
+                            (self._page_map_state(),))
+        paths = pool.imap(_render_page_map_to_pdf, range(page_count))
+        painters = (lambda ctx, path=path: _paint_pdf_file(ctx, path)
+                    for path in paths)
+        return pool, painters
+
+    def _render_map_pages(self, ctx, cairo_surface, page_map_painters):
+        """Render the map pages, their maps being drawn by the functions
+        given by page_map_painters (see _start_page_maps_rendering())."""
+        for map_number, grid in enumerate(self._page_grids):
             if Renderer.DEBUG: # show area excluding bleed-difference
                 margin_x = Renderer.PRINT_BLEED_PT
                 margin_y = Renderer.PRINT_BLEED_PT
@@ -1086,8 +1263,7 @@ class MultiPageRenderer(Renderer):
                 ctx.restore()
 
             ctx.save()
-            #LOG.info('Map page %d of %d' % (map_number + 1, len(self.pages)))
-            rendered_map = canvas.get_rendered_map()
+            #LOG.info('Map page %d of %d' % (map_number + 1, len(self._pages_bboxes)))
             # LOG.debug('Mapnik scale: 1/%f' % rendered_map.scale_denominator())
             # LOG.debug('Actual scale: 1/%f' % canvas.get_actual_scale())
 
@@ -1097,11 +1273,7 @@ class MultiPageRenderer(Renderer):
             dest_tag = "mypage%d" % (map_number + self._first_map_page_number)
             draw_utils.anchor(ctx, dest_tag)
 
-            mapnik.render(rendered_map, ctx)
-
-            for overlay_canvas in overlay_canvases:
-                rendered_overlay = overlay_canvas.get_rendered_map()
-                mapnik.render(rendered_overlay, ctx)
+            canvas = next(page_map_painters)(ctx)
 
             # Place the vertical and horizontal square labels
             ctx.save()
@@ -1123,8 +1295,12 @@ class MultiPageRenderer(Renderer):
             # we have to undo border adjustments here
             ctx.translate(-commons.convert_pt_to_dots(self.grayed_margin_inside_pt)/2,
                         -commons.convert_pt_to_dots(self.grayed_margin_top_bottom_pt)/2)
-            self._map_canvas = canvas
-            for effect in overlay_effects:
+            if self._page_overlay_effects:
+                if canvas is None:
+                    # the page map was drawn by a worker process
+                    canvas = self._create_page_map_canvas(map_number)
+                self._map_canvas = canvas
+            for effect in self._page_overlay_effects:
                 self.grid = grid
                 effect.render(self, ctx)
             ctx.restore()
@@ -1140,13 +1316,42 @@ class MultiPageRenderer(Renderer):
                                             Renderer.PRINT_BLEED_PT,
                                             transparent_background = True)
             self._render_neighbour_arrows(ctx, cairo_surface, map_number,
-                                            len(str(len(self.pages) + self._first_map_page_number)))
+                                            len(str(len(self._pages_bboxes) + self._first_map_page_number)))
 
             cairo_surface.set_page_label('Map page %d' % (map_number + self._first_map_page_number))
             cairo_surface.show_page()
             ctx.restore()
 
-        ctx.restore()
+            # release the page map before preparing the next one
+            canvas = self._map_canvas = None
+
+    def render(self, cairo_surface, dpi, osm_date):
+        ctx = cairo.Context(cairo_surface)
+
+        # translate all pages by PRINT_SAFE_MARGIN_PT
+        ctx.save()        
+        ctx.translate(
+            commons.convert_pt_to_dots(Renderer.PRINT_SAFE_MARGIN_PT),
+            commons.convert_pt_to_dots(Renderer.PRINT_SAFE_MARGIN_PT))
+        
+        # Start drawing the page maps while the front and overview pages
+        # are being rendered
+        pool, page_map_painters = self._start_page_maps_rendering()
+        try:
+            self._render_front_page(ctx, cairo_surface, dpi, osm_date)
+            #self._render_blank_page(ctx, cairo_surface, dpi, 2)
+
+            ctx.save()
+
+            self._render_overview_page(ctx, cairo_surface, dpi, 1)
+
+            self._render_map_pages(ctx, cairo_surface, page_map_painters)
+
+            ctx.restore()
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
 
         mpsir = MultiPageStreetIndexRenderer(self.rc.i18n,
                                              ctx, cairo_surface,
@@ -1154,7 +1359,8 @@ class MultiPageRenderer(Renderer):
                                              (self._usable_map_area_width_pt, self._usable_map_area_height_pt),
                                              (self.grayed_margin_inside_pt, self.grayed_margin_outside_pt, self.grayed_margin_top_bottom_pt),
                                              Renderer.PRINT_BLEED_PT,
-                                             len(self.pages) + 1 + self.rc.ins_pgs_bef_idx)
+                                             len(self._pages_bboxes) + 1 + self.rc.ins_pgs_bef_idx,
+                                             self.text_measurements)
 
         mpsir.render()
 
@@ -1197,23 +1403,27 @@ class MultiPageRenderer(Renderer):
         bottom, left = bottom_right.y, top_left.x
         coord_delta_y = top_left.y - bottom_right.y
         coord_delta_x = bottom_right.x - top_left.x
-        w, h = None, None
-        for idx, page_bb in enumerate(overview_grid._pages_bbox):
-            p_bottom_right, p_bottom_left, p_top_left, p_top_right = \
-                                                        page_bb.to_mercator()
-            center_x = p_top_left.x+(p_top_right.x-p_top_left.x)/2
-            center_y = p_bottom_left.y+(p_top_right.y-p_bottom_right.y)/2
-            y_percent = 100 - 100.0*(center_y - bottom)/coord_delta_y
-            y = int(area_height_dots*y_percent/100)
 
-            x_percent = 100.0*(center_x - left)/coord_delta_x
-            x = int(area_width_dots*x_percent/100)
+        # project the corners of all the pages at once
+        pages_bbox = overview_grid._pages_bbox
+        lefts, bottoms = coords.mercator_forward(
+            [bb.get_left() for bb in pages_bbox],
+            [bb.get_bottom() for bb in pages_bbox])
+        rights, tops = coords.mercator_forward(
+            [bb.get_right() for bb in pages_bbox],
+            [bb.get_top() for bb in pages_bbox])
+        xs = (area_width_dots * ((lefts + rights)/2 - left)
+              / coord_delta_x).astype(int)
+        ys = (area_height_dots * (1 - ((bottoms + tops)/2 - bottom)
+                                  / coord_delta_y)).astype(int)
+
+        w, h = None, None
+        for idx in range(len(pages_bbox)):
+            x, y = int(xs[idx]), int(ys[idx])
 
             if not w or not h:
-                w = area_width_dots*(p_bottom_right.x - p_bottom_left.x
-                                                         )/coord_delta_x
-                h = area_height_dots*(p_top_right.y - p_bottom_right.y
-                                                         )/coord_delta_y
+                w = area_width_dots*(rights[idx] - lefts[idx])/coord_delta_x
+                h = area_height_dots*(tops[idx] - bottoms[idx])/coord_delta_y
 
             draw_utils.draw_text_adjusted(ctx, str(idx + self._first_map_page_number),
                                           x, y, w, h,
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+# ocitysmap, city map and street index generator from OpenStreetMap data
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Process wide registry of the effect plugins found in render_plugins.
+
+The plugins are discovered and imported once per process, all the
+renderers share the same plugin modules.
+
+Besides its render(renderer, ctx) function, a plugin module may declare
+what it needs from the renderer in a CAPABILITIES sequence:
+
+ - NEEDS_DB: the renderer database connection,
+ - NEEDS_STREET_INDEX: the street index of the renderer, which the
+   single-page renderers only have when there is something to index.
+
+The renderer does not load the plugins whose needs it cannot fulfil.
+"""
+
+import logging
+import os
+import threading
+
+from pluginbase import PluginBase
+
+LOG = logging.getLogger('ocitysmap')
+
+NEEDS_DB = 'db'
+NEEDS_STREET_INDEX = 'street_index'
+
+PLUGIN_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                           'render_plugins'))
+
+class PluginRegistry:
+    """The effect plugins of a plugin directory, imported on first use."""
+
+    def __init__(self, searchpath):
+        """
+        Args:
+           searchpath (list): directories holding the plugins.
+        """
+        self._plugin_base = PluginBase(package='ocitysmap.layout_plugins')
+        self._plugin_source = self._plugin_base.make_plugin_source(
+            searchpath=searchpath, identifier='ocitysmap')
+        self._plugins = {}
+        self._lock = threading.Lock()
+
+    def list_plugins(self):
+        """Return the sorted names of the available plugins."""
+        return self._plugin_source.list_plugins()
+
+    def get_plugin(self, plugin_name):
+        """Return the module of a plugin, imported once.
+
+        Args:
+           plugin_name (str): name of the plugin.
+        """
+        with self._lock:
+            plugin = self._plugins.get(plugin_name)
+            if plugin is None:
+                LOG.debug('Loading plugin %s.' % plugin_name)
+                plugin = self._plugin_source.load_plugin(plugin_name)
+                self._plugins[plugin_name] = plugin
+            return plugin
+
+    def get_capabilities(self, plugin_name):
+        """Return the set of the CAPABILITIES declared by a plugin."""
+        return frozenset(getattr(self.get_plugin(plugin_name),
+                                 'CAPABILITIES', ()))
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_registry():
+    """Return the registry of the plugins of render_plugins."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = PluginRegistry([PLUGIN_PATH])
+        return _registry
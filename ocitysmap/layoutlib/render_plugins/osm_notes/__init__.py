@@ -9,7 +9,9 @@ from gi.repository import Rsvg
 
 from ocitysmap.layoutlib.commons import convert_pt_to_dots
 from ocitysmap.layoutlib.abstract_renderer import Renderer
+from ocitysmap.layoutlib import markers, plugins
 from ocitysmap.coords import Point
+from ocitysmap import notes_store
 
 from ocitysmap.indexlib.commons import StreetIndexItem
 
@@ -17,53 +19,104 @@ from urllib.request import Request, urlopen
 from urllib.error import URLError, HTTPError
 
 import json
+import sqlite3
 
 import logging
 LOG = logging.getLogger('ocitysmap')
 
-def render(renderer, ctx):
-    if not hasattr(renderer, 'street_index'):
-        return
-
-    bbox = renderer._map_canvas.get_actual_bounding_box()
-    url  = ("https://api.openstreetmap.org/api/0.6/notes.json?closed=0&bbox=%f,%f,%f,%f"
-            % (bbox.get_left(), bbox.get_bottom(), bbox.get_right(), bbox.get_top()))
+CAPABILITIES = (plugins.NEEDS_STREET_INDEX,)
+
+# seconds to wait for the notes API
+NOTES_API_TIMEOUT = 10
+
+def _overlay(renderer):
+    # the overlay stylesheet of this plugin, configured like:
+    #   [osm_notes]
+    #   path: internal:osm_notes
+    #   datasource: /path/to/notes.sqlite (see sync-osm-notes.py)
+    #   url: notes API, queried when there is no store or it cannot
+    #        be read
+    for overlay in renderer.rc.overlays:
+        if overlay.path.strip() == 'internal:osm_notes':
+            return overlay
+    return None
+
+def _query_api(url, bbox):
+    # return the (lat, lon, text) of the open notes from the notes API
+    url = ("%s?closed=0&bbox=%f,%f,%f,%f"
+           % (url, bbox.get_left(), bbox.get_bottom(), bbox.get_right(), bbox.get_top()))
     LOG.info("OSM Notes URL: %s" % url)
 
     req = Request(url)
     try:
-        response = urlopen(req)
+        response = urlopen(req, timeout=NOTES_API_TIMEOUT)
+        notes_json = response.read()
     except HTTPError as e:
         LOG.error('The server couldn\'t fulfill the request.')
         LOG.error('Error code: %s' % e.code)
-        return
-    except URLError as e:
+        return None
+    except (URLError, OSError) as e:
         LOG.error('We failed to reach a server.')
-        LOG.error('Reason: %s' % e.reason)
-        return
-
-    notes_json = response.read()
+        LOG.error('Reason: %s' % getattr(e, 'reason', e))
+        return None
 
     try:
         notes = json.loads(notes_json)
-    except Exception as e:
-        LOG.error("JSON decode exception %s / %s." % (e.code, e.reason))
-        return 
+    except ValueError as e:
+        LOG.error("JSON decode exception %s." % e)
+        return None
+
+    return [(note['geometry']['coordinates'][1],
+             note['geometry']['coordinates'][0],
+             note['properties']['comments'][0]['text'])
+            for note in notes['features']]
+
+def _get_notes(renderer, bbox):
+    # return the (lat, lon, text) of the open notes within bbox, from the
+    # local notes store when there is one, None when no notes can be read
+    overlay = _overlay(renderer)
+    store_path = overlay.datasource if overlay is not None else ''
+    api_url = overlay.url if overlay is not None else ''
+
+    if store_path:
+        try:
+            return notes_store.query(store_path, bbox)
+        except sqlite3.Error as e:
+            LOG.error("Cannot read the OSM notes store %s: %s" % (store_path, e))
+    elif not api_url:
+        LOG.warning("Neither a notes store nor a notes API configured for "
+                    "the OSM notes overlay.")
+
+    if api_url:
+        return _query_api(api_url, bbox)
+    return None
+
+def render(renderer, ctx):
+    if not hasattr(renderer, 'street_index'):
+        return
+
+    bbox = renderer._map_canvas.get_actual_bounding_box()
+    notes = _get_notes(renderer, bbox)
+    if notes is None:
+        return
 
     index_items = []
 
+    xs, ys = renderer.project_points([lat for lat, lon, text in notes],
+                                     [lon for lat, lon, text in notes])
+
+    layer = markers.MarkerLayer(ctx, renderer.dpi)
+
     n = 0
-    for note in notes['features']:
+    for (lat, lon, text) in notes:
         n = n + 1
-        lat = note['geometry']['coordinates'][1]
-        lon = note['geometry']['coordinates'][0]
 
         point = Point(lat, lon)
 
-        index_text = "Note %d - %s" % (n, note['properties']['comments'][0]['text'])
+        index_text = "Note %d - %s" % (n, text)
 
         index_items.append(StreetIndexItem(index_text[0:50], None, point, point, None))
 
-        renderer._marker('red', str(n), lat, lon, ctx, renderer.dpi)
+        layer.draw('red', str(n), xs[n - 1], ys[n - 1])
 
     renderer.street_index.add_category("OSM Notes", index_items)
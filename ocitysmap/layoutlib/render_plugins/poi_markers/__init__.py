@@ -12,20 +12,35 @@ from io import BytesIO
 
 from ocitysmap.layoutlib.commons import convert_pt_to_dots
 from ocitysmap.layoutlib.abstract_renderer import Renderer
+from ocitysmap.layoutlib import markers, plugins
 
 import logging
 LOG = logging.getLogger('ocitysmap')
 
+CAPABILITIES = (plugins.NEEDS_STREET_INDEX,)
+
 def render(renderer, ctx):
     if renderer.rc.poi_file:
 
         # place POI markers on map canvas
-        n = 0
+        colors = []
+        lats = []
+        lons = []
         for category in renderer.street_index.categories:
             for poi in category.items:
-                n = n + 1
                 lat, lon = poi.endpoint1.get_latlong()
-                renderer._marker(category.color, str(n), lat, lon, ctx, renderer.dpi)
+                colors.append(category.color)
+                lats.append(lat)
+                lons.append(lon)
+
+        xs, ys = renderer.project_points(lats, lons)
+        layer = markers.MarkerLayer(ctx, renderer.dpi,
+                                   renderer.rc.poi_marker_culling)
+        for n, (color, x, y) in enumerate(zip(colors, xs, ys), 1):
+            layer.draw(color, str(n), x, y)
+        if layer.culled:
+            LOG.info("%d of %d POI markers left out, hidden by other markers."
+                     % (layer.culled, len(colors)))
 
         # place "you are here" circle if coordinates are given
         if renderer.street_index.lat != False:
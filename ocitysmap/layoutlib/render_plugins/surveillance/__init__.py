@@ -1,13 +1,21 @@
 import cairo
-from gi.repository import Rsvg
 import math
+import numpy
 import os
 import psycopg2
 import logging
 
+from ocitysmap.layoutlib import plugins, svg_assets
+
 LOG = logging.getLogger('ocitysmap')
 
-def _camera_view(renderer, ctx, map_scale, surveillance, lat, lon, camera_type, direction, angle, height):
+CAPABILITIES = (plugins.NEEDS_DB,)
+
+# larger than the radius of the largest camera view drawn by _camera_view()
+VIEW_RADIUS_M = 100
+METERS_PER_DEGREE = 111320.0
+
+def _camera_view(renderer, ctx, map_scale, surveillance, x, y, camera_type, direction, angle, height):
     if camera_type == 'dome':
         symbol = 'dome-camera'
         direction = '0'
@@ -50,8 +58,6 @@ def _camera_view(renderer, ctx, map_scale, surveillance, lat, lon, camera_type,
 
     ctx.save()
 
-    x,y = renderer._latlon2xy(lat, lon, renderer.dpi)
-
     if type(direction) == float and surveillance != 'indoor':
         if height and height.isdigit():
            height = float(height)
@@ -101,35 +107,39 @@ def _camera_view(renderer, ctx, map_scale, surveillance, lat, lon, camera_type,
 
 
 
-def _show_symbol(renderer, ctx, lat, lon, surveillance, symbol):
+def _show_symbol(renderer, ctx, x, y, surveillance, symbol):
     if surveillance != 'public' and surveillance != 'outdoor' and surveillance != 'indoor':
         surveillance = 'public'
 
     symbol_path = os.path.abspath(os.path.join(os.path.dirname(__file__), 'images', surveillance, (symbol+'.svg')))
 
-    fp = open(symbol_path,'rb')
-    data = fp.read()
-    fp.close()
-
-    rsvg = Rsvg.Handle()
-    svg  = rsvg.new_from_data(data)
-    x,y = renderer._latlon2xy(lat, lon, renderer.dpi)
+    svg = svg_assets.get_asset(symbol_path)
+    _, svg_width, svg_height = svg
 
-    svg_scale = renderer.dpi / (4 * svg.props.height);
-    sx = x - svg.props.width  * svg_scale/2
-    sy = y - svg.props.height * svg_scale/2
+    svg_scale = renderer.dpi / (4 * svg_height);
+    sx = x - svg_width  * svg_scale/2
+    sy = y - svg_height * svg_scale/2
 
     ctx.save()
     ctx.translate(sx, sy)
     ctx.scale(svg_scale, svg_scale)
-    svg.render_cairo(ctx)
+    svg_assets.paint_asset(ctx, svg)
     ctx.restore()
 
 
 
 
 
-def render(renderer, ctx):
+def prefetch(renderer, db):
+    """Fetch the surveillance features of the whole job area.
+
+    Args:
+       renderer (Renderer): the renderer of the job.
+       db (psycopg2 connection): the database connection to use.
+
+    Returns a tuple (rows of the features sorted by longitude, numpy array
+    of their longitudes), searched by _visible_rows().
+    """
     query = """SELECT ST_Y(ST_TRANSFORM(way, 4326)) AS lat
                     , ST_X(ST_TRANSFORM(way, 4326)) AS lon
                     , tags->'surveillance'      AS surveillance
@@ -154,14 +164,48 @@ def render(renderer, ctx):
                   AND ST_CONTAINS(ST_TRANSFORM(ST_GeomFromText('%s', 4326), 3857), way)
              """ % ( renderer.rc.polygon_wkt, renderer.rc.polygon_wkt)
 
-    cursor = renderer.db.cursor()
+    cursor = db.cursor()
     cursor.execute(query)
+    rows = sorted(cursor.fetchall(), key=lambda row: row[1])
+    cursor.close()
+
+    LOG.debug("Prefetched %d surveillance features." % len(rows))
+    return rows, numpy.array([row[1] for row in rows], dtype=float)
+
+def _visible_rows(renderer, features):
+    """Return the prefetched features that may show up on the current map
+    canvas."""
+    rows, lons = features
+    bbox = renderer._map_canvas.get_actual_bounding_box()
+    (top, left) = bbox.get_top_left()
+    (bottom, right) = bbox.get_bottom_right()
+
+    # features next to the map still show their symbol (18pt wide) or
+    # camera view (at most 85m wide) on it
+    view_margin = VIEW_RADIUS_M / METERS_PER_DEGREE
+    lat_margin = (top - bottom) * 9.0 / renderer._map_coords[3] + view_margin
+    lon_margin = ((right - left) * 9.0 / renderer._map_coords[2] +
+                  view_margin / math.cos(math.radians(top)))
+
+    first, last = numpy.searchsorted(lons, [left - lon_margin,
+                                            right + lon_margin])
+    return [row for row in rows[first:last]
+            if bottom - lat_margin <= row[0] <= top + lat_margin]
+
+def render(renderer, ctx):
+    features = renderer.get_prefetched('surveillance')
+    if features is None:
+        features = prefetch(renderer, renderer.db)
 
     map_scale = renderer._map_canvas.get_actual_scale() * 72.0 / renderer.dpi
 
-    for lat, lon, surveillance, surveillance_type, direction, angle, camera_type, height in cursor.fetchall():
+    rows = _visible_rows(renderer, features)
+    xs, ys = renderer.project_points([row[0] for row in rows],
+                                     [row[1] for row in rows])
+
+    for x, y, (lat, lon, surveillance, surveillance_type, direction, angle, camera_type, height) in zip(xs, ys, rows):
         if surveillance_type == 'camera':
-            symbol = _camera_view(renderer, ctx, map_scale, surveillance, lat, lon, camera_type, direction, angle, height)
+            symbol = _camera_view(renderer, ctx, map_scale, surveillance, x, y, camera_type, direction, angle, height)
         elif surveillance_type == 'guard':
             symbol = 'guard-shield'
         elif surveillance_type == 'ALPR':
@@ -169,5 +213,5 @@ def render(renderer, ctx):
         else:
             continue
 
-        _show_symbol(renderer, ctx, lat, lon, surveillance, symbol) 
+        _show_symbol(renderer, ctx, x, y, surveillance, symbol) 
 
@@ -21,6 +21,7 @@ import math
 import os
 import logging
 import mapnik
+import numpy
 import utm
 
 from shapely.geometry import Point
@@ -33,6 +34,9 @@ from ocitysmap.layoutlib.abstract_renderer import Renderer
 
 LOG = logging.getLogger('ocitysmap')
 
+# number of straight segments approximating each (curved) grid line
+SEGMENTS_PER_LINE = 32
+
 # draw a blue UTM grid with 1km grid size on top of the map
 
 def render(renderer, ctx):
@@ -102,18 +106,24 @@ def render(renderer, ctx):
 
         return '+proj=utm +zone=%d %s +ellps=WGS84 +datum=WGS84 +units=m +no_defs' % (number, south)
 
-    def grid_line(lat1, lon1, lat2, lon2):
-        # draw a blue grid line between two coordinates
-        (x1, y1) = renderer._latlon2xy(lat1, lon1)
-        (x2, y2) = renderer._latlon2xy(lat2, lon2)
+    def grid_lines(eastings, northings, zone_number, zone_letter):
+        # project grid lines given as arrays of UTM coordinates, one row
+        # per line, and add them to the current path as polylines
+        if not eastings.size:
+            return eastings, northings
 
-        ctx.save()
-        ctx.set_source_rgba(0, 0, 1.0, 0.5)
-        ctx.set_line_width(pt2px(1))
-        ctx.move_to(x1, y1)
-        ctx.line_to(x2, y2)
-        ctx.stroke()
-        ctx.restore()
+        (lats, lons) = utm.to_latlon(eastings.ravel(), northings.ravel(),
+                                     zone_number, zone_letter)
+        (xs, ys) = renderer.project_points(lats, lons)
+        xs = xs.reshape(eastings.shape)
+        ys = ys.reshape(eastings.shape)
+
+        for (line_xs, line_ys) in zip(xs.tolist(), ys.tolist()):
+            ctx.move_to(line_xs[0], line_ys[0])
+            for (x, y) in zip(line_xs[1:], line_ys[1:]):
+                ctx.line_to(x, y)
+
+        return xs, ys
 
     def show_grid(lat1, lon1, lat2, lon2):
         # draw grid over given bounding box
@@ -160,34 +170,42 @@ def render(renderer, ctx):
         n_km = math.ceil(north/1000)
         s_km = math.floor(south/1000)
 
-        # draw the vertical grid lines
-        for v in range(w_km, e_km):
-            # calc line endings and draw line
-            # TODO: the vertical lines are not really straight
-            (lat1, lon1) = utm.to_latlon(v * 1000, n_km * 1000, zone1_number, zone1_letter)
-            (lat2, lon2) = utm.to_latlon(v * 1000, s_km * 1000, zone1_number, zone1_letter)
-            grid_line(lat1, lon1, lat2, lon2)
-
-            # draw easting value right next to upper visible end of the grid line
-            (x1, y1) = renderer._latlon2xy(lat1, lon1)
-            ctx.save()
-            ctx.set_source_rgba(0, 0, 0.5, 0.5)
-            draw_simpletext_center(ctx, beautify_km(v), x1 + 12, 20)
-            ctx.restore()
-
-        # draw the horizontal grid lines
-        for h in range(s_km, n_km):
-            # calc line endings and draw line
-            (lat1, lon1) = utm.to_latlon(w_km * 1000, h * 1000, zone1_number, zone1_letter)
-            (lat2, lon2) = utm.to_latlon(e_km * 1000, h * 1000, zone1_number, zone1_letter)
-            grid_line(lat1, lon1, lat2, lon2)
-
-            # draw northing value right below left visible end of the line
-            (x1, y1) = renderer._latlon2xy(lat1, lon1)
-            ctx.save()
-            ctx.set_source_rgba(0, 0, 0.5, 0.5)
-            draw_simpletext_center(ctx, beautify_km(h), 27, y1 + 5)
-            ctx.restore()
+        # the grid lines are curved on the map, each one is drawn as a
+        # polyline of SEGMENTS_PER_LINE segments
+        eastings = numpy.arange(w_km, e_km) * 1000.0
+        northings = numpy.arange(s_km, n_km) * 1000.0
+        steps = numpy.linspace(0.0, 1.0, SEGMENTS_PER_LINE + 1)
+
+        ctx.save()
+        ctx.set_source_rgba(0, 0, 1.0, 0.5)
+        ctx.set_line_width(pt2px(1))
+        # vertical lines, from north to south
+        (v_xs, v_ys) = grid_lines(
+            numpy.repeat(eastings[:, None], len(steps), axis=1),
+            numpy.tile(n_km * 1000.0 + steps * (s_km - n_km) * 1000.0,
+                       (len(eastings), 1)),
+            zone1_number, zone1_letter)
+        # horizontal lines, from west to east
+        (h_xs, h_ys) = grid_lines(
+            numpy.tile(w_km * 1000.0 + steps * (e_km - w_km) * 1000.0,
+                       (len(northings), 1)),
+            numpy.repeat(northings[:, None], len(steps), axis=1),
+            zone1_number, zone1_letter)
+        ctx.stroke()
+        ctx.restore()
+
+        ctx.save()
+        ctx.set_source_rgba(0, 0, 0.5, 0.5)
+
+        # draw easting values right next to upper visible end of the lines
+        for (v, x) in zip(range(w_km, e_km), v_xs[:, 0]):
+            draw_simpletext_center(ctx, beautify_km(v), x + 12, 20)
+
+        # draw northing values right below left visible end of the lines
+        for (h, y) in zip(range(s_km, n_km), h_ys[:, 0]):
+            draw_simpletext_center(ctx, beautify_km(h), 27, y + 5)
+
+        ctx.restore()
 
         # draw zone field info in upper left map corner
         # TODO avoid overlap with northing/easting values
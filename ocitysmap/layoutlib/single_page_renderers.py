@@ -87,7 +87,7 @@ class SinglePageRenderer(Renderer):
 
         # Prepare the index
         if rc.poi_file:
-            self.street_index = PoiIndex(rc.poi_file)
+            self.street_index = PoiIndex(rc.poi_file, rc.bounding_box)
         else:
             self.street_index = StreetIndex(db,
                                             rc.polygon_wkt,
@@ -179,26 +179,35 @@ class SinglePageRenderer(Renderer):
         # Prepare overlay styles for uploaded files
         self._overlays = copy(self.rc.overlays)
 
-        # generate style file for GPX file
+        # generate style file for GPX file, its tracks simplified to the
+        # scale of the map
         if self.rc.gpx_file:
-            self._overlays.append(GpxStylesheet(self.rc.gpx_file, self.tmpdir))
+            envelope = ocitysmap.coords.project_envelope(
+                self._map_canvas.get_actual_bounding_box())
+            self._overlays.append(GpxStylesheet(self.rc.gpx_file, self.tmpdir,
+                                                envelope.width() / float(self._map_coords[2])))
 
         # denormalize UMAP json to geojson, then create style for it
         if self.rc.umap_file:
             self._overlays.append(UmapStylesheet(self.rc.umap_file, self.tmpdir))
 
+        self._overlay_canvases = []
+        self._overlay_effects  = []
+
         # add special POI marker overlay if a POI file is given
         # TODO: refactor this special case
         if self.rc.poi_file:
-            self._overlay_effects.append(self.get_plugin('poi_markers'))
+            plugin = self.get_plugin('poi_markers')
+            if plugin is not None:
+                self._overlay_effects.append(plugin)
 
         # Prepare map overlays
-        self._overlay_canvases = []
-        self._overlay_effects  = []
         for overlay in self._overlays:
             path = overlay.path.strip()
             if path.startswith('internal:'):
-                self._overlay_effects.append(self.get_plugin(path.lstrip('internal:')))
+                plugin = self.get_plugin(path.lstrip('internal:'))
+                if plugin is not None:
+                    self._overlay_effects.append(plugin)
             else:
                 self._overlay_canvases.append(MapCanvas(overlay,
                                               self.rc.bounding_box,
@@ -233,7 +242,8 @@ class SinglePageRenderer(Renderer):
                                                  self.street_index.categories)
         else:
             index_renderer = StreetIndexRenderer(self.rc.i18n,
-                                                 self.street_index.categories)
+                                                 self.street_index.categories,
+                                                 text_measurements=self.text_measurements)
 
         # We use a fake vector device to determine the actual
         # rendering characteristics
@@ -636,6 +646,10 @@ class SinglePageRenderer(Renderer):
         else:
             cairo_surface.flush()
 
+    def renders_single_page(self, output_format):
+        return not (self.index_position == 'extra_page'
+                    and self._has_multipage_format(output_format))
+
     @staticmethod
     def _generic_get_compatible_paper_sizes(bounding_box,
                                             paper_sizes,
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+# ocitysmap, city map and street index generator from OpenStreetMap data
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Process wide cache of the SVG assets (markers, logos, plugin symbols)
+drawn on the maps.
+
+Each SVG file is parsed once, and drawn once into a cairo recording
+surface, which is then painted wherever the asset shows up, on all the
+pages of all the jobs rendered by the process. Painting the same
+recording also lets the vector backends emit the asset only once.
+"""
+
+import cairo
+import gi
+gi.require_version('Rsvg', '2.0')
+from gi.repository import Rsvg
+import logging
+
+LOG = logging.getLogger('ocitysmap')
+
+# (path, color) -> (recording surface, width, height)
+_assets = {}
+_ASSETS_CACHE_SIZE = 256
+
+def get_asset(path, color=None):
+    """Return the SVG file at the given path, drawn in a recording surface.
+
+    Args:
+        path (str): path of the SVG file.
+        color (str): when given, the '#000000' color of the SVG is
+            replaced with this one.
+
+    Returns a tuple (cairo.RecordingSurface, SVG width, SVG height). Raise
+    the GLib error of librsvg when the file cannot be read.
+    """
+    key = (path, color)
+    asset = _assets.get(key)
+    if asset is not None:
+        return asset
+
+    with open(path, 'rb') as fp:
+        data = fp.read()
+    if color is not None:
+        data = data.replace(b'#000000', color.encode())
+    svg = Rsvg.Handle.new_from_data(data)
+
+    width, height = svg.props.width, svg.props.height
+    surface = cairo.RecordingSurface(cairo.CONTENT_COLOR_ALPHA,
+                                     cairo.Rectangle(0, 0, width, height))
+    svg.render_cairo(cairo.Context(surface))
+
+    if len(_assets) >= _ASSETS_CACHE_SIZE:
+        del _assets[next(iter(_assets))]
+    asset = _assets[key] = (surface, width, height)
+    LOG.debug('Cached SVG asset %s (%s).' % (path, color))
+    return asset
+
+def paint_asset(ctx, asset):
+    """Paint an asset returned by get_asset() at the origin of the current
+    user space of ctx, at its SVG size."""
+    surface, width, height = asset
+    ctx.save()
+    ctx.set_source_surface(surface, 0, 0)
+    ctx.rectangle(0, 0, width, height)
+    ctx.fill()
+    ctx.restore()
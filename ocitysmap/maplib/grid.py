@@ -124,13 +124,13 @@ class Grid:
                (self.grid_size_m, self.grid_size_m,
                 self.horiz_count, self.vert_count))
 
-    def generate_shape_file(self, filename):
+    def generate_shape_file(self, filename=None):
         """Generates the grid shapefile with all the horizontal and
         vertical lines added.
 
         Args:
-            filename (string): path to the temporary shape file that will be
-                generated.
+            filename (string): optional path of a shape file to write the
+                grid to on flush(), the grid is kept in memory otherwise.
         Returns the ShapeFile object.
         """
 
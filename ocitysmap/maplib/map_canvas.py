@@ -31,6 +31,7 @@ assert mapnik.mapnik_version() >= 300000, \
 
 import math
 import os
+from xml.etree import ElementTree
 
 import ocitysmap
 from ocitysmap.layoutlib.commons import convert_pt_to_dots
@@ -38,9 +39,113 @@ import ocitysmap.maplib.shapes
 
 LOG = logging.getLogger('ocitysmap')
 
-_MAPNIK_PROJECTION = "+proj=merc +a=6378137 +b=6378137 +lat_ts=0.0 " \
-                     "+lon_0=0.0 +x_0=0.0 +y_0=0 +k=1.0 +units=m   " \
-                     "+nadgrids=@null +no_defs +over"
+_MAPNIK_PROJECTION = ocitysmap.coords._MAPNIK_PROJECTION
+
+# Stylesheets already parsed by this process: path -> (mtime, size, XML)
+_stylesheet_cache = {}
+_STYLESHEET_CACHE_SIZE = 16
+
+def _load_stylesheet(mapnik_map, path):
+    """Load the Mapnik stylesheet at the given path into the map.
+
+    The first load of a stylesheet goes through mapnik.load_map(), which
+    resolves its entities and includes; the resulting map is serialized
+    once and the following maps are loaded from that flat XML string, until
+    the stylesheet file is modified."""
+    st = os.stat(path)
+    cached = _stylesheet_cache.get(path)
+    if cached is not None and cached[:2] == (st.st_mtime, st.st_size):
+        mapnik.load_map_from_string(mapnik_map, cached[2], False,
+                                    os.path.dirname(os.path.abspath(path)))
+        return
+
+    mapnik.load_map(mapnik_map, path)
+    if len(_stylesheet_cache) >= _STYLESHEET_CACHE_SIZE:
+        # drop the oldest entry, most likely a per-job overlay stylesheet
+        del _stylesheet_cache[next(iter(_stylesheet_cache))]
+    _stylesheet_cache.pop(path, None)
+    _stylesheet_cache[path] = (st.st_mtime, st.st_size,
+                               mapnik.save_map_to_string(mapnik_map))
+    LOG.debug('Cached stylesheet %s.' % path)
+
+class SharedDatasources:
+    """
+    The datasources of a stylesheet, opened once and shared by all the map
+    canvases created with it, which then only differ by their extent. Meant
+    for the overlays of a multi-page job, whose GeoJSON or OGR files would
+    otherwise be parsed again for each page.
+
+    GeoJSON datasources keep their features in memory along with a
+    spatial index. The features of OGR datasources are copied into memory
+    too, so that no file handle is shared with the processes rendering
+    the pages. SQLite datasources are left in the stylesheet: opening one
+    is cheap, and the R-tree index of its table then selects the features
+    of each map.
+    """
+
+    def __init__(self, path):
+        mapnik_map = mapnik.Map(1, 1, _MAPNIK_PROJECTION)
+        _load_stylesheet(mapnik_map, path)
+
+        self._base_path = os.path.dirname(os.path.abspath(path))
+        self._datasources = [self._shared(layer.datasource)
+                             for layer in mapnik_map.layers]
+
+        # Keep the stylesheet without its shared datasources, so that
+        # loading it does not open them again
+        root = ElementTree.fromstring(mapnik.save_map_to_string(mapnik_map))
+        for layer, datasource in zip(root.findall('Layer'), self._datasources):
+            if datasource is not None:
+                for element in layer.findall('Datasource'):
+                    layer.remove(element)
+        self._xml = ElementTree.tostring(root, encoding='unicode')
+
+        LOG.debug('Shared %d datasources of %s.'
+                  % (sum(datasource is not None
+                         for datasource in self._datasources), path))
+
+    @staticmethod
+    def _shared(datasource):
+        # return the datasource shared by the maps, None for the ones
+        # opened by each map
+        if datasource is None or datasource.params().get('type') == 'sqlite':
+            return None
+        if datasource.params().get('type') != 'ogr':
+            return datasource
+        memory_datasource = mapnik.MemoryDatasource()
+        for feature in datasource.all_features():
+            memory_datasource.add_feature(feature)
+        return memory_datasource
+
+    def load(self, mapnik_map):
+        """Load the stylesheet into the map, with the shared datasources."""
+        mapnik.load_map_from_string(mapnik_map, self._xml, False,
+                                    self._base_path)
+        for layer, datasource in zip(mapnik_map.layers, self._datasources):
+            if datasource is not None:
+                layer.datasource = datasource
+
+def predict_actual_scale(bounding_box, _width, _height, dpi=72.0):
+    """Return the scale MapCanvas.get_actual_scale() gives for a canvas
+    created with extend_bbox_to_ratio=False on the given bounding box and
+    size, without having to create the canvas and load its stylesheet.
+
+    This follows what mapnik does in Map.zoom_to_box() and
+    Map.scale_denominator() for a projected map."""
+    envelope = ocitysmap.coords.project_envelope(bounding_box)
+    g_width  = int(convert_pt_to_dots(_width, dpi))
+    g_height = int(convert_pt_to_dots(_height, dpi))
+
+    # zoom_to_box() grows the envelope to the ratio of the map
+    extent_width = max(envelope.width(),
+                       envelope.height() * float(g_width) / g_height)
+    # mapnik assumes 0.28mm pixels
+    scale = extent_width / g_width / 0.00028
+
+    lat = bounding_box.get_top_left()[0]
+    scale *= math.cos(math.radians(lat))
+    scale *= float(dpi) / 90
+    return scale
 
 class MapCanvas:
     """
@@ -51,7 +156,7 @@ class MapCanvas:
     """
 
     def __init__(self, stylesheet, bounding_box, _width, _height, dpi=72.0,
-                 extend_bbox_to_ratio=True):
+                 extend_bbox_to_ratio=True, datasources=None):
         """Initialize the map canvas for rendering.
 
         Args:
@@ -62,16 +167,17 @@ class MapCanvas:
             extend_bbox_to_ratio (boolean): allow MapCanvas to extend
             the bounding box to make it match the ratio of the
             provided rendering area. Needed by SinglePageRenderer.
+            datasources (SharedDatasources): the already opened datasources
+            of the stylesheet, if any.
         """
 
-        self._proj = mapnik.Projection(_MAPNIK_PROJECTION)
         self._dpi  = dpi
 
         # This is where the magic of the map canvas happens. Given an original
         # bounding box and a graphical ratio for the output, the bounding box
         # is adjusted (extended) to fill the destination zone. See
         # _fix_bbox_ratio for more details on how this is done.
-        orig_envelope = self._project_envelope(bounding_box)
+        orig_envelope = ocitysmap.coords.project_envelope(bounding_box)
         graphical_ratio = _width / _height
 
         if extend_bbox_to_ratio:
@@ -81,7 +187,7 @@ class MapCanvas:
                 graphical_ratio)
 
             envelope = mapnik.Box2d(off_x, off_y, off_x+width, off_y+height)
-            self._geo_bbox = self._inverse_envelope(envelope)
+            self._geo_bbox = ocitysmap.coords.inverse_envelope(envelope)
             LOG.debug('Corrected bounding box from %s to %s, ratio: %.2f.' %
                     (bounding_box, self._geo_bbox, graphical_ratio))
         else:
@@ -94,7 +200,10 @@ class MapCanvas:
         # Create the Mapnik map with the corrected width and height and zoom to
         # the corrected bounding box ('envelope' in the Mapnik jargon)
         self._map = mapnik.Map(g_width, g_height, _MAPNIK_PROJECTION)
-        mapnik.load_map(self._map, stylesheet.path)
+        if datasources is not None:
+            datasources.load(self._map)
+        else:
+            _load_stylesheet(self._map, stylesheet.path)
         self._map.zoom_to_box(envelope)
 
         # Added shapes to render
@@ -123,8 +232,8 @@ class MapCanvas:
                        line_width=1.0):
         """
         Args:
-            shape_file (shapes.ShapeFile): path to the shape file to overlay on
-                this map canvas.
+            shape_file (shapes.ShapeFile): the shapes to overlay on this map
+                canvas.
             str_color (string): litteral name of the layer's color, needs to be
                 understood by mapnik.Color.
             alpha (float): transparency factor in the range 0 (invisible) -> 1
@@ -137,7 +246,7 @@ class MapCanvas:
                              'color': col,
                              'line_width': line_width})
         LOG.debug('Added shape file %s to map canvas as layer %s.' %
-                (shape_file.get_filepath(), shape_file.get_layer_name()))
+                (shape_file, shape_file.get_layer_name()))
 
     def render(self):
         """Render the map in memory with all the added shapes. The Mapnik Map
@@ -167,9 +276,8 @@ class MapCanvas:
 
     def _render_shape_file(self, shape_file, color, line_width):
         #LOG.debug("render_shape_file")
-        shape_file.flush()
-
-        shpid = os.path.basename(shape_file.get_filepath())
+        # the shapes live in memory, the layer index keeps the names unique
+        shpid = '%s_%d' % (shape_file.get_layer_name(), len(self._map.layers))
         s,r = mapnik.Style(), mapnik.Rule()
 
         if ocitysmap.get_mapnik_major_version() == 2:
@@ -187,28 +295,11 @@ class MapCanvas:
 
         self._map.append_style('style_%s' % shpid, s)
         layer = mapnik.Layer(shpid)
-        layer.datasource = mapnik.Shapefile(file=shape_file.get_filepath())
+        layer.datasource = shape_file.get_datasource()
         layer.styles.append('style_%s' % shpid)
 
         self._map.layers.append(layer)
 
-    def _project_envelope(self, bbox):
-        """Project the given bounding box into the rendering projection."""
-        envelope = mapnik.Box2d(bbox.get_top_left()[1],
-                                bbox.get_top_left()[0],
-                                bbox.get_bottom_right()[1],
-                                bbox.get_bottom_right()[0])
-        c0 = self._proj.forward(mapnik.Coord(envelope.minx, envelope.miny))
-        c1 = self._proj.forward(mapnik.Coord(envelope.maxx, envelope.maxy))
-        return mapnik.Box2d(c0.x, c0.y, c1.x, c1.y)
-
-    def _inverse_envelope(self, envelope):
-        """Inverse the given cartesian envelope (in 3587) back to a 4326
-        bounding box."""
-        c0 = self._proj.inverse(mapnik.Coord(envelope.minx, envelope.miny))
-        c1 = self._proj.inverse(mapnik.Coord(envelope.maxx, envelope.maxy))
-        return ocitysmap.coords.BoundingBox(c0.y, c0.x, c1.y, c1.x)
-
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
 
@@ -50,13 +50,13 @@ class OverviewGrid:
         LOG.info('Laying out of overview grid on %.1fx%.1fm area...' %
                (self._width_m, self._height_m))
 
-    def generate_shape_file(self, filename):
+    def generate_shape_file(self, filename=None):
         """Generates the grid shapefile with all the horizontal and
         vertical lines added.
 
         Args:
-            filename (string): path to the temporary shape file that will be
-                generated.
+            filename (string): optional path of a shape file to write the
+                grid to on flush(), the grid is kept in memory otherwise.
         Returns the ShapeFile object.
         """
 
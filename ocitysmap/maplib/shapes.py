@@ -26,6 +26,8 @@ import locale
 import logging
 import os
 
+import mapnik
+
 # The ogr module is now known as osgeo.ogr in recent versions of the
 # module, but we want to keep compatibility with older versions
 try:
@@ -37,70 +39,101 @@ LOG = logging.getLogger('ocitysmap')
 
 class _ShapeFile:
     """
-    This class represents a shapefile (.shp) that can be added to a Mapnik map
-    as a layer. It provides a few methods to add some geometry 'features' to
-    the shape file.
+    This class represents a set of geometry 'features' that can be added to
+    a Mapnik map as a layer. It provides a few methods to add features to
+    it.
+
+    The features are kept in memory and handed to Mapnik through a
+    MemoryDatasource; writing them to an actual shapefile (.shp) is only
+    done when an output file name is given, which is mostly useful for
+    debugging.
 
     This is a private base class and is not meant to be used directly from the
     outside.
     """
 
+    # OGR geometry type of the layer, only used when writing to disk
+    _OGR_GEOM_TYPE = None
+
     def __init__(self, bounding_box, out_filename, layer_name):
         """
         Args:
             bounding_box (BoundingBox): bounding box of the map area.
-            out_filename (string): path to the output shape file to generate.
+            out_filename (string): path to the output shape file to
+                generate on flush(), or None to stay in memory.
             layer_name (string): layer name for the shape file.
         """
 
         self._bbox = bounding_box
         self._filepath = out_filename
         self._layer_name = layer_name
+        self._wkts = []
+
+    def _add_feature(self, wkt):
+        self._wkts.append(wkt)
+
+    def flush(self):
+        """
+        Commit the features to the output shape file, if any.
+        """
+        if self._filepath is None:
+            return
 
         driver = ogr.GetDriverByName('ESRI Shapefile')
-        if os.path.exists(out_filename):
+        if os.path.exists(self._filepath):
             # Delete the detination file first
-            driver.DeleteDataSource(out_filename)
+            driver.DeleteDataSource(self._filepath)
 
-        self._ds = driver.CreateDataSource(out_filename)
-        self._layer = None
+        ds = driver.CreateDataSource(self._filepath)
+        layer = ds.CreateLayer(self._layer_name,
+                               geom_type=self._OGR_GEOM_TYPE)
 
-    def _add_feature(self, feature):
-        f = ogr.Feature(feature_def=self._layer.GetLayerDefn())
-        f.SetGeometryDirectly(feature)
-        self._layer.CreateFeature(f)
-        f.Destroy()
+        # Prevent the current locale from influencing how the WKT data is
+        # parsed by OGR.
+        try:
+            prev_locale = locale.getlocale(locale.LC_ALL)
+        except:
+            prev_locale = ''
+        locale.setlocale(locale.LC_ALL, "C")
 
-    def flush(self):
-        """
-        Commit the file to disk and prevent any further addition of
-        new longitude/latitude lines
-        """
-        self._ds.Destroy()
-        self._ds = None
+        try:
+            for wkt in self._wkts:
+                f = ogr.Feature(feature_def=layer.GetLayerDefn())
+                f.SetGeometryDirectly(ogr.CreateGeometryFromWkt(wkt))
+                layer.CreateFeature(f)
+                f.Destroy()
+        finally:
+            locale.setlocale(locale.LC_ALL, prev_locale)
+
+        ds.Destroy()
+
+    def get_datasource(self):
+        """Returns a Mapnik MemoryDatasource holding the features."""
+        ds = mapnik.MemoryDatasource()
+        context = mapnik.Context()
+        for i, wkt in enumerate(self._wkts):
+            f = mapnik.Feature(context, i + 1)
+            f.geometry = mapnik.Geometry.from_wkt(wkt)
+            ds.add_feature(f)
+        return ds
 
     def get_layer_name(self):
         """Returns the name of the layer used for this shape file."""
         return self._layer_name
 
     def get_filepath(self):
-        """Returns the path to the destination shape file."""
+        """Returns the path to the destination shape file, if any."""
         return self._filepath
 
     def __str__(self):
-        return "ShapeFile(%s)" % self._filepath
+        return "ShapeFile(%s)" % (self._filepath or self._layer_name)
 
 class LineShapeFile(_ShapeFile):
     """
     Shape file for LineString geometries.
     """
 
-    def __init__(self, bounding_box, out_filename, layer_name):
-        _ShapeFile.__init__(self, bounding_box, out_filename, layer_name)
-        self._layer = self._ds.CreateLayer(self._layer_name,
-                                           geom_type=ogr.wkbLineString)
-        LOG.debug('Created layer %s in LineShapeFile %s.' %
-                (layer_name, out_filename))
+    _OGR_GEOM_TYPE = ogr.wkbLineString
 
     def add_bounding_rectangle(self):
         self.add_horiz_line(self._bbox.get_top_left()[0])
@@ -109,20 +142,19 @@ class LineShapeFile(_ShapeFile):
         self.add_vert_line(self._bbox.get_bottom_right()[1])
         return self
 
+    def _add_line(self, x1, y1, x2, y2):
+        self._add_feature('LINESTRING (%r %r, %r %r)' % (x1, y1, x2, y2))
+
     def add_horiz_line(self, y):
         """Add a new latitude line at the given latitude."""
-        line = ogr.Geometry(type = ogr.wkbLineString)
-        line.AddPoint_2D(self._bbox.get_top_left()[1], y)
-        line.AddPoint_2D(self._bbox.get_bottom_right()[1], y)
-        self._add_feature(line)
+        self._add_line(self._bbox.get_top_left()[1], y,
+                       self._bbox.get_bottom_right()[1], y)
         return self
 
     def add_vert_line(self, x):
         """Add a new longitude line at the given longitude."""
-        line = ogr.Geometry(type = ogr.wkbLineString)
-        line.AddPoint_2D(x, self._bbox.get_top_left()[0])
-        line.AddPoint_2D(x, self._bbox.get_bottom_right()[0])
-        self._add_feature(line)
+        self._add_line(x, self._bbox.get_top_left()[0],
+                       x, self._bbox.get_bottom_right()[0])
         return self
 
 class BoxShapeFile(LineShapeFile):
@@ -131,27 +163,12 @@ class BoxShapeFile(LineShapeFile):
     """
 
     def add_box(self, box):
-        top_left, bottom_right = box.get_top_left(), box.get_bottom_right()
-
-        line = ogr.Geometry(type = ogr.wkbLineString)
-        line.AddPoint_2D(*list(reversed(top_left)))
-        line.AddPoint_2D(bottom_right[1], top_left[0])
-        self._add_feature(line)
-
-        line = ogr.Geometry(type = ogr.wkbLineString)
-        line.AddPoint_2D(bottom_right[1], top_left[0])
-        line.AddPoint_2D(*list(reversed(bottom_right)))
-        self._add_feature(line)
-
-        line = ogr.Geometry(type = ogr.wkbLineString)
-        line.AddPoint_2D(*list(reversed(bottom_right)))
-        line.AddPoint_2D(top_left[1], bottom_right[0])
-        self._add_feature(line)
-
-        line = ogr.Geometry(type = ogr.wkbLineString)
-        line.AddPoint_2D(top_left[1], bottom_right[0])
-        line.AddPoint_2D(*list(reversed(top_left)))
-        self._add_feature(line)
+        (top, left), (bottom, right) = box.get_top_left(), box.get_bottom_right()
+
+        self._add_line(left, top, right, top)
+        self._add_line(right, top, right, bottom)
+        self._add_line(right, bottom, left, bottom)
+        self._add_line(left, bottom, left, top)
         return self
 
 class PolyShapeFile(_ShapeFile):
@@ -159,29 +176,11 @@ class PolyShapeFile(_ShapeFile):
     Shape file for Polygon geometries.
     """
 
-    def __init__(self, bounding_box, out_filename, layer_name):
-        _ShapeFile.__init__(self, bounding_box, out_filename, layer_name)
-        self._layer = self._ds.CreateLayer(self._layer_name,
-                                           geom_type=ogr.wkbPolygon)
-        LOG.debug('Created layer %s in PolyShapeFile %s.' %
-                (layer_name, out_filename))
+    _OGR_GEOM_TYPE = ogr.wkbPolygon
 
     def add_shade_from_wkt(self, wkt):
         """Add the polygon feature to the shape file."""
-        # Prevent the current locale from influencing how the WKT data is
-        # parsed by OGR.
-        try:
-            prev_locale = locale.getlocale(locale.LC_ALL)
-        except:
-            prev_locale = ''
-        locale.setlocale(locale.LC_ALL, "C")
-
-        try:
-            poly = ogr.CreateGeometryFromWkt(wkt)
-        finally:
-            locale.setlocale(locale.LC_ALL, prev_locale)
-
-        self._add_feature(poly)
+        self._add_feature(wkt)
         return self
 
 if __name__ == "__main__":
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+# ocitysmap, city map and street index generator from OpenStreetMap data
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Local store of the open OpenStreetMap notes, used by the osm_notes
+overlay plugin instead of the notes API.
+
+The store is a SQLite file holding the open notes and an R-tree index of
+their positions. It is rebuilt from the planet notes dump
+(https://planet.openstreetmap.org/notes/) by sync-osm-notes.py.
+"""
+
+import bz2
+import logging
+import os
+import sqlite3
+import xml.etree.ElementTree as ET
+
+LOG = logging.getLogger('ocitysmap')
+
+# number of notes written to the store per transaction
+_SYNC_BATCH_SIZE = 10000
+
+_SCHEMA = """
+CREATE TABLE notes (id INTEGER PRIMARY KEY, lat REAL, lon REAL, text TEXT);
+CREATE VIRTUAL TABLE notes_index USING rtree(id, min_lon, max_lon,
+                                             min_lat, max_lat);
+"""
+
+def _open_notes(dump_path):
+    """Yield (id, lat, lon, text of the first comment) for each open note
+    of a planet notes dump, read one note at a time."""
+    opener = bz2.open if dump_path.endswith('.bz2') else open
+    with opener(dump_path, 'rb') as dump:
+        events = ET.iterparse(dump, events=('start', 'end'))
+        _, root = next(events)
+        for event, elem in events:
+            if event != 'end' or elem.tag != 'note':
+                continue
+            if elem.get('closed_at') is None:
+                comment = elem.find('comment')
+                yield (int(elem.get('id')),
+                       float(elem.get('lat')), float(elem.get('lon')),
+                       (comment.text or '') if comment is not None else '')
+            # drop the notes read so far from the tree
+            root.clear()
+
+def sync(dump_path, store_path):
+    """Rebuild the notes store from a planet notes dump.
+
+    The store is written next to store_path, then moved over it, so that
+    renderings running meanwhile keep reading the previous store.
+
+    Args:
+        dump_path (str): planet notes dump (.osn or .osn.bz2).
+        store_path (str): path of the SQLite notes store.
+
+    Returns the number of open notes stored.
+    """
+    tmp_path = store_path + '.new'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    db = sqlite3.connect(tmp_path)
+    try:
+        db.executescript(_SCHEMA)
+        count = 0
+        batch = []
+        for note in _open_notes(dump_path):
+            batch.append(note)
+            if len(batch) >= _SYNC_BATCH_SIZE:
+                count += _insert(db, batch)
+                batch = []
+        count += _insert(db, batch)
+    finally:
+        db.close()
+
+    os.replace(tmp_path, store_path)
+    LOG.info('Stored %d open notes in %s.' % (count, store_path))
+    return count
+
+def _insert(db, notes):
+    with db:
+        db.executemany('INSERT INTO notes VALUES (?, ?, ?, ?)', notes)
+        db.executemany('INSERT INTO notes_index VALUES (?, ?, ?, ?, ?)',
+                       [(id, lon, lon, lat, lat)
+                        for id, lat, lon, text in notes])
+    return len(notes)
+
+def query(store_path, bbox):
+    """Return the open notes within a bounding box.
+
+    Args:
+        store_path (str): path of the SQLite notes store.
+        bbox (coords.BoundingBox): the area to look into.
+
+    Returns a list of (lat, lon, text) tuples, sorted by note id. Raise
+    sqlite3.Error when the store cannot be read.
+    """
+    db = sqlite3.connect('file:%s?mode=ro' % store_path, uri=True)
+    try:
+        return db.execute("""
+            SELECT notes.lat, notes.lon, notes.text
+              FROM notes_index JOIN notes ON notes.id = notes_index.id
+             WHERE notes_index.min_lon <= ? AND notes_index.max_lon >= ?
+               AND notes_index.min_lat <= ? AND notes_index.max_lat >= ?
+             ORDER BY notes.id""",
+            (bbox.get_right(), bbox.get_left(),
+             bbox.get_top(), bbox.get_bottom())).fetchall()
+    finally:
+        db.close()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8; mode: Python -*-
+import bz2
+import os
+import shutil
+import tempfile
+import unittest
+from ocitysmap import notes_store
+
+DUMP = '''<?xml version="1.0"?>
+<osm-notes>
+<note id="1" lat="48.1" lon="2.1" created_at="2020-01-01T00:00:00Z">
+  <comment action="opened">First</comment>
+  <comment action="commented">Second</comment>
+</note>
+<note id="2" lat="48.2" lon="2.2" created_at="2020-01-01T00:00:00Z"
+      closed_at="2020-02-01T00:00:00Z">
+  <comment action="opened">Closed</comment>
+</note>
+<note id="3" lat="48.3" lon="2.3" created_at="2020-01-01T00:00:00Z">
+  <comment action="opened"></comment>
+</note>
+<note id="4" lat="10.0" lon="20.0" created_at="2020-01-01T00:00:00Z">
+  <comment action="opened">Far away</comment>
+</note>
+</osm-notes>
+'''
+
+class _BoundingBox:
+    def __init__(self, left, bottom, right, top):
+        self._edges = (left, bottom, right, top)
+
+    def get_left(self):
+        return self._edges[0]
+
+    def get_bottom(self):
+        return self._edges[1]
+
+    def get_right(self):
+        return self._edges[2]
+
+    def get_top(self):
+        return self._edges[3]
+
+class notes_store_test(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = os.path.join(self.directory, 'notes.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _dump(self, name, opener=open):
+        path = os.path.join(self.directory, name)
+        with opener(path, 'wt') as fp:
+            fp.write(DUMP)
+        return path
+
+    def test_sync_and_query(self):
+        self.assertEqual(notes_store.sync(self._dump('notes.osn'), self.store),
+                         3)
+        self.assertFalse(os.path.exists(self.store + '.new'))
+
+        self.assertEqual(notes_store.query(self.store,
+                                           _BoundingBox(2.0, 48.0, 2.5, 48.5)),
+                         [(48.1, 2.1, 'First'), (48.3, 2.3, '')])
+        self.assertEqual(notes_store.query(self.store,
+                                           _BoundingBox(2.15, 48.0, 2.5, 48.5)),
+                         [(48.3, 2.3, '')])
+        self.assertEqual(notes_store.query(self.store,
+                                           _BoundingBox(-1.0, -1.0, 1.0, 1.0)),
+                         [])
+
+    def test_sync_replaces_store(self):
+        with open(self.store, 'w') as fp:
+            fp.write('not a notes store')
+        self.assertEqual(notes_store.sync(self._dump('notes.osn.bz2', bz2.open),
+                                          self.store),
+                         3)
+        self.assertEqual(notes_store.query(self.store,
+                                           _BoundingBox(19.0, 9.0, 21.0, 11.0)),
+                         [(10.0, 20.0, 'Far away')])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -23,25 +23,64 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from . import Stylesheet
+from .sqlite_layer import SqliteLayer
+from .. import coords
 
+import logging
+import numpy
 import os
+import shapely.geometry
+import sqlite3
 from string import Template
-import gpxpy
-import gpxpy.gpx
-import codecs
+import xml.etree.ElementTree as ET
+
+LOG = logging.getLogger('ocitysmap')
+
+# (GPX file, database, tolerance) -> (annotation, bbox) of the GPX files
+# preprocessed, their database being reused by the stylesheets of the
+# other output formats of the rendering
+_preprocessed = {}
+_PREPROCESSED_CACHE_SIZE = 16
+
+def _local_name(tag):
+    # tag name without its GPX 1.0 / 1.1 namespace
+    return tag.rsplit('}', 1)[-1]
 
 class GpxStylesheet(Stylesheet):
-    def __init__(self, gpx_file, tmpdir):
+    # resolution the tracks are simplified to, in dots per inch of paper
+    SIMPLIFY_DPI = 300
+
+    # vertices of the track pieces written to the database; short pieces
+    # let mapnik leave out what is outside of the map
+    PIECE_VERTICES = 256
+
+    # elements removed from the GPX tree once read
+    _DROPPED_ELEMENTS = ('trkpt', 'trkseg', 'trk', 'rtept', 'rte', 'wpt')
+
+    def __init__(self, gpx_file, tmpdir, meters_per_pt=None):
+        """
+        Args:
+           gpx_file (str): path of the GPX file.
+           tmpdir (str): directory of the files of the job.
+           meters_per_pt (float): Web Mercator meters per pt of paper at
+               the scale of the map, to simplify the tracks to. None keeps
+               all the track points.
+        """
         super().__init__()
 
-        gpx_fp = codecs.open(gpx_file, 'r', 'utf-8-sig')
-        gpx = gpxpy.parse(gpx_fp)
+        db_filename = os.path.join(tmpdir, 'gpx.sqlite')
+        tolerance = None
+        if meters_per_pt is not None:
+            tolerance = meters_per_pt * 72.0 / self.SIMPLIFY_DPI
+        key = (os.path.realpath(gpx_file), db_filename, tolerance)
+        if key in _preprocessed and os.path.exists(db_filename):
+            self.annotation, self.bbox = _preprocessed[key]
+        else:
+            self.gpx_preprocess(gpx_file, db_filename, tolerance)
+            if len(_preprocessed) >= _PREPROCESSED_CACHE_SIZE:
+                del _preprocessed[next(iter(_preprocessed))]
+            _preprocessed[key] = (self.annotation, self.bbox)
 
-        if gpx.copyright_year or gpx.copyright_author or gpx.copyright_license:
-            self.annotation = "GPX track © %s %s %s" % (gpx.copyright_year, gpx.copyright_author, gpx.copyright_license)
-        
-        gpx_fp.close()
-        
         template_dir = os.path.realpath(
             os.path.join(
                 os.path.dirname(__file__),
@@ -55,11 +94,110 @@ class GpxStylesheet(Stylesheet):
             tmpstyle = Template(style_template.read())
             tmpfile.write(
                 tmpstyle.substitute(
-                    gpxfile = gpx_file,
-                    svgdir = template_dir
+                    gpxfile = db_filename,
+                    svgdir = template_dir,
+                    extent = self._extent()
                 ))
 
         tmpfile.close()
 
         self.name = "GPX overlay"
         self.path = GPX_filename
+
+    def _extent(self):
+        # extent of the layers, given to mapnik as some may be empty
+        if self.bbox is None:
+            return '-180,-90,180,90'
+        return '%f,%f,%f,%f' % (self.bbox.get_left(), self.bbox.get_bottom(),
+                                self.bbox.get_right(), self.bbox.get_top())
+
+    def _add_segment(self, tracks, lons, lats, tolerance):
+        """Simplify a track segment and add it to the tracks layer, in
+        pieces of at most PIECE_VERTICES vertices."""
+        if len(lons) < 2:
+            return
+
+        if tolerance is not None:
+            xs, ys = coords.mercator_forward(lons, lats)
+            line = shapely.geometry.LineString(numpy.column_stack((xs, ys)))
+            xs, ys = numpy.asarray(line.simplify(tolerance, preserve_topology=False).coords).T
+            lons, lats = coords.mercator_inverse(xs, ys)
+
+        points = numpy.column_stack((lons, lats))
+        # consecutive pieces share a vertex
+        for start in range(0, len(points) - 1, self.PIECE_VERTICES - 1):
+            tracks.add(shapely.geometry.LineString(
+                points[start:start + self.PIECE_VERTICES]))
+
+    def gpx_preprocess(self, gpx_file, db_filename, tolerance=None):
+        """Read the GPX file in one streaming pass: set the copyright
+        annotation and the bounding box of the stylesheet, and write the
+        tracks and waypoints to the SQLite database read by the mapnik
+        style of templates/gpx.
+
+        Args:
+           gpx_file (str): path of the GPX file.
+           db_filename (str): path of the database to create.
+           tolerance (float): Web Mercator meters the simplified tracks
+               may deviate from the track points, None to keep them all.
+        """
+        db = sqlite3.connect(db_filename)
+        tracks = SqliteLayer(db, 'tracks', [])
+        waypoints = SqliteLayer(db, 'waypoints', [('name', 'TEXT')])
+
+        min_lat, min_lon, max_lat, max_lon = 90, 180, -90, -180
+        n_points = 0
+        lons = []
+        lats = []
+        parents = []
+
+        for event, elem in ET.iterparse(gpx_file, events=('start', 'end')):
+            if event == 'start':
+                parents.append(elem)
+                continue
+            parents.pop()
+
+            name = _local_name(elem.tag)
+            if 'lat' in elem.attrib:
+                lat = float(elem.get('lat'))
+                lon = float(elem.get('lon'))
+                min_lat = min(min_lat, lat)
+                min_lon = min(min_lon, lon)
+                max_lat = max(max_lat, lat)
+                max_lon = max(max_lon, lon)
+                n_points += 1
+
+                if name == 'trkpt':
+                    lons.append(lon)
+                    lats.append(lat)
+                elif name == 'wpt':
+                    wpt_name = ''
+                    for child in elem:
+                        if _local_name(child.tag) == 'name':
+                            wpt_name = child.text or ''
+                    waypoints.add(shapely.geometry.Point(lon, lat),
+                                  {'name': wpt_name})
+            elif name == 'trkseg':
+                self._add_segment(tracks, lons, lats, tolerance)
+                lons = []
+                lats = []
+            elif name == 'copyright':
+                fields = dict((_local_name(child.tag), child.text or '')
+                              for child in elem)
+                self.annotation = "GPX track © %s %s %s" % (
+                    fields.get('year', ''), elem.get('author', ''),
+                    fields.get('license', ''))
+
+            # the points and tracks read are not needed any more
+            if parents and name in self._DROPPED_ELEMENTS:
+                del parents[-1][-1]
+
+        tracks.flush()
+        waypoints.flush()
+        db.close()
+
+        self.bbox = None
+        if n_points:
+            self.bbox = coords.BoundingBox(min_lat, min_lon, max_lat, max_lon)
+        LOG.debug("GPX: %d points, %d track pieces and %d waypoints written."
+                  % (n_points, tracks.count, waypoints.count))
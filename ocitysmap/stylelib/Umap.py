@@ -22,14 +22,15 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from . import Stylesheet
+from . import Stylesheet, icon_cache
+from .sqlite_layer import SqliteLayer
 
 import os
 import json
 import re
-import urllib3
-import tempfile
 import logging
+import shapely.geometry
+import sqlite3
 from string import Template
 import codecs
 
@@ -37,6 +38,16 @@ LOG = logging.getLogger('ocitysmap')
 
 
 class UmapStylesheet(Stylesheet):
+    # properties of the converted features, read by templates/umap, with
+    # their SQLite type
+    FEATURE_COLUMNS = [
+        ('name', 'TEXT'), ('color', 'TEXT'), ('opacity', 'REAL'),
+        ('fillColor', 'TEXT'), ('fillOpacity', 'REAL'), ('weight', 'REAL'),
+        ('dashArray', 'TEXT'), ('fill', 'TEXT'), ('stroke', 'TEXT'),
+        ('iconClass', 'TEXT'), ('iconUrl', 'TEXT'), ('iconFill', 'TEXT'),
+        ('iconOffset', 'REAL'),
+    ]
+
     def __init__(self, umap_file, tmpdir):
         super().__init__()
 
@@ -45,10 +56,8 @@ class UmapStylesheet(Stylesheet):
                 os.path.dirname(__file__),
                 '../../templates/umap'))
 
-        json_filename = os.path.join(tmpdir, 'geo.json')
-        json_tmpfile = open(json_filename, 'w')
-        json_tmpfile.write(self.umap_preprocess(umap_file, tmpdir))
-        json_tmpfile.close()
+        db_filename = os.path.join(tmpdir, 'umap.sqlite')
+        extent = self.umap_preprocess(umap_file, db_filename)
 
         template_file = os.path.join(template_dir, 'template.xml')
         style_filename = os.path.join(tmpdir, 'umap_style.xml')
@@ -58,8 +67,9 @@ class UmapStylesheet(Stylesheet):
             tmpstyle = Template(style_template.read())
             style_tmpfile.write(
                 tmpstyle.substitute(
-                    umapfile = json_filename,
-                    basedir  = template_dir
+                    umapfile = db_filename,
+                    basedir  = template_dir,
+                    extent   = extent
                 ))
 
         style_tmpfile.close()
@@ -68,7 +78,16 @@ class UmapStylesheet(Stylesheet):
         self.path = style_filename
 
 
-    def umap_preprocess(self, umap_file, tmpdir):
+    def umap_preprocess(self, umap_file, db_filename):
+        """Convert the features of an uMap export into the SQLite database
+        read by the mapnik style of templates/umap.
+
+        Args:
+           umap_file (str): path of the uMap export.
+           db_filename (str): path of the database to create.
+
+        Returns the extent of the features, for the datasource.
+        """
         umap_defaults = {
             'color'      :   'blue',
             'opacity'    :      0.5,
@@ -95,8 +114,6 @@ class UmapStylesheet(Stylesheet):
                 os.path.dirname(__file__),
                 '../../templates/umap/maki/icons'))
 
-        http = urllib3.PoolManager()
-
         fp = codecs.open(umap_file, 'r', 'utf-8-sig')
 
         umap = json.load(fp)
@@ -116,9 +133,12 @@ class UmapStylesheet(Stylesheet):
 
         layers = umap['layers']
 
-        new_features = []
+        db = sqlite3.connect(db_filename)
+        features = SqliteLayer(db, 'features', self.FEATURE_COLUMNS)
 
-        icon_cache = {}
+        # URLs of the icons to fetch, stored as is in the database until
+        # they are fetched
+        remote_icons = set()
 
         for layer in layers:
             for feature in layer['features']:
@@ -164,39 +184,33 @@ class UmapStylesheet(Stylesheet):
                             else:
                                 new_props['iconFill'] = 'white'
                         else:
-                            if iconUrl in icon_cache:
-                                new_props['iconUrl'] = icon_cache[iconUrl]
-                            else:
-                                LOG.info("Umap: fetching icon from URL: %s" % iconUrl)
-                                try:
-                                    response = http.request('GET', iconUrl)
-                                    iconFile = tempfile.NamedTemporaryFile(suffix='.png', delete=False, mode='wb', dir=tmpdir)
-                                    iconFile.write(response.data)
-                                    iconFile.close()
-
-                                    iconPath = os.path.realpath(iconFile.name)
-                                except:
-                                    iconPath = icon_dir + '/circle-15.svg'
-
-                                new_props['iconUrl'] = iconPath
-                                icon_cache[iconUrl] = iconPath
+                            # fetched below, all at once
+                            new_props['iconUrl'] = iconUrl
+                            remote_icons.add(iconUrl)
 
                     try:
-                        new_props['offset'] = marker_offsets[iconClass]
+                        new_props['iconOffset'] = marker_offsets[iconClass]
                     except:
                         pass
 
                 new_props['weight'] = float(new_props['weight']) / 4
 
-                new_features.append({
-                    'type'       : 'Feature', 
-                    'properties' : new_props, 
-                    'geometry'   : feature['geometry']
-                })
-
-        new_umap = {
-            'type'     : 'FeatureCollection', 
-            'features' : new_features
-        }
-
-        return json.dumps(new_umap, indent=2)
+                try:
+                    geometry = shapely.geometry.shape(feature['geometry'])
+                except Exception as e:
+                    LOG.warning("Umap: skipping invalid geometry: %s" % e)
+                    continue
+                features.add(geometry, new_props)
+
+        features.flush()
+        extent = features.extent()
+
+        icon_paths = icon_cache.get_default_cache().get_icons(
+            remote_icons, icon_dir + '/circle-15.svg',
+            os.path.join(os.path.dirname(db_filename), 'umap_icons'))
+        with db:
+            db.executemany('UPDATE features SET iconUrl = ? WHERE iconUrl = ?',
+                           [(path, url) for url, path in icon_paths.items()])
+        db.close()
+
+        return extent
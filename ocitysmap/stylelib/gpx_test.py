@@ -0,0 +1,92 @@
+# -*- coding: utf-8; mode: Python -*-
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import shapely.wkb
+from ocitysmap.stylelib import Gpx
+
+def _trkseg(points):
+    return '<trkseg>%s</trkseg>' % ''.join(
+        '<trkpt lat="%f" lon="%f"><ele>10</ele></trkpt>' % point
+        for point in points)
+
+def _gpx_file(directory, body):
+    path = os.path.join(directory, 'track.gpx')
+    with open(path, 'w') as fp:
+        fp.write('<?xml version="1.0" encoding="UTF-8"?>'
+                 '<gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1">'
+                 '<metadata><copyright author="Jane Doe">'
+                 '<year>2020</year><license>CC-BY-SA</license>'
+                 '</copyright></metadata>%s</gpx>' % body)
+    return path
+
+class gpx_test(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _preprocess(self, body, tolerance):
+        gpx = Gpx.GpxStylesheet.__new__(Gpx.GpxStylesheet)
+        gpx.annotation = ''
+        db_filename = os.path.join(self.directory, 'gpx.sqlite')
+        gpx.gpx_preprocess(_gpx_file(self.directory, body), db_filename,
+                           tolerance)
+
+        db = sqlite3.connect(db_filename)
+        tracks = [shapely.wkb.loads(row[0]) for row in
+                  db.execute('SELECT geometry FROM tracks ORDER BY id')]
+        waypoints = db.execute('SELECT name FROM waypoints').fetchall()
+        db.close()
+        return gpx, tracks, waypoints
+
+    def test_streaming_pass(self):
+        straight = [(45.0, 5.0 + 0.0001 * n) for n in range(100)]
+        body = ('<wpt lat="44.5" lon="4.5"><name>Start</name></wpt>'
+                '<trk>%s%s</trk>' % (_trkseg(straight),
+                                     _trkseg([(46.0, 6.0)])))
+        gpx, tracks, waypoints = self._preprocess(body, 1.0)
+
+        self.assertEqual(gpx.annotation, 'GPX track © 2020 Jane Doe CC-BY-SA')
+        self.assertEqual(gpx.bbox.get_top_left(), (46.0, 4.5))
+        self.assertEqual(gpx.bbox.get_bottom_right(), (44.5, 6.0))
+        self.assertEqual(waypoints, [('Start',)])
+
+        # the points of the straight segment are dropped but its ends, the
+        # single point segment is left out
+        self.assertEqual(len(tracks), 1)
+        self.assertEqual(len(tracks[0].coords), 2)
+        self.assertAlmostEqual(tracks[0].coords[0][0], straight[0][1])
+        self.assertAlmostEqual(tracks[0].coords[-1][0], straight[-1][1])
+
+    def test_pieces(self):
+        zigzag = [(45.0 + 0.01 * (n % 2), 5.0 + 0.01 * n) for n in range(600)]
+        gpx, tracks, waypoints = self._preprocess(
+            '<trk>%s</trk>' % _trkseg(zigzag), None)
+
+        piece_vertices = Gpx.GpxStylesheet.PIECE_VERTICES
+        self.assertEqual([len(track.coords) for track in tracks],
+                         [piece_vertices, piece_vertices,
+                          600 - 2 * (piece_vertices - 1)])
+        # consecutive pieces share a vertex
+        for previous, track in zip(tracks, tracks[1:]):
+            self.assertEqual(previous.coords[-1], track.coords[0])
+        self.assertEqual(waypoints, [])
+
+    def test_reuse(self):
+        gpx_file = _gpx_file(self.directory, '<trk>%s</trk>'
+                             % _trkseg([(45.0, 5.0), (45.5, 5.5)]))
+        first = Gpx.GpxStylesheet(gpx_file, self.directory, 1.0)
+
+        # the stylesheets of the other output formats reuse the database
+        os.remove(gpx_file)
+        second = Gpx.GpxStylesheet(gpx_file, self.directory, 1.0)
+        self.assertEqual(second.annotation, first.annotation)
+        self.assertIs(second.bbox, first.bbox)
+        self.assertEqual(second.path, first.path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+
+# ocitysmap, city map and street index generator from OpenStreetMap data
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Persistent cache of the marker icons of the uMap overlays, shared by all
+the jobs of a host.
+
+The icons are stored under the hash of their content in the objects/
+directory of the cache, and the urls/ directory maps the hash of each
+icon URL to its icon file. The least recently used icons are removed
+when the cache grows over its size limit. Files are written atomically,
+so several rendering processes can share a cache directory, and the jobs
+get links to the icons they use, which another process may evict before
+mapnik reads them.
+"""
+
+import concurrent.futures
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import urllib.parse
+import urllib3
+
+LOG = logging.getLogger('ocitysmap')
+
+DEFAULT_DIRECTORY = os.path.join(tempfile.gettempdir(), 'ocitysmap-icons')
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+# seconds to fetch an icon
+DEFAULT_TIMEOUT = 5.0
+# icons fetched at the same time
+FETCH_THREADS = 8
+
+ICON_SUFFIXES = ['.png', '.svg', '.jpg', '.jpeg', '.gif']
+
+class IconCache:
+    """A directory of icons downloaded from their URL."""
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES,
+                 timeout=DEFAULT_TIMEOUT):
+        """
+        Args:
+           directory (str): the cache directory, created when needed.
+           max_bytes (int): size of the icons kept in the cache.
+           timeout (float): seconds to wait for an icon.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._objects_dir = os.path.join(directory, 'objects')
+        self._urls_dir = os.path.join(directory, 'urls')
+        os.makedirs(self._objects_dir, exist_ok=True)
+        os.makedirs(self._urls_dir, exist_ok=True)
+
+        self._http = urllib3.PoolManager(
+            maxsize=FETCH_THREADS, retries=False,
+            timeout=urllib3.Timeout(total=timeout))
+        self._evict_lock = threading.Lock()
+
+    def _url_entry(self, url):
+        return os.path.join(self._urls_dir,
+                            hashlib.sha256(url.encode('utf-8')).hexdigest())
+
+    @staticmethod
+    def _write_file(path, data):
+        # write a file atomically, for the other processes to never see
+        # it partially written
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                        prefix='.tmp')
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(data)
+        os.replace(tmp_path, path)
+
+    def lookup(self, url):
+        """Return the path of the cached icon of an URL, or None."""
+        try:
+            with open(self._url_entry(url), 'r') as fp:
+                path = os.path.join(self._objects_dir, fp.read().strip())
+            # the modification time orders the eviction
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def _store(self, url, data):
+        suffix = os.path.splitext(urllib.parse.urlparse(url).path)[1].lower()
+        if suffix not in ICON_SUFFIXES:
+            suffix = '.png'
+        name = hashlib.sha256(data).hexdigest() + suffix
+
+        path = os.path.join(self._objects_dir, name)
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            self._write_file(path, data)
+        self._write_file(self._url_entry(url), name.encode('ascii'))
+        return path
+
+    def _fetch(self, url):
+        # return the path of the icon downloaded from url, or None
+        LOG.info("Umap: fetching icon from URL: %s" % url)
+        try:
+            response = self._http.request('GET', url)
+        except (urllib3.exceptions.HTTPError, ValueError) as e:
+            LOG.warning("Umap: cannot fetch icon %s: %s" % (url, e))
+            return None
+        if response.status != 200 or not response.data:
+            LOG.warning("Umap: cannot fetch icon %s: HTTP status %d"
+                        % (url, response.status))
+            return None
+        return self._store(url, response.data)
+
+    @staticmethod
+    def _keep(path, directory):
+        # return the path of a link to, or else a copy of, a cached icon
+        # in directory; None when the icon was evicted meanwhile
+        kept = os.path.join(directory, os.path.basename(path))
+        if os.path.exists(kept):
+            return kept
+        try:
+            os.link(path, kept)
+        except FileNotFoundError:
+            return None
+        except OSError:
+            # another file system
+            try:
+                shutil.copyfile(path, kept)
+            except FileNotFoundError:
+                return None
+        return kept
+
+    def get_icons(self, urls, fallback, directory=None):
+        """Return the local paths of the icons of some URLs.
+
+        The icons that are not in the cache yet are fetched concurrently.
+
+        Args:
+           urls (iterable): the icon URLs.
+           fallback (str): path of the icon used for the URLs that cannot
+               be fetched.
+           directory (str): directory of the job, created when needed. The
+               returned paths are links to the cached icons in it, which
+               stay valid when the cache evicts the icons.
+
+        Returns a dict URL -> icon path.
+        """
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+        paths = {}
+        missing = []
+        for url in set(urls):
+            path = self.lookup(url)
+            if path is not None and directory is not None:
+                path = self._keep(path, directory)
+            if path is None:
+                missing.append(url)
+            else:
+                paths[url] = path
+
+        if missing:
+            with concurrent.futures.ThreadPoolExecutor(
+                    min(FETCH_THREADS, len(missing))) as executor:
+                for url, path in zip(missing, executor.map(self._fetch, missing)):
+                    if path is not None and directory is not None:
+                        path = self._keep(path, directory)
+                    paths[url] = path or fallback
+            self.evict()
+
+        return paths
+
+    def evict(self):
+        """Remove the least recently used icons until the cache fits in its
+        size limit."""
+        with self._evict_lock:
+            objects = []
+            for entry in os.scandir(self._objects_dir):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                objects.append((st.st_mtime, st.st_size, entry.name))
+
+            total = sum(size for mtime, size, name in objects)
+            if total <= self.max_bytes:
+                return
+
+            removed = set()
+            for mtime, size, name in sorted(objects):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self._objects_dir, name))
+                except OSError:
+                    pass
+                removed.add(name)
+                total -= size
+
+            # drop the URLs of the removed icons
+            for entry in os.scandir(self._urls_dir):
+                try:
+                    with open(entry.path, 'r') as fp:
+                        if fp.read().strip() in removed:
+                            os.remove(entry.path)
+                except OSError:
+                    pass
+
+            LOG.debug("Umap: evicted %d icons from %s."
+                      % (len(removed), self.directory))
+
+_default_cache = None
+_default_settings = (DEFAULT_DIRECTORY, DEFAULT_MAX_BYTES, DEFAULT_TIMEOUT)
+_default_lock = threading.Lock()
+
+def configure(directory=DEFAULT_DIRECTORY, max_bytes=DEFAULT_MAX_BYTES,
+              timeout=DEFAULT_TIMEOUT):
+    """Set the settings of the cache returned by get_default_cache()."""
+    global _default_cache, _default_settings
+    with _default_lock:
+        if (directory, max_bytes, timeout) != _default_settings:
+            _default_settings = (directory, max_bytes, timeout)
+            _default_cache = None
+
+def get_default_cache():
+    """Return the icon cache of the process, as set by configure()."""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = IconCache(*_default_settings)
+        return _default_cache
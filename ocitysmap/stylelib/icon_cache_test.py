@@ -0,0 +1,99 @@
+# -*- coding: utf-8; mode: Python -*-
+import http.server
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from ocitysmap.stylelib import icon_cache
+
+ICONS = {
+    '/icons/a.png': b'icon a',
+    '/icons/b.svg': b'<svg/>',
+    '/icons/same-as-a.png': b'icon a',
+}
+
+class _IconHandler(http.server.BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        _IconHandler.requests.append(self.path)
+        data = ICONS.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class icon_cache_test(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                     _IconHandler)
+        cls.base_url = 'http://127.0.0.1:%d' % cls.server.server_port
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        _IconHandler.requests = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_fetch_once(self):
+        urls = [self.base_url + path for path in ICONS]
+        paths = icon_cache.IconCache(self.directory).get_icons(urls, 'fallback')
+        self.assertEqual(sorted(_IconHandler.requests), sorted(ICONS))
+        for path in ICONS:
+            with open(paths[self.base_url + path], 'rb') as fp:
+                self.assertEqual(fp.read(), ICONS[path])
+        self.assertTrue(paths[self.base_url + '/icons/b.svg'].endswith('.svg'))
+        # content addressed: the same icon is stored once
+        self.assertEqual(paths[self.base_url + '/icons/a.png'],
+                         paths[self.base_url + '/icons/same-as-a.png'])
+
+        # another cache on the same directory, as another job would use
+        again = icon_cache.IconCache(self.directory).get_icons(urls, 'fallback')
+        self.assertEqual(again, paths)
+        self.assertEqual(len(_IconHandler.requests), len(ICONS))
+
+    def test_fallback(self):
+        closed_port = 'http://127.0.0.1:1/icon.png'
+        missing = self.base_url + '/icons/missing.png'
+        paths = icon_cache.IconCache(self.directory, timeout=1).get_icons(
+            [missing, closed_port], 'fallback')
+        self.assertEqual(paths, {missing: 'fallback', closed_port: 'fallback'})
+
+    def test_eviction(self):
+        cache = icon_cache.IconCache(self.directory, max_bytes=10)
+        a = self.base_url + '/icons/a.png'
+        b = self.base_url + '/icons/b.svg'
+        cache.get_icons([a], 'fallback')
+        os.utime(cache.lookup(a), (0, 0))
+        cache.get_icons([b], 'fallback')
+        self.assertIsNone(cache.lookup(a))
+        self.assertIsNotNone(cache.lookup(b))
+
+    def test_job_directory(self):
+        cache = icon_cache.IconCache(self.directory, max_bytes=0)
+        job_directory = os.path.join(self.directory, 'job')
+        a = self.base_url + '/icons/a.png'
+        paths = cache.get_icons([a], 'fallback', job_directory)
+        # the icon of the job outlives its eviction from the cache
+        self.assertIsNone(cache.lookup(a))
+        self.assertEqual(os.path.dirname(paths[a]), job_directory)
+        with open(paths[a], 'rb') as fp:
+            self.assertEqual(fp.read(), ICONS['/icons/a.png'])
+
+if __name__ == '__main__':
+    unittest.main()
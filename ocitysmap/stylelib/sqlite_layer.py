@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+# ocitysmap, city map and street index generator from OpenStreetMap data
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Layers of the overlays converted from uploaded files (uMap, GPX), written
+to SQLite tables read by the sqlite datasource of mapnik:
+
+    <Parameter name="type">sqlite</Parameter>
+    <Parameter name="table">...</Parameter>
+    <Parameter name="key_field">id</Parameter>
+    <Parameter name="geometry_field">geometry</Parameter>
+    <Parameter name="wkb_format">generic</Parameter>
+
+The geometries are stored as WKB, along with the R-tree index mapnik
+uses to only read the features within the extent of the map.
+"""
+
+import logging
+
+LOG = logging.getLogger('ocitysmap')
+
+class SqliteLayer:
+    """A table of features, written in batches."""
+
+    # features written to the database at once
+    WRITE_BATCH_SIZE = 1000
+
+    def __init__(self, db, table, columns):
+        """Create the table and its index.
+
+        Args:
+           db (sqlite3.Connection): the database of the overlay.
+           table (str): name of the table.
+           columns (list): (name, SQLite type) of the feature properties.
+        """
+        self._db = db
+        self._table = table
+        self._columns = columns
+        self._pending = []
+        self.count = 0
+
+        db.execute('CREATE TABLE %s (%s)'
+                   % (table, ', '.join(['id INTEGER PRIMARY KEY', 'geometry BLOB']
+                                       + ['%s %s' % column for column in columns])))
+        db.execute('CREATE VIRTUAL TABLE idx_%s_geometry '
+                   'USING rtree(pkid, xmin, xmax, ymin, ymax)' % table)
+
+    def add(self, geometry, props={}):
+        """Add a feature to the table.
+
+        Args:
+           geometry (shapely geometry): geometry of the feature, in WGS84
+               coordinates. Empty geometries are left out.
+           props (dict): properties of the feature, by column name.
+        """
+        if geometry.is_empty:
+            return
+        self._pending.append((geometry, props))
+        if len(self._pending) >= self.WRITE_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Write the features added so far."""
+        if not self._pending:
+            return
+
+        rows = []
+        boxes = []
+        for n, (geometry, props) in enumerate(self._pending, self.count + 1):
+            rows.append([n, geometry.wkb]
+                        + [props.get(name) for name, _ in self._columns])
+            minx, miny, maxx, maxy = geometry.bounds
+            boxes.append((n, minx, maxx, miny, maxy))
+
+        with self._db:
+            self._db.executemany('INSERT INTO %s VALUES (%s)'
+                                 % (self._table, ', '.join('?' * len(rows[0]))),
+                                 rows)
+            self._db.executemany('INSERT INTO idx_%s_geometry VALUES (?, ?, ?, ?, ?)'
+                                 % self._table, boxes)
+
+        self.count += len(rows)
+        self._pending = []
+
+    def extent(self):
+        """Return the extent of the features written, as the extent
+        parameter of the mapnik datasource: the whole world when there is
+        none, for mapnik not to fail on an empty index."""
+        row = self._db.execute(
+            'SELECT min(xmin), min(ymin), max(xmax), max(ymax) '
+            'FROM idx_%s_geometry' % self._table).fetchone()
+        if row[0] is None:
+            return '-180,-90,180,90'
+        return '%f,%f,%f,%f' % row
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8; mode: Python -*-
+
+# ocitysmap, city map and street index generator from OpenStreetMap data
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Rebuild the local OSM notes store of the osm_notes overlay from a planet
+notes dump, typically from a daily cron job:
+
+    wget https://planet.openstreetmap.org/notes/planet-notes-latest.osn.bz2
+    ./sync-osm-notes.py planet-notes-latest.osn.bz2 /path/to/notes.sqlite
+"""
+
+import logging
+import optparse
+import sys
+
+from ocitysmap import notes_store
+
+LOG = logging.getLogger('ocitysmap')
+
+def main():
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s')
+
+    usage = '%prog <planet notes dump> <notes store>'
+    parser = optparse.OptionParser(usage=usage)
+    (options, args) = parser.parse_args()
+    if len(args) != 2:
+        parser.print_help()
+        return 1
+
+    notes_store.sync(args[0], args[1])
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())